@@ -0,0 +1,307 @@
+import os
+import re
+import sys
+import json
+import time
+import glob
+import math
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from server.utils.cache_backend import CacheBackend, create_cache
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.enrich import batched, map_fields, read_feed, to_product
+from server.utils.fused_enricher import FusedEnricher
+from server.utils.llm_client import reset_clients, set_clients
+from server.utils.llm_scheduler import LLMScheduler
+from server.utils.llm_stub import AsyncStubClient, LatencyModel, StubClient
+from server.utils.product_id_enricher import ProductIDEnricher
+
+DEFAULT_FEEDS_DIR = os.path.join('attached_assets', 'test_feeds')
+DEFAULT_SIZES = (50, 100, 500)
+
+_FEED_RE = re.compile(r'^(?P<category>.+)_(?P<size>\d+)rows\.csv$')
+
+_MISSING = object()
+
+class _CountingCache(CacheBackend):
+    """Cache wrapper counting lookup hits and misses."""
+
+    def __init__(self, inner: CacheBackend):
+        self.inner = inner
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.inner.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.inner.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.inner.delete(key)
+
+    def clear(self) -> None:
+        self.inner.clear()
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of values (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB (None where unsupported).
+
+    This is the process-wide high-water mark, so it only describes one feed
+    when the feed ran in its own process (see run_feed_isolated).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def find_feeds(feeds_dir: str, sizes=DEFAULT_SIZES, categories: Optional[List[str]] = None) -> List[Dict]:
+    """Benchmark feeds named <category>_<rows>rows.csv, ordered by category then size."""
+    feeds = []
+    for path in glob.glob(os.path.join(feeds_dir, '*rows.csv')):
+        match = _FEED_RE.match(os.path.basename(path))
+        if not match:
+            continue
+        size = int(match.group('size'))
+        if size in sizes and (not categories or match.group('category') in categories):
+            feeds.append({'path': path, 'category': match.group('category'), 'size': size})
+    return sorted(feeds, key=lambda feed: (feed['category'], feed['size']))
+
+def _load_products(path: str) -> List[Dict]:
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as handle:
+        headers, _, rows = read_feed(handle)
+        field_map = map_fields(headers)
+        return [to_product(row, field_map) for row in rows]
+
+def run_feed(feed: Dict, latency: LatencyModel, mode: str = 'row', batch_size: int = 100,
+             marketplace: str = 'walmart', packed: bool = False, fused: bool = False) -> Dict:
+    """
+    Benchmark one feed with fresh in-memory caches and stub clients.
+
+    Args:
+        feed: Entry from find_feeds
+        latency: Stub LLM latency model
+        mode: 'row' times each row through the interactive API, 'batch' times batch calls
+        batch_size: Rows per batch in batch mode
+        marketplace: Target marketplace taxonomy
+        packed: Use packed category prompts in batch mode
+        fused: One completion per product for category and identifiers
+
+    Returns:
+        Dict: Throughput, latency percentiles, LLM calls, cache hit rate and peak RSS of the process
+    """
+    products = _load_products(feed['path'])
+
+    client, async_client = StubClient(latency), AsyncStubClient(latency)
+    set_clients(client, async_client)
+    # The stub is the only limit being measured; keep admission control out of the way
+    scheduler = LLMScheduler(requests_per_minute=1e9, tokens_per_minute=1e12)
+    category_cache = _CountingCache(create_cache('category', path=':memory:'))
+    id_cache = _CountingCache(create_cache('product_ids', path=':memory:'))
+    guesser = CategoryGuesser(cache=category_cache, scheduler=scheduler)
+    enricher = ProductIDEnricher(cache=id_cache, scheduler=scheduler)
+    fused_enricher = FusedEnricher(guesser, enricher, scheduler=scheduler) if fused else None
+
+    latencies = []
+    tiers = Counter()
+    started = time.perf_counter()
+    try:
+        if mode == 'batch':
+            for batch in batched(products, batch_size):
+                batch_started = time.perf_counter()
+                if fused_enricher is not None:
+                    results, _ = fused_enricher.batch_enrich(batch, marketplace)
+                else:
+                    results = guesser.batch_guess_categories_detailed(batch, marketplace, packed=packed)
+                    enricher.batch_enrich_products(batch)
+                latencies.append(time.perf_counter() - batch_started)
+                tiers.update(result['tier'] for result in results)
+        else:
+            for product in products:
+                row_started = time.perf_counter()
+                if fused_enricher is not None:
+                    result, _ = fused_enricher.enrich(product, marketplace)
+                else:
+                    result = guesser.guess_category_detailed(product, marketplace)
+                    enricher.enrich_product_ids(product)
+                latencies.append(time.perf_counter() - row_started)
+                tiers[result['tier']] += 1
+    finally:
+        reset_clients()
+    elapsed = time.perf_counter() - started
+
+    calls = client.stats['calls'] + async_client.stats['calls']
+    hits = category_cache.hits + id_cache.hits
+    lookups = hits + category_cache.misses + id_cache.misses
+    rows = len(products)
+    return {
+        'feed': os.path.basename(feed['path']),
+        'category': feed['category'],
+        'rows': rows,
+        'mode': mode,
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(rows / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_unit': 'batch' if mode == 'batch' else 'row',
+        'latency_ms': {name: round(percentile(latencies, fraction) * 1000, 3)
+                       for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))},
+        'llm_calls': calls,
+        'llm_calls_per_row': round(calls / rows, 4) if rows else 0.0,
+        'llm_tokens': sum(stub.stats['prompt_tokens'] + stub.stats['completion_tokens']
+                          for stub in (client, async_client)),
+        'cache_hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        'category_tiers': dict(tiers),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def _run_feed_spawned(feed: Dict, latency_args: tuple, *args) -> Dict:
+    return run_feed(feed, LatencyModel(*latency_args), *args)
+
+def run_feed_isolated(feed: Dict, latency_args: tuple, mode: str = 'row', batch_size: int = 100,
+                      marketplace: str = 'walmart', packed: bool = False, fused: bool = False) -> Dict:
+    """
+    run_feed in a fresh interpreter, so its peak_rss_mb is that feed's own peak.
+
+    Args:
+        latency_args: LatencyModel arguments (distribution, mean_ms, jitter_ms, seed); the model is built
+            in the child
+        Others as for run_feed
+
+    Returns:
+        Dict: As for run_feed
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_run_feed_spawned, feed, latency_args, mode, batch_size, marketplace, packed,
+                           fused).result()
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict, baseline: Dict) -> List[str]:
+    """Per-feed rows/sec and p95 changes against an earlier results file."""
+    previous = {(feed['feed'], feed['mode']): feed for feed in baseline.get('feeds', [])}
+    lines = []
+    for feed in results['feeds']:
+        before = previous.get((feed['feed'], feed['mode']))
+        if not before or not before['rows_per_sec']:
+            continue
+        throughput = (feed['rows_per_sec'] - before['rows_per_sec']) / before['rows_per_sec'] * 100
+        lines.append(f"{feed['feed']}: {before['rows_per_sec']:.1f} -> {feed['rows_per_sec']:.1f} rows/s "
+                     f"({throughput:+.1f}%), p95 {before['latency_ms']['p95']:.2f} -> "
+                     f"{feed['latency_ms']['p95']:.2f} ms")
+    return lines
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m server.utils.benchmark',
+        description='Benchmark category guessing and ID enrichment over the test feeds with a stub LLM.'
+    )
+    parser.add_argument('--feeds-dir', default=DEFAULT_FEEDS_DIR, help='Directory of <category>_<N>rows.csv feeds')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Feed sizes to run')
+    parser.add_argument('--categories', nargs='+', help='Only these feed categories')
+    parser.add_argument('--mode', choices=('row', 'batch'), default='row', help='Time single rows or whole batches')
+    parser.add_argument('-b', '--batch-size', type=int, default=100, help='Rows per batch in batch mode')
+    parser.add_argument('--packed', action='store_true', help='Packed category prompts in batch mode')
+    parser.add_argument('--fused', action='store_true', help='One completion per product for category and IDs')
+    parser.add_argument('-m', '--marketplace', default='walmart', help='Target marketplace taxonomy')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Stub LLM mean latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Stub LLM latency spread')
+    parser.add_argument('--distribution', choices=LatencyModel.DISTRIBUTIONS, default='fixed',
+                        help='Stub LLM latency distribution')
+    parser.add_argument('--seed', type=int, default=0, help='Latency random seed')
+    parser.add_argument('--cache', default=':memory:',
+                        help="Cache file for header mappings and enrichment (default ':memory:', so production "
+                             "caches are never read or written)")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='Results JSON path')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    # Inherited by the per-feed processes; a cache snapshot would also hide the work being measured
+    os.environ['ENRICHMENT_CACHE_PATH'] = args.cache
+    os.environ['ENRICHMENT_CACHE_SNAPSHOT'] = ''
+
+    feeds = find_feeds(args.feeds_dir, args.sizes, args.categories)
+    if not feeds:
+        print(f"No benchmark feeds found in {args.feeds_dir}", file=sys.stderr)
+        return 1
+
+    results = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'config': {
+            'mode': args.mode,
+            'batch_size': args.batch_size,
+            'packed': args.packed,
+            'fused': args.fused,
+            'marketplace': args.marketplace,
+            'latency': {'distribution': args.distribution, 'mean_ms': args.latency_ms,
+                        'jitter_ms': args.jitter_ms, 'seed': args.seed},
+        },
+        'feeds': [],
+    }
+
+    for feed in feeds:
+        # Same seed per feed so a feed's latency sequence does not depend on which feeds ran before it
+        latency_args = (args.distribution, args.latency_ms, args.jitter_ms, args.seed)
+        result = run_feed_isolated(feed, latency_args, args.mode, args.batch_size, args.marketplace, args.packed,
+                                   args.fused)
+        results['feeds'].append(result)
+        print(f"{result['feed']}: {result['rows']} rows, {result['rows_per_sec']:.1f} rows/s, "
+              f"p50/p95/p99 {result['latency_ms']['p50']:.2f}/{result['latency_ms']['p95']:.2f}/"
+              f"{result['latency_ms']['p99']:.2f} ms, {result['llm_calls_per_row']:.2f} calls/row, "
+              f"cache hits {result['cache_hit_rate']:.0%}, peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+
+    total_rows = sum(feed['rows'] for feed in results['feeds'])
+    total_seconds = sum(feed['seconds'] for feed in results['feeds'])
+    results['totals'] = {
+        'rows': total_rows,
+        'seconds': round(total_seconds, 4),
+        'rows_per_sec': round(total_rows / total_seconds, 2) if total_seconds else 0.0,
+        'llm_calls_per_row': round(sum(feed['llm_calls'] for feed in results['feeds']) / total_rows, 4)
+        if total_rows else 0.0,
+        # Each feed ran in its own process; the largest of their peaks
+        'max_feed_peak_rss_mb': max((feed['peak_rss_mb'] for feed in results['feeds']
+                                     if feed['peak_rss_mb'] is not None), default=None),
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Wrote {args.output}: {total_rows} rows, {results['totals']['rows_per_sec']:.1f} rows/s", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            for line in compare(results, json.load(handle)):
+                print(line, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.enrich import ID_FIELDS, backfill_parts, batched, map_fields, output_headers, read_feed, to_product
+from server.utils.gs1 import derive_identifiers_bulk
+from server.utils.product_id_enricher import ProductIDEnricher
+
+# Batch API endpoint every request line targets
+BATCH_URL = '/v1/chat/completions'
+
+# Provider limit on requests per batch input file
+MAX_REQUESTS_PER_FILE = 50000
+
+def custom_id(kind: str, cache_key: str) -> str:
+    """Stable request ID: the same product and missing fields give the same ID on every export."""
+    return f"{kind}-{hashlib.blake2b(cache_key.encode('utf-8'), digest_size=12).hexdigest()}"
+
+class RequestWriter:
+    """
+    Writes batch request lines, rolling over to a new file every max_requests lines.
+
+    The first file is `path`; later ones insert a part number before the
+    extension (requests.jsonl, requests.2.jsonl, ...).
+    """
+
+    def __init__(self, path: str, max_requests: int = MAX_REQUESTS_PER_FILE):
+        self.path = path
+        self.max_requests = max_requests
+        self.paths: List[str] = []
+        self.count = 0
+        self._handle = None
+        self._in_file = 0
+
+    def _open_next(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+        stem, extension = os.path.splitext(self.path)
+        path = self.path if not self.paths else f"{stem}.{len(self.paths) + 1}{extension}"
+        self._handle = open(path, 'w', encoding='utf-8')
+        self.paths.append(path)
+        self._in_file = 0
+
+    def write(self, request_id: str, body: Dict) -> None:
+        if self._handle is None or self._in_file >= self.max_requests:
+            self._open_next()
+        line = {'custom_id': request_id, 'method': 'POST', 'url': BATCH_URL, 'body': body}
+        self._handle.write(json.dumps(line, separators=(',', ':'), ensure_ascii=False) + '\n')
+        self._in_file += 1
+        self.count += 1
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+def read_results(paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    Answers of batch result files by custom ID.
+
+    Args:
+        paths: Result JSONL files ({"custom_id", "response": {"status_code", "body"}, "error"} lines)
+
+    Returns:
+        Dict[str, Optional[str]]: custom ID -> completion text, or None for failed requests
+    """
+    results: Dict[str, Optional[str]] = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as handle:
+            for line_number, line in enumerate(handle, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    response = entry.get('response') or {}
+                    if entry.get('error') or response.get('status_code') != 200:
+                        results.setdefault(entry['custom_id'], None)
+                        continue
+                    results[entry['custom_id']] = response['body']['choices'][0]['message']['content']
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    print(f"Error reading batch result {path}:{line_number}: {e}")
+    return results
+
+class BulkJob:
+    """
+    Offline bulk enrichment through a provider batch API.
+
+    export writes one request per distinct cache miss (category and
+    identifiers separately) with custom IDs derived from the cache keys, so
+    re-exporting the same feed yields the same IDs. ingest walks the feed
+    again, feeds each answer through the guesser's and enricher's usual
+    normalization, parsing and validation into their caches, and fills the
+    rows; rows whose answer is missing or failed get their best local answer
+    and are marked for backfill.
+    """
+
+    def __init__(self, guesser: Optional[CategoryGuesser] = None, enricher: Optional[ProductIDEnricher] = None,
+                 marketplace: str = 'amazon'):
+        self.guesser = guesser
+        self.enricher = enricher
+        self.marketplace = marketplace
+        # Cumulative over export and ingest calls
+        self.stats = {'rows': 0, 'category_requests': 0, 'id_requests': 0, 'category_answers': 0,
+                      'id_answers': 0, 'unanswered': 0}
+
+    def export(self, rows: Iterable[Dict[str, str]], field_map: Dict[str, str], writer: RequestWriter,
+               batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Write a batch request for every cache-missing product of a feed.
+
+        Args:
+            rows: Feed rows
+            field_map: Product field -> input header (see enrich.map_fields)
+            writer: Destination of the request lines
+            batch_size: Rows read per batch
+
+        Returns:
+            Dict[str, int]: Counters (rows, category_requests, id_requests)
+        """
+        seen = set()
+        for batch in batched(rows, batch_size):
+            products = [to_product(row, field_map) for row in batch]
+            derived = derive_identifiers_bulk(products) if self.enricher is not None else None
+            self.stats['rows'] += len(products)
+
+            for index, product in enumerate(products):
+                if self.guesser is not None:
+                    request = self.guesser.bulk_request(product, self.marketplace)
+                    if request is not None and custom_id('category', request[0]) not in seen:
+                        seen.add(custom_id('category', request[0]))
+                        writer.write(custom_id('category', request[0]), request[1])
+                        self.stats['category_requests'] += 1
+                if self.enricher is not None:
+                    request = self.enricher.bulk_request(product, derived[index])
+                    if request is not None and custom_id('ids', request[0]) not in seen:
+                        seen.add(custom_id('ids', request[0]))
+                        writer.write(custom_id('ids', request[0]), request[1])
+                        self.stats['id_requests'] += 1
+        return self.stats
+
+    def ingest(self, rows: Iterable[Dict[str, str]], field_map: Dict[str, str], results: Dict[str, Optional[str]],
+               batch_size: int = 1000) -> Iterator[Dict[str, str]]:
+        """
+        Fill feed rows from batch results, caching every answer on the way.
+
+        Each answer is ingested once (at the first row it belongs to) and
+        dropped from results; later rows with the same key hit the cache.
+
+        Args:
+            rows: Feed rows, as exported
+            field_map: Product field -> input header (see enrich.map_fields)
+            results: custom ID -> answer (see read_results); consumed
+            batch_size: Rows read per batch
+
+        Yields:
+            Dict[str, str]: Input row plus category / identifier / backfill columns
+        """
+        for batch in batched(rows, batch_size):
+            products = [to_product(row, field_map) for row in batch]
+            derived = derive_identifiers_bulk(products) if self.enricher is not None else None
+            self.stats['rows'] += len(products)
+
+            for index, (row, product) in enumerate(zip(batch, products)):
+                result = enriched = None
+                if self.guesser is not None:
+                    result = self._ingest_category(product, results)
+                    row['category'] = result['category']
+                    row['category_tier'] = result['tier']
+                if self.enricher is not None:
+                    enriched = self._ingest_ids(product, derived[index], results)
+                    for id_type in ID_FIELDS:
+                        if enriched.get(id_type):
+                            row[field_map.get(id_type, id_type)] = enriched[id_type]
+                parts = backfill_parts(result, enriched)
+                row['backfill'] = ','.join(parts)
+                self.stats['unanswered'] += bool(parts)
+
+            yield from batch
+
+    def _ingest_category(self, product: Dict[str, str], results: Dict[str, Optional[str]]) -> Dict:
+        answer = results.pop(custom_id('category', self.guesser._cache_key(product, self.marketplace)), None)
+        if answer is not None:
+            self.stats['category_answers'] += 1
+            return self.guesser.ingest_bulk_answer(product, self.marketplace, answer)
+        resolved = self.guesser._resolve_offline(product, self.marketplace)
+        if resolved is not None:
+            return resolved
+        return self.guesser._local_fallback(product, self.marketplace, 'unanswered')
+
+    def _ingest_ids(self, product: Dict[str, str], derived_ids: Dict[str, str],
+                    results: Dict[str, Optional[str]]) -> Dict:
+        enriched, missing_ids = self.enricher._prepare_ids(product, derived_ids)
+        if not missing_ids:
+            return enriched
+
+        answer = results.pop(custom_id('ids', self.enricher._id_cache_key(product, missing_ids)), None)
+        if answer is not None:
+            self.stats['id_answers'] += 1
+            generated_ids = self.enricher.ingest_bulk_answer(product, missing_ids, answer)
+        else:
+            generated_ids = self.enricher._cached_ids(product, missing_ids)
+
+        if generated_ids is None:
+            enriched['backfill'] = 'ids'
+        else:
+            self.enricher._apply_generated_ids(enriched, generated_ids)
+        return enriched
+
+def simulate_results(request_paths: Iterable[str], output_path: str, error_rate: float = 0.0,
+                     seed: int = 0) -> int:
+    """
+    Answer batch request files with the local stub provider (see llm_stub), writing a result file.
+
+    Lets export -> ingest run end to end offline; error_rate fails that share of
+    requests with a provider-style error line.
+
+    Returns:
+        int: Result lines written
+    """
+    from server.utils.llm_stub import StubClient
+
+    client = StubClient()
+    failures = random.Random(seed)
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as output:
+        for path in request_paths:
+            with open(path, encoding='utf-8') as handle:
+                for line in handle:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    count += 1
+                    entry: Dict[str, Any] = {'id': f"batch_req_{count}", 'custom_id': request['custom_id']}
+                    if failures.random() < error_rate:
+                        entry['response'] = None
+                        entry['error'] = {'code': 'server_error', 'message': 'Simulated failure'}
+                    else:
+                        completion = client.create(**request['body'])
+                        entry['response'] = {
+                            'status_code': 200,
+                            'request_id': f"req_{count}",
+                            'body': {
+                                'id': completion.id,
+                                'object': 'chat.completion',
+                                'model': completion.model,
+                                'choices': [{'index': 0, 'finish_reason': 'stop',
+                                             'message': {'role': 'assistant',
+                                                         'content': completion.choices[0].message.content}}],
+                                'usage': vars(completion.usage),
+                            },
+                        }
+                        entry['error'] = None
+                    output.write(json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n')
+    return count
+
+def _open_feed(path: str):
+    return sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig', errors='replace')
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m server.utils.bulk_jobs',
+        description='Offline bulk enrichment: export batch requests, ingest batch results.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='Write batch requests for every cache miss of a feed')
+    export.add_argument('input', help="Input feed path, or '-' for stdin")
+    export.add_argument('-o', '--output', required=True, help='Request JSONL path (rolls over into .2, .3, ...)')
+    export.add_argument('--max-requests', type=int, default=MAX_REQUESTS_PER_FILE, help='Requests per file')
+
+    ingest = commands.add_parser('ingest', help='Cache batch results and write the enriched feed')
+    ingest.add_argument('input', help="Input feed path (as exported), or '-' for stdin")
+    ingest.add_argument('results', nargs='+', help='Batch result JSONL files')
+    ingest.add_argument('-o', '--output', default='-', help="Output path, or '-' for stdout (default)")
+
+    for command in (export, ingest):
+        command.add_argument('-m', '--marketplace', default='amazon', help='Target marketplace taxonomy')
+        command.add_argument('-d', '--delimiter', help='Input delimiter (sniffed by default)')
+        command.add_argument('--no-category', action='store_true', help='Skip category guessing')
+        command.add_argument('--no-ids', action='store_true', help='Skip UPC/GTIN/ASIN enrichment')
+
+    simulate = commands.add_parser('simulate', help='Answer request files with the local stub provider')
+    simulate.add_argument('requests', nargs='+', help='Request JSONL files')
+    simulate.add_argument('-o', '--output', required=True, help='Result JSONL path')
+    simulate.add_argument('--error-rate', type=float, default=0.0, help='Share of requests to fail')
+    simulate.add_argument('--seed', type=int, default=0, help='Seed of the simulated failures')
+
+    args = parser.parse_args(argv)
+    started = time.time()
+
+    if args.command == 'simulate':
+        count = simulate_results(args.requests, args.output, args.error_rate, args.seed)
+        print(f"Answered {count} requests in {time.time() - started:.2f}s", file=sys.stderr)
+        return 0
+
+    csv.field_size_limit(16 * 1024 * 1024)
+    job = BulkJob(None if args.no_category else CategoryGuesser(), None if args.no_ids else ProductIDEnricher(),
+                  args.marketplace)
+
+    source = _open_feed(args.input)
+    try:
+        headers, delimiter, rows = read_feed(source, args.delimiter)
+        field_map = map_fields(headers)
+        if 'title' not in field_map:
+            print(f"No title column found in {args.input}; headers: {', '.join(headers)}", file=sys.stderr)
+            return 1
+
+        if args.command == 'export':
+            writer = RequestWriter(args.output, args.max_requests)
+            try:
+                stats = job.export(rows, field_map, writer)
+            finally:
+                writer.close()
+            print(f"Exported {stats['category_requests']} category and {stats['id_requests']} ID requests "
+                  f"for {stats['rows']} rows to {', '.join(writer.paths) or 'nothing'} "
+                  f"in {time.time() - started:.2f}s", file=sys.stderr)
+            return 0
+
+        results = read_results(args.results)
+        target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+        try:
+            fieldnames = output_headers(headers, field_map)
+            writer = csv.DictWriter(target, fieldnames=fieldnames, delimiter=delimiter, extrasaction='ignore')
+            writer.writeheader()
+            for batch in batched(job.ingest(rows, field_map, results), 1000):
+                writer.writerows(batch)
+        finally:
+            if target is not sys.stdout:
+                target.close()
+        stats = job.stats
+        print(f"Ingested {stats['category_answers']} category and {stats['id_answers']} ID answers into "
+              f"{stats['rows']} rows; {stats['unanswered']} rows marked for backfill "
+              f"in {time.time() - started:.2f}s", file=sys.stderr)
+        return 0
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+import os
+import json
+import mmap
+import time
+import bisect
+import struct
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from server.utils.metrics import CACHE_LOOKUPS
+
+_MISSING = object()
+
+# Snapshot file layout: header, JSON values, one sorted index per namespace, JSON metadata
+SNAPSHOT_MAGIC = b'JADOOSNP'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<8sIIQQ')  # magic, version, reserved, metadata offset, metadata length
+_SNAPSHOT_ENTRY = struct.Struct('<16sQI')  # key digest prefix, value offset, value length
+_SNAPSHOT_DIGEST = 16
+
+def hash_key(key: str) -> str:
+    """Hash a cache key to a fixed-size digest."""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class CacheBackend:
+    """
+    Minimal cache interface shared by the enrichment caches.
+
+    Subclasses implement get/set/delete/clear; the dict-style helpers are
+    built on top so existing `key in cache` / `cache[key] = value` code keeps
+    working.
+    """
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        self.delete(key)
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with an entry cap and optional TTL."""
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache(CacheBackend):
+    """
+    File-backed cache shared by every process that opens the same path.
+
+    Keys are stored hashed, values as JSON. Entries expire after `ttl`
+    seconds and the oldest entries of a namespace are pruned once it grows
+    past `max_entries`.
+    """
+
+    def __init__(self, path: str, namespace: str = 'default', ttl: Optional[float] = None,
+                 max_entries: int = 1000000, prune_interval: int = 1000):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self._writes = 0
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (namespace, created_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, hash_key(key))
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return default
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, hash_key(key), json.dumps(value), now, expires_at)
+            )
+        self._writes += 1
+        if self._writes % self.prune_interval == 0:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, hash_key(key)))
+
+    def clear(self) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def prune(self) -> None:
+        """Drop expired entries and enforce the size cap."""
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at < ?",
+                (self.namespace, time.time())
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache WHERE namespace = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries)
+            )
+
+    def namespaces(self) -> List[str]:
+        """Every namespace stored in the file."""
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT namespace FROM cache ORDER BY namespace")]
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """Live entries of the namespace as (hashed key, JSON value), for snapshots."""
+        cursor = self._connection().execute(
+            "SELECT key, value FROM cache WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (self.namespace, time.time())
+        )
+        yield from cursor
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+
+class _DigestColumn:
+    """Key digests of one namespace's snapshot index, as a sequence bisect can search in place."""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __getitem__(self, index: int) -> bytes:
+        start = self._offset + index * _SNAPSHOT_ENTRY.size
+        return self._buffer[start:start + _SNAPSHOT_DIGEST]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def value_span(self, index: int) -> Tuple[int, int]:
+        """(offset, length) of the value at index."""
+        _, offset, length = _SNAPSHOT_ENTRY.unpack_from(self._buffer, self._offset + index * _SNAPSHOT_ENTRY.size)
+        return offset, length
+
+class Snapshot:
+    """
+    Read-only cache snapshot, memory-mapped.
+
+    Opening one reads only the header and metadata; lookups binary-search
+    the namespace's sorted index in the mapping, so a worker can serve hits
+    straight after boot and every process on the host shares the same pages.
+    Build snapshots with write_snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._buffer) < _SNAPSHOT_HEADER.size:
+                raise ValueError(f"{path} is not a cache snapshot")
+            magic, version, _, meta_offset, meta_length = _SNAPSHOT_HEADER.unpack_from(self._buffer, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a cache snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} has snapshot format {version}; this build reads {SNAPSHOT_VERSION}")
+            self.meta = json.loads(self._buffer[meta_offset:meta_offset + meta_length])
+        except Exception:
+            self._buffer.close()
+            raise
+
+        self._indexes = {
+            namespace: _DigestColumn(self._buffer, index['offset'], index['count'])
+            for namespace, index in self.meta['namespaces'].items()
+        }
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        index = self._indexes.get(namespace)
+        if index is None:
+            return default
+        digest = hashlib.sha256(key.encode('utf-8')).digest()[:_SNAPSHOT_DIGEST]
+        position = bisect.bisect_left(index, digest)
+        if position == len(index) or index[position] != digest:
+            return default
+        offset, length = index.value_span(position)
+        return json.loads(self._buffer[offset:offset + length])
+
+    def count(self, namespace: str) -> int:
+        index = self._indexes.get(namespace)
+        return len(index) if index is not None else 0
+
+    def close(self) -> None:
+        self._buffer.close()
+
+class SnapshotCache(CacheBackend):
+    """
+    One namespace of a Snapshot as a read-only cache tier.
+
+    Writes and deletes are ignored; the tiers around it take them.
+    """
+
+    def __init__(self, snapshot: Snapshot, namespace: str):
+        self.snapshot = snapshot
+        self.namespace = namespace
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.snapshot.get(self.namespace, key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return self.snapshot.count(self.namespace)
+
+def write_snapshot(path: str, entries: Iterable[Tuple[str, str, str]], meta: Optional[Dict] = None) -> Dict:
+    """
+    Write a cache snapshot.
+
+    The file is built next to path and moved into place, so workers that
+    already mapped the previous snapshot keep reading it undisturbed.
+
+    Args:
+        path: Snapshot file
+        entries: (namespace, hashed key as stored by SQLiteCache, JSON value) triples
+        meta: Extra metadata recorded in the file (e.g. the warm-up corpus)
+
+    Returns:
+        Dict: The snapshot metadata (format, created_at, per-namespace entry counts)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(b'\0' * _SNAPSHOT_HEADER.size)
+            offset = _SNAPSHOT_HEADER.size
+
+            # Packed index records sort by digest, since the digest leads the record
+            records: Dict[str, List[bytes]] = {}
+            for namespace, key_hash, value in entries:
+                data = value.encode('utf-8')
+                output.write(data)
+                digest = bytes.fromhex(key_hash)[:_SNAPSHOT_DIGEST]
+                records.setdefault(namespace, []).append(_SNAPSHOT_ENTRY.pack(digest, offset, len(data)))
+                offset += len(data)
+
+            namespaces = {}
+            for namespace in sorted(records):
+                index = sorted(records.pop(namespace))
+                namespaces[namespace] = {'offset': offset, 'count': len(index)}
+                output.write(b''.join(index))
+                offset += len(index) * _SNAPSHOT_ENTRY.size
+
+            meta = dict(meta or {}, format=SNAPSHOT_VERSION, created_at=time.time(), namespaces=namespaces)
+            encoded = json.dumps(meta, sort_keys=True).encode('utf-8')
+            output.write(encoded)
+            output.seek(0)
+            output.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, offset, len(encoded)))
+
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    return meta
+
+_snapshots: Dict[str, Optional[Snapshot]] = {}
+_snapshots_lock = threading.Lock()
+
+def load_snapshot(path: str) -> Optional[Snapshot]:
+    """
+    Snapshot at path, mapped once per process and shared by every cache.
+
+    Returns:
+        Optional[Snapshot]: The snapshot, or None if it is missing or unreadable
+    """
+    path = os.path.abspath(path)
+    with _snapshots_lock:
+        if path not in _snapshots:
+            try:
+                _snapshots[path] = Snapshot(path)
+            except Exception as e:
+                print(f"Error loading cache snapshot {path}: {e}")
+                _snapshots[path] = None
+        return _snapshots[path]
+
+class TieredCache(CacheBackend):
+    """
+    Read-through stack of caches, fastest first.
+
+    A hit in a lower tier is copied into the tiers above it; writes go to
+    every tier. Lookups are counted per tier in the
+    enrichment_cache_lookups_total metric under `name`.
+    """
+
+    def __init__(self, tiers: List[CacheBackend], name: str = 'default'):
+        self.tiers = tiers
+        self.name = name
+        labels = [_tier_label(tier) for tier in tiers]
+        self._hits = [CACHE_LOOKUPS.labels(name, label, 'hit') for label in labels]
+        self._misses = [CACHE_LOOKUPS.labels(name, label, 'miss') for label in labels]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        for depth, tier in enumerate(self.tiers):
+            value = tier.get(key, _MISSING)
+            if value is not _MISSING:
+                self._hits[depth].inc()
+                for upper in self.tiers[:depth]:
+                    upper.set(key, value)
+                return value
+            self._misses[depth].inc()
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def delete(self, key: str) -> None:
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+    def __len__(self) -> int:
+        return len(self.tiers[-1])
+
+def _tier_label(tier: CacheBackend) -> str:
+    if isinstance(tier, LRUCache):
+        return 'memory'
+    if isinstance(tier, SQLiteCache):
+        return 'sqlite'
+    if isinstance(tier, SnapshotCache):
+        return 'snapshot'
+    return type(tier).__name__.lower()
+
+def default_cache_path() -> str:
+    """Location of the shared SQLite cache (ENRICHMENT_CACHE_PATH overrides it)."""
+    return os.getenv('ENRICHMENT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'jadoo_enrichment_cache.sqlite3'))
+
+def create_cache(namespace: str, path: Optional[str] = None, ttl: Optional[float] = None,
+                 memory_entries: Optional[int] = None, max_entries: Optional[int] = None,
+                 snapshot: Optional[str] = None) -> CacheBackend:
+    """
+    Build the default two-tier cache: an in-memory LRU in front of SQLite.
+
+    With a snapshot (see cache_warmup), its read-only mapping sits between
+    the two, so a fresh worker hits warmed entries before its SQLite file
+    has any. Snapshots older than ttl are ignored.
+
+    Args:
+        namespace: Logical cache name, e.g. 'category' or 'product_ids'
+        path: SQLite file; ':memory:' or an empty string keeps the cache in-process only
+        ttl: Entry lifetime in seconds (ENRICHMENT_CACHE_TTL, default 30 days)
+        memory_entries: LRU front size (ENRICHMENT_CACHE_MEMORY_ENTRIES, default 10000)
+        max_entries: SQLite size cap per namespace (ENRICHMENT_CACHE_MAX_ENTRIES, default 1000000)
+        snapshot: Snapshot file (ENRICHMENT_CACHE_SNAPSHOT); an empty string disables it
+
+    Returns:
+        CacheBackend: The configured cache
+    """
+    path = default_cache_path() if path is None else path
+    ttl = ttl if ttl is not None else float(os.getenv('ENRICHMENT_CACHE_TTL', str(30 * 24 * 3600)))
+    memory_entries = memory_entries or int(os.getenv('ENRICHMENT_CACHE_MEMORY_ENTRIES', '10000'))
+    max_entries = max_entries or int(os.getenv('ENRICHMENT_CACHE_MAX_ENTRIES', '1000000'))
+
+    snapshot = os.getenv('ENRICHMENT_CACHE_SNAPSHOT', '') if snapshot is None else snapshot
+
+    tiers: List[CacheBackend] = [LRUCache(max_entries=memory_entries, ttl=ttl)]
+    mapped = load_snapshot(snapshot) if snapshot else None
+    if mapped is not None and mapped.count(namespace) and mapped.meta['created_at'] + ttl >= time.time():
+        tiers.append(SnapshotCache(mapped, namespace))
+    if path and path != ':memory:':
+        tiers.append(SQLiteCache(path, namespace=namespace, ttl=ttl, max_entries=max_entries))
+
+    return TieredCache(tiers, name=namespace)
@@ -0,0 +1,195 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from server.utils.cache_backend import Snapshot, SQLiteCache, create_cache, default_cache_path, write_snapshot
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.enrich import enrich_rows, map_fields, read_feed, to_product
+from server.utils.product_id_enricher import ProductIDEnricher
+
+# Feed files picked up when a corpus path is a directory
+CORPUS_EXTENSIONS = ('.csv', '.tsv', '.txt')
+
+# Category tiers whose answer a worker should find under the product's own cache key
+ANSWER_TIERS = ('local', 'cache', 'llm')
+
+def corpus_files(paths: Sequence[str]) -> List[str]:
+    """Feed files under each path (directories are walked recursively, in sorted order)."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            subdirectories.sort()
+            files.extend(os.path.join(directory, name) for name in sorted(names)
+                         if name.lower().endswith(CORPUS_EXTENSIONS))
+    return files
+
+def warm_caches(files: Sequence[str], cache_path: str, marketplaces: Sequence[str] = ('amazon',),
+                categories: bool = True, ids: bool = True, batch_size: int = 100, packed: bool = False,
+                fused: bool = False) -> Dict[str, int]:
+    """
+    Run enrichment over a corpus so its answers land in the SQLite cache at cache_path.
+
+    Categories are warmed for every marketplace, identifiers once (they do
+    not depend on the marketplace). Any existing snapshot is bypassed, and
+    each row's answers are stored under its own cache keys even when they
+    came from a near duplicate or a learned local match, so every answer
+    the corpus needs ends up in the file.
+
+    Returns:
+        Dict[str, int]: Counters (files, skipped, rows)
+    """
+    guesser = CategoryGuesser(cache=create_cache('category', path=cache_path, snapshot='')) if categories else None
+    enricher = ProductIDEnricher(cache=create_cache('product_ids', path=cache_path, snapshot='')) if ids else None
+    stats = {'files': 0, 'skipped': 0, 'rows': 0}
+
+    for path in files:
+        for position, marketplace in enumerate(marketplaces if categories else marketplaces[:1]):
+            with open(path, newline='', encoding='utf-8-sig', errors='replace') as source:
+                headers, _, rows = read_feed(source)
+                field_map = map_fields(headers)
+                if 'title' not in field_map:
+                    print(f"No title column found in {path}; skipping", file=sys.stderr)
+                    stats['skipped'] += 1
+                    break
+
+                # Products as read, before enrichment fills in their identifiers
+                products = deque()
+
+                def tracked(rows):
+                    for row in rows:
+                        products.append(to_product(row, field_map))
+                        yield row
+
+                count = 0
+                for row in enrich_rows(tracked(rows), field_map, guesser, enricher if position == 0 else None,
+                                       marketplace, batch_size, packed, fused and position == 0):
+                    _store_answers(products.popleft(), row, field_map, guesser, enricher if position == 0 else None,
+                                   marketplace)
+                    count += 1
+                if position == 0:
+                    stats['files'] += 1
+                    stats['rows'] += count
+                    print(f"Warmed {count} rows from {path}", file=sys.stderr)
+
+    return stats
+
+def _store_answers(product: Dict, row: Dict, field_map: Dict[str, str], guesser: Optional[CategoryGuesser],
+                   enricher: Optional[ProductIDEnricher], marketplace: str) -> None:
+    """Cache an enriched row's category and generated identifiers under the product's own keys."""
+    if guesser is not None and row.get('category_tier') in ANSWER_TIERS:
+        key = guesser._cache_key(product, marketplace)
+        if guesser.category_cache.get(key) is None:
+            guesser.category_cache[key] = row['category']
+
+    if enricher is not None and 'ids' not in row.get('backfill', '').split(','):
+        _, missing_ids = enricher._prepare_ids(product)
+        key = enricher._id_cache_key(product, missing_ids)
+        if missing_ids and enricher.id_cache.get(key) is None:
+            enricher.id_cache[key] = {id_type: row[field_map.get(id_type, id_type)] for id_type in missing_ids
+                                      if row.get(field_map.get(id_type, id_type))}
+
+def snapshot_entries(cache_path: str, namespaces: Optional[Sequence[str]] = None) -> Iterator:
+    """(namespace, hashed key, JSON value) of every live entry of the SQLite cache at cache_path."""
+    for namespace in namespaces or SQLiteCache(cache_path).namespaces():
+        for key_hash, value in SQLiteCache(cache_path, namespace=namespace).entries():
+            yield namespace, key_hash, value
+
+def build_snapshot(cache_path: str, output: str, namespaces: Optional[Sequence[str]] = None,
+                   meta: Optional[Dict] = None) -> Dict:
+    """
+    Export the SQLite cache at cache_path as a read-only snapshot.
+
+    Workers pick it up through ENRICHMENT_CACHE_SNAPSHOT (see create_cache).
+
+    Returns:
+        Dict: The snapshot metadata
+    """
+    meta = dict(meta or {}, source=os.path.abspath(cache_path))
+    return write_snapshot(output, snapshot_entries(cache_path, namespaces), meta)
+
+def describe(meta: Dict, path: str) -> str:
+    created = datetime.fromtimestamp(meta['created_at'], timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+    counts = ', '.join(f"{namespace} {index['count']}" for namespace, index in meta['namespaces'].items())
+    label = f" '{meta['label']}'" if meta.get('label') else ''
+    return (f"Snapshot{label} {path}: format {meta['format']}, {os.path.getsize(path)} bytes, "
+            f"created {created}; entries: {counts or 'none'}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m server.utils.cache_warmup',
+        description='Pre-populate the enrichment caches and export snapshots workers load at startup.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    warm = commands.add_parser('warm', help='Enrich a corpus of feeds into the cache')
+    warm.add_argument('corpus', nargs='+', help='Feed files or directories (e.g. attached_assets/test_feeds)')
+    warm.add_argument('-m', '--marketplaces', default='amazon', help='Comma-separated marketplaces to warm')
+    warm.add_argument('-b', '--batch-size', type=int, default=100, help='Rows per enrichment batch')
+    warm.add_argument('--packed', action='store_true', help='Categorize several products per completion')
+    warm.add_argument('--fused', action='store_true',
+                      help='Ask for the category and identifiers in one completion per product')
+    warm.add_argument('--no-category', action='store_true', help='Skip category guessing')
+    warm.add_argument('--no-ids', action='store_true', help='Skip UPC/GTIN/ASIN enrichment')
+    warm.add_argument('--snapshot', help='Also export a snapshot here once the corpus is warmed')
+
+    snapshot = commands.add_parser('snapshot', help='Export the cache as a read-only snapshot')
+    snapshot.add_argument('-o', '--output', required=True, help='Snapshot path')
+    snapshot.add_argument('--namespace', action='append', help='Namespace to export (repeatable; default all)')
+
+    for command in (warm, snapshot):
+        command.add_argument('--cache', default=default_cache_path(),
+                             help='SQLite cache file (default ENRICHMENT_CACHE_PATH)')
+        command.add_argument('--label', help='Version label recorded in the snapshot (e.g. the release)')
+
+    inspect = commands.add_parser('inspect', help='Describe a snapshot')
+    inspect.add_argument('snapshot', help='Snapshot path')
+    inspect.add_argument('--json', action='store_true', help='Print the raw metadata')
+
+    args = parser.parse_args(argv)
+    started = time.time()
+
+    if args.command == 'inspect':
+        try:
+            mapped = Snapshot(args.snapshot)
+        except (OSError, ValueError) as e:
+            print(f"Error reading snapshot: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(mapped.meta, indent=2, sort_keys=True) if args.json else describe(mapped.meta, args.snapshot))
+        mapped.close()
+        return 0
+
+    if not args.cache or args.cache == ':memory:':
+        print("Warm-up needs a cache file; set --cache or ENRICHMENT_CACHE_PATH", file=sys.stderr)
+        return 1
+
+    # Supplier descriptions can exceed csv's 128 KB default field limit
+    csv.field_size_limit(16 * 1024 * 1024)
+
+    meta = {'label': args.label} if args.label else {}
+    output = args.output if args.command == 'snapshot' else args.snapshot
+
+    if args.command == 'warm':
+        files = corpus_files(args.corpus)
+        marketplaces = [marketplace.strip() for marketplace in args.marketplaces.split(',') if marketplace.strip()]
+        stats = warm_caches(files, args.cache, marketplaces, not args.no_category, not args.no_ids,
+                            args.batch_size, args.packed, args.fused)
+        print(f"Warmed {stats['rows']} rows from {stats['files']} files ({stats['skipped']} skipped) "
+              f"in {time.time() - started:.2f}s", file=sys.stderr)
+        meta.update(corpus=list(args.corpus), marketplaces=marketplaces, rows=stats['rows'])
+
+    if output:
+        meta = build_snapshot(args.cache, output, args.namespace if args.command == 'snapshot' else None, meta)
+        print(describe(meta, output), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
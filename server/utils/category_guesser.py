@@ -1,14 +1,52 @@
-import openai
 import os
-from typing import Dict, List, Optional
+import asyncio
+from typing import Dict, List, Optional, Tuple
 import json
+import re
+
+from server.utils.cache_backend import CacheBackend, create_cache
+from server.utils.llm_client import get_async_client, get_client, run_sync
+from server.utils.local_classifier import KEYWORD_HINTS, LocalCategoryClassifier
+from server.utils.metrics import CATEGORY_RESULTS, NEAR_DUPLICATE_HITS
+from server.utils.near_duplicate import NearDuplicateMatcher
+from server.utils.taxonomy import TAXONOMY_EXTENSIONS, Taxonomy
+from server.utils.llm_scheduler import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceeded, LLMScheduler, estimate_request_tokens, get_scheduler
+)
+
+DEFAULT_CATEGORY = "Electronics > Cell Phones"
+
+SYSTEM_PROMPT = "You are a product categorization expert. Analyze the product information and return ONLY the most specific category path from the provided taxonomy. Do not include any explanations or additional text."
 
 class CategoryGuesser:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, max_concurrency: Optional[int] = None, pack_token_budget: int = 2000,
+                 max_pack_size: int = 40, cache: Optional[CacheBackend] = None,
+                 local_confidence_threshold: Optional[float] = None, scheduler: Optional[LLMScheduler] = None,
+                 near_duplicate_threshold: Optional[float] = None, taxonomies: Optional[Dict[str, Taxonomy]] = None,
+                 candidate_count: Optional[int] = None, max_prompt_categories: Optional[int] = None):
+        # OpenAI clients come from the shared, lazily created pool unless overridden
+        self._client = None
+        self._async_client = None
+        
+        # Rate limiting, backoff and retries shared with every other LLM caller in the process
+        self.scheduler = scheduler or get_scheduler()
+        
+        # Upper bound on in-flight completions for the async batch path
+        self.max_concurrency = max_concurrency or int(os.getenv('CATEGORY_GUESSER_CONCURRENCY', '8'))
+        
+        # Packed mode: how many product tokens (estimated) and items go into one prompt
+        self.pack_token_budget = pack_token_budget
+        self.max_pack_size = max_pack_size
+        
+        # Cache for category mappings to avoid repeated API calls (LRU in front of a shared SQLite file)
+        self.category_cache = cache if cache is not None else create_cache('category')
         
-        # Cache for category mappings to avoid repeated API calls
-        self.category_cache = {}
+        # Titles that are near duplicates (typos, spacing, variants, brand prefixes) of a cached one reuse its
+        # category; a threshold outside (0, 1] turns this off
+        self.near_duplicates = NearDuplicateMatcher.for_categories(
+            near_duplicate_threshold if near_duplicate_threshold is not None
+            else float(os.getenv('CATEGORY_NEAR_DUPLICATE_THRESHOLD', '0.8'))
+        )
         
         # Marketplace category taxonomies
         self.marketplace_taxonomies = {
@@ -33,6 +71,43 @@ class CategoryGuesser:
                 'Automotive': ['Parts', 'Accessories', 'Tools']
             }
         }
+        
+        # Indexed trees used for prompts and candidate retrieval; full marketplace trees in
+        # CATEGORY_TAXONOMY_DIR (<marketplace>.json/.csv/.txt) replace the built-in ones
+        self.taxonomies = {
+            marketplace: Taxonomy.from_dict(tree, KEYWORD_HINTS)
+            for marketplace, tree in self.marketplace_taxonomies.items()
+        }
+        self.taxonomies.update(self._load_taxonomies(os.getenv('CATEGORY_TAXONOMY_DIR')))
+        self.taxonomies.update(taxonomies or {})
+        
+        # Taxonomies with more leaves than this are not listed in full: the LLM chooses among
+        # the candidate_count leaves retrieved locally for each product
+        self.max_prompt_categories = max_prompt_categories or int(os.getenv('CATEGORY_PROMPT_MAX_CATEGORIES', '60'))
+        self.candidate_count = candidate_count or int(os.getenv('CATEGORY_CANDIDATES', '15'))
+        
+        # Offline first tier; products it is less sure about than the threshold go to the LLM
+        self.local_classifier = LocalCategoryClassifier(self.taxonomies)
+        self.local_confidence_threshold = (
+            local_confidence_threshold if local_confidence_threshold is not None
+            else float(os.getenv('CATEGORY_LOCAL_CONFIDENCE', '0.75'))
+        )
+    
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_client()
+    
+    @client.setter
+    def client(self, value) -> None:
+        self._client = value
+    
+    @property
+    def async_client(self):
+        return self._async_client if self._async_client is not None else get_async_client()
+    
+    @async_client.setter
+    def async_client(self, value) -> None:
+        self._async_client = value
     
     def guess_category(self, product_data: Dict, marketplace: str = 'amazon') -> str:
         """
@@ -45,43 +120,238 @@ class CategoryGuesser:
         Returns:
             str: Predicted category path (e.g., "Electronics > Cell Phones")
         """
-        # Create a cache key
-        cache_key = f"{marketplace}_{product_data.get('title', '')}_{product_data.get('brand', '')}"
+        return self.guess_category_detailed(product_data, marketplace)['category']
+    
+    def guess_category_detailed(self, product_data: Dict, marketplace: str = 'amazon') -> Dict:
+        """
+        Guess the product category and report which tier produced it.
         
-        if cache_key in self.category_cache:
-            return self.category_cache[cache_key]
+        The local classifier answers first; the cache and then the LLM are
+        only consulted when its confidence is below the threshold. If the LLM
+        call runs out of its latency budget the best local guess is returned
+        with tier 'deadline', marking the product for a later backfill.
         
-        # Build the prompt
-        prompt = self._build_category_prompt(product_data, marketplace)
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, etc.)
+            marketplace: Target marketplace ('amazon', 'walmart', etc.)
+            
+        Returns:
+            Dict: {'category': str, 'tier': 'local' | 'cache' | 'llm' | 'deadline' | 'fallback', 'confidence': Optional[float]}
+        """
+        resolved = self._resolve_offline(product_data, marketplace)
+        if resolved is not None:
+            return resolved
+        
+        return self._request_category(product_data, marketplace)
+    
+    def _request_category(self, product_data: Dict, marketplace: str) -> Dict:
+        """
+        Ask the LLM for a product that _resolve_offline could not answer.
+        
+        Callers that already resolved the product offline (e.g. FusedEnricher) call this directly,
+        so the offline tiers are not consulted and counted twice.
+        
+        Returns:
+            Dict: Result shaped like guess_category_detailed (tier 'llm', 'deadline' or 'fallback')
+        """
+        request = self._completion_kwargs(product_data, marketplace)
+        
+        try:
+            response = self.scheduler.call(
+                lambda: self.client.chat.completions.create(**request),
+                priority=PRIORITY_INTERACTIVE,
+                estimated_tokens=estimate_request_tokens(request),
+                component='category'
+            )
+            
+            category = self._normalize_answer(response.choices[0].message.content, product_data, marketplace)
+            
+            self._remember(product_data, marketplace, category)
+            
+            return self._result(category, 'llm')
+            
+        except DeadlineExceeded:
+            return self._local_fallback(product_data, marketplace)
+        except Exception as e:
+            print(f"Error guessing category: {e}")
+            # Fallback to a default category
+            return self._result(DEFAULT_CATEGORY, 'fallback')
+    
+    async def aguess_category(self, product_data: Dict, marketplace: str = 'amazon') -> str:
+        """
+        Async variant of guess_category using the async OpenAI client.
+        
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, etc.)
+            marketplace: Target marketplace ('amazon', 'walmart', etc.)
+            
+        Returns:
+            str: Predicted category path (e.g., "Electronics > Cell Phones")
+        """
+        return (await self.aguess_category_detailed(product_data, marketplace))['category']
+    
+    async def aguess_category_detailed(self, product_data: Dict, marketplace: str = 'amazon',
+                                       priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """
+        Async variant of guess_category_detailed.
+        
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, etc.)
+            marketplace: Target marketplace ('amazon', 'walmart', etc.)
+            priority: Scheduler priority of the LLM request
+            
+        Returns:
+            Dict: {'category': str, 'tier': 'local' | 'cache' | 'llm' | 'deadline' | 'fallback', 'confidence': Optional[float]}
+        """
+        resolved = self._resolve_offline(product_data, marketplace)
+        if resolved is not None:
+            return resolved
+        
+        request = self._completion_kwargs(product_data, marketplace)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a product categorization expert. Analyze the product information and return ONLY the most specific category path from the provided taxonomy. Do not include any explanations or additional text."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=50,
-                temperature=0.1
+            response = await self.scheduler.acall(
+                lambda: self.async_client.chat.completions.create(**request),
+                priority=priority,
+                estimated_tokens=estimate_request_tokens(request),
+                component='category'
             )
             
-            category = response.choices[0].message.content.strip()
+            category = self._normalize_answer(response.choices[0].message.content, product_data, marketplace)
             
-            # Cache the result
-            self.category_cache[cache_key] = category
+            self._remember(product_data, marketplace, category)
             
-            return category
+            return self._result(category, 'llm')
             
+        except DeadlineExceeded:
+            return self._local_fallback(product_data, marketplace)
         except Exception as e:
             print(f"Error guessing category: {e}")
             # Fallback to a default category
-            return "Electronics > Cell Phones"
+            return self._result(DEFAULT_CATEGORY, 'fallback')
+    
+    def _resolve_offline(self, product_data: Dict, marketplace: str) -> Optional[Dict]:
+        """
+        Answer from the local classifier or the cache, without a network call.
+        
+        Returns:
+            Optional[Dict]: Tier-tagged result, or None if the LLM is needed
+        """
+        category, confidence = self.local_classifier.classify(product_data, marketplace)
+        if category is not None and confidence >= self.local_confidence_threshold:
+            return self._result(category, 'local', confidence)
+        
+        cached = self.category_cache.get(self._cache_key(product_data, marketplace))
+        if cached is not None:
+            return self._result(cached, 'cache')
+        
+        similar_key = self.near_duplicates.match(marketplace, product_data.get('title', ''),
+                                                 product_data.get('brand', ''))
+        if similar_key is not None:
+            cached = self.category_cache.get(similar_key)
+            if cached is not None:
+                NEAR_DUPLICATE_HITS.labels('category').inc()
+                return self._result(cached, 'cache')
+        
+        return None
+    
+    def _local_fallback(self, product_data: Dict, marketplace: str, tier: str = 'deadline') -> Dict:
+        """Best local answer when no LLM answer is available: the local classifier's top path at any confidence."""
+        category, confidence = self.local_classifier.classify(product_data, marketplace)
+        if category is None:
+            # Still tagged with tier so the row is backfilled, but counted as the default answer it is
+            return self._result(DEFAULT_CATEGORY, tier, 0.0, counted_as='fallback')
+        return self._result(category, tier, confidence)
+    
+    def _result(self, category: str, tier: str, confidence: Optional[float] = None,
+                counted_as: Optional[str] = None) -> Dict:
+        """Build a tier-tagged result and count it in the category results metric (under counted_as if given)."""
+        CATEGORY_RESULTS.labels(counted_as or tier).inc()
+        return {'category': category, 'tier': tier, 'confidence': confidence}
+    
+    def _remember(self, product_data: Dict, marketplace: str, category: str) -> None:
+        """Cache an LLM answer and feed it to the local classifier."""
+        key = self._cache_key(product_data, marketplace)
+        self.category_cache[key] = category
+        self.near_duplicates.add(marketplace, key, product_data.get('title', ''), product_data.get('brand', ''))
+        self.local_classifier.learn(product_data, category, marketplace)
+    
+    def _load_taxonomies(self, directory: Optional[str]) -> Dict[str, Taxonomy]:
+        """Load every <marketplace>.json/.csv/.txt taxonomy file in directory."""
+        
+        taxonomies = {}
+        if not directory or not os.path.isdir(directory):
+            return taxonomies
+        
+        for name in sorted(os.listdir(directory)):
+            marketplace, extension = os.path.splitext(name)
+            if extension.lower() not in TAXONOMY_EXTENSIONS or marketplace in taxonomies:
+                continue
+            try:
+                taxonomies[marketplace] = Taxonomy.load(os.path.join(directory, name), KEYWORD_HINTS)
+            except Exception as e:
+                print(f"Error loading taxonomy {name}: {e}")
+        
+        return taxonomies
+    
+    def _taxonomy(self, marketplace: str) -> Taxonomy:
+        return self.taxonomies.get(marketplace, self.taxonomies['amazon'])
+    
+    def _candidate_paths(self, product_data: Dict, marketplace: str) -> Optional[List[str]]:
+        """
+        Leaves the LLM should choose among, or None when the whole taxonomy fits in the prompt.
+        
+        Args:
+            product_data: Product information
+            marketplace: Target marketplace
+            
+        Returns:
+            Optional[List[str]]: Candidate leaf paths, best first
+        """
+        taxonomy = self._taxonomy(marketplace)
+        if len(taxonomy.leaves) <= self.max_prompt_categories:
+            return None
+        
+        text = f"{product_data.get('title', '')} {product_data.get('brand', '')} {product_data.get('description', '')}"
+        return [path for path, _ in taxonomy.candidates(text, self.candidate_count)]
+    
+    def _normalize_answer(self, answer: str, product_data: Dict, marketplace: str) -> str:
+        """
+        Map an LLM answer onto the taxonomy when the prompt listed candidates.
+        
+        Answers outside the tree fall back to the best local candidate, so
+        large taxonomies never produce a path the marketplace does not have.
+        """
+        answer = answer.strip()
+        candidates = self._candidate_paths(product_data, marketplace)
+        if not candidates:
+            return answer
+        return self._taxonomy(marketplace).resolve(answer, candidates) or candidates[0]
+    
+    def _cache_key(self, product_data: Dict, marketplace: str) -> str:
+        """Build the cache key for a product/marketplace pair."""
+        return f"{marketplace}_{product_data.get('title', '')}_{product_data.get('brand', '')}"
+    
+    def _completion_kwargs(self, product_data: Dict, marketplace: str) -> Dict:
+        """Build the chat completion request shared by the sync and async paths."""
+        
+        prompt = self._build_category_prompt(product_data, marketplace)
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": 50,
+            "temperature": 0.1
+        }
     
     def _build_category_prompt(self, product_data: Dict, marketplace: str) -> str:
         """Build the prompt for category guessing."""
@@ -90,11 +360,12 @@ class CategoryGuesser:
         brand = product_data.get('brand', '')
         description = product_data.get('description', '')
         
-        taxonomy = self.marketplace_taxonomies.get(marketplace, self.marketplace_taxonomies['amazon'])
-        
-        taxonomy_text = ""
-        for main_category, subcategories in taxonomy.items():
-            taxonomy_text += f"{main_category}: {', '.join(subcategories)}\n"
+        candidates = self._candidate_paths(product_data, marketplace)
+        taxonomy_text = self._render_taxonomy(marketplace, candidates)
+        if candidates:
+            answer_format = 'Return only one of the category paths above, in format: "Parent Category > Category"'
+        else:
+            answer_format = 'Return only the category path in format: "Main Category > Subcategory"'
         
         prompt = f"""Based on this product information:
 Title: {title}
@@ -106,31 +377,340 @@ What is the most specific category for this product in {marketplace.title()} tax
 Available categories:
 {taxonomy_text}
 
-Return only the category path in format: "Main Category > Subcategory"
+{answer_format}
 Example: "Electronics > Cell Phones" or "Home & Garden > Kitchen"
 
 Category:"""
         
         return prompt
     
-    def batch_guess_categories(self, products: List[Dict], marketplace: str = 'amazon') -> List[str]:
+    def _render_taxonomy(self, marketplace: str, paths: Optional[List[str]] = None) -> str:
+        """Render the marketplace taxonomy (or only the given leaves) as prompt text."""
+        
+        return self._taxonomy(marketplace).render(paths)
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """Rough token estimate (~4 characters per token) used for packing."""
+        return len(text) // 4 + 1
+    
+    def _render_packed_item(self, item_id: int, product_data: Dict) -> str:
+        """Render one product as a single line of a packed prompt."""
+        
+        title = product_data.get('title', '')
+        brand = product_data.get('brand', '')
+        description = product_data.get('description', '')
+        
+        return f"{item_id}. Title: {title} | Brand: {brand} | Description: {description}"
+    
+    def _pack_products(self, products: List[Dict]) -> List[List[int]]:
+        """
+        Split products into blocks whose rendered size fits the token budget.
+        
+        Args:
+            products: List of product dictionaries
+            
+        Returns:
+            List[List[int]]: Blocks of indices into products
+        """
+        blocks = []
+        block: List[int] = []
+        block_tokens = 0
+        
+        for index, product in enumerate(products):
+            item_tokens = self._estimate_tokens(self._render_packed_item(len(block) + 1, product))
+            if block and (block_tokens + item_tokens > self.pack_token_budget or len(block) >= self.max_pack_size):
+                blocks.append(block)
+                block = []
+                block_tokens = 0
+            block.append(index)
+            block_tokens += item_tokens
+        
+        if block:
+            blocks.append(block)
+        
+        return blocks
+    
+    def _build_packed_prompt(self, products: List[Dict], marketplace: str) -> str:
+        """Build one prompt that categorizes a block of products."""
+        
+        items_text = "\n".join(
+            self._render_packed_item(item_id, product) for item_id, product in enumerate(products, 1)
+        )
+        
+        # Large taxonomies: the union of every item's candidates, so the prompt grows with the block, not the tree
+        candidates = None
+        if len(self._taxonomy(marketplace).leaves) > self.max_prompt_categories:
+            candidates = list(dict.fromkeys(
+                path for product in products for path in self._candidate_paths(product, marketplace)
+            ))
+        taxonomy_text = self._render_taxonomy(marketplace, candidates)
+        
+        prompt = f"""Categorize each of these products in {marketplace.title()} taxonomy:
+{items_text}
+
+Available categories:
+{taxonomy_text}
+
+Return a JSON object mapping each product number to its category path in format "Main Category > Subcategory".
+Example: {{"1": "Electronics > Cell Phones", "2": "Home & Garden > Kitchen"}}
+
+JSON:"""
+        
+        return prompt
+    
+    def _packed_completion_kwargs(self, products: List[Dict], marketplace: str) -> Dict:
+        """Build the chat completion request for a packed block."""
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": self._build_packed_prompt(products, marketplace)
+                }
+            ],
+            "max_tokens": 20 * len(products) + 20,
+            "temperature": 0.1
+        }
+    
+    def _parse_packed_response(self, result_text: str, count: int) -> Dict[int, str]:
+        """
+        Parse a packed response into per-item categories.
+        
+        Items that are missing, out of range or not a "Main > Sub" path are
+        left out so the caller can retry them individually.
+        
+        Args:
+            result_text: Raw model output
+            count: Number of products in the block
+            
+        Returns:
+            Dict[int, str]: Zero-based item index to category
+        """
+        match = re.search(r'\{.*\}', result_text, re.DOTALL)
+        if not match:
+            return {}
+        
+        try:
+            parsed = json.loads(match.group(0))
+        except ValueError:
+            return {}
+        
+        if not isinstance(parsed, dict):
+            return {}
+        
+        categories = {}
+        for key, value in parsed.items():
+            try:
+                index = int(key) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < count and isinstance(value, str) and ' > ' in value:
+                categories[index] = value.strip()
+        
+        return categories
+    
+    async def _aguess_packed_block(self, products: List[Dict], marketplace: str) -> Dict[int, str]:
+        """
+        Categorize a block of products with a single completion.
+        
+        Args:
+            products: Products in the block
+            marketplace: Target marketplace
+            
+        Returns:
+            Dict[int, str]: Zero-based item index to category for the items that parsed
+            
+        Raises:
+            DeadlineExceeded: The block ran out of its latency budget
+        """
+        request = self._packed_completion_kwargs(products, marketplace)
+        
+        try:
+            response = await self.scheduler.acall(
+                lambda: self.async_client.chat.completions.create(**request),
+                priority=PRIORITY_BATCH,
+                estimated_tokens=estimate_request_tokens(request),
+                component='category_packed'
+            )
+            
+            return self._parse_packed_response(response.choices[0].message.content, len(products))
+            
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error guessing packed categories: {e}")
+            return {}
+    
+    def batch_guess_categories(self, products: List[Dict], marketplace: str = 'amazon',
+                               max_concurrency: Optional[int] = None, packed: bool = False) -> List[str]:
         """
         Guess categories for multiple products in batch.
         
+        Runs the async path with bounded concurrency on the shared client
+        loop, so connections stay warm across batches. When called from inside
+        a running event loop, falls back to sequential calls; use
+        abatch_guess_categories there instead.
+        
         Args:
             products: List of product dictionaries
             marketplace: Target marketplace
+            max_concurrency: Maximum in-flight requests (defaults to self.max_concurrency)
+            packed: Send several products per completion (see abatch_guess_categories_detailed)
             
         Returns:
-            List[str]: List of predicted categories
+            List[str]: List of predicted categories, in input order
         """
-        categories = []
+        results = self.batch_guess_categories_detailed(products, marketplace, max_concurrency, packed)
+        return [result['category'] for result in results]
+    
+    def batch_guess_categories_detailed(self, products: List[Dict], marketplace: str = 'amazon',
+                                        max_concurrency: Optional[int] = None, packed: bool = False) -> List[Dict]:
+        """
+        Sync entry point for abatch_guess_categories_detailed (see batch_guess_categories).
         
-        for product in products:
-            category = self.guess_category(product, marketplace)
-            categories.append(category)
+        Returns:
+            List[Dict]: Results shaped like guess_category_detailed, in input order
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return run_sync(self.abatch_guess_categories_detailed(products, marketplace, max_concurrency, packed))
         
-        return categories
+        return [self.guess_category_detailed(product, marketplace) for product in products]
+    
+    async def abatch_guess_categories(self, products: List[Dict], marketplace: str = 'amazon',
+                                      max_concurrency: Optional[int] = None, packed: bool = False) -> List[str]:
+        """
+        Guess categories for multiple products concurrently.
+        
+        Args:
+            products: List of product dictionaries
+            marketplace: Target marketplace
+            max_concurrency: Maximum in-flight requests (defaults to self.max_concurrency)
+            packed: Send several products per completion
+            
+        Returns:
+            List[str]: List of predicted categories, in input order
+        """
+        results = await self.abatch_guess_categories_detailed(products, marketplace, max_concurrency, packed)
+        return [result['category'] for result in results]
+    
+    async def abatch_guess_categories_detailed(self, products: List[Dict], marketplace: str = 'amazon',
+                                               max_concurrency: Optional[int] = None,
+                                               packed: bool = False) -> List[Dict]:
+        """
+        Guess categories for multiple products concurrently, tagged with their tier.
+        
+        Local-classifier and cache hits are resolved without touching the
+        network, and products that share a cache key, or are near duplicates of
+        another pending product, are only requested once.
+        In packed mode the remaining products are grouped into token-budgeted
+        blocks, one completion per block; items missing or malformed in a
+        block's answer are retried with a single-product request. Products
+        whose request runs out of its latency budget get tier 'deadline'.
+        
+        Args:
+            products: List of product dictionaries
+            marketplace: Target marketplace
+            max_concurrency: Maximum in-flight requests (defaults to self.max_concurrency)
+            packed: Send several products per completion
+            
+        Returns:
+            List[Dict]: Results shaped like guess_category_detailed, in input order
+        """
+        results: List[Optional[Dict]] = [None] * len(products)
+        pending: Dict[str, List[int]] = {}
+        batch_duplicates = self.near_duplicates.spawn()
+        
+        for index, product in enumerate(products):
+            resolved = self._resolve_offline(product, marketplace)
+            if resolved is not None:
+                results[index] = resolved
+                continue
+            key = self._cache_key(product, marketplace)
+            if key not in pending:
+                title, brand = product.get('title', ''), product.get('brand', '')
+                similar_key = batch_duplicates.match(marketplace, title, brand)
+                if similar_key is not None:
+                    NEAR_DUPLICATE_HITS.labels('category').inc()
+                    key = similar_key
+                else:
+                    batch_duplicates.add(marketplace, key, title, brand)
+            pending.setdefault(key, []).append(index)
+        
+        if pending:
+            semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+            
+            async def guess(indices: List[int]) -> None:
+                async with semaphore:
+                    result = await self.aguess_category_detailed(products[indices[0]], marketplace, PRIORITY_BATCH)
+                for index in indices:
+                    results[index] = result
+            
+            async def guess_block(keys: List[str]) -> None:
+                block = [products[pending[key][0]] for key in keys]
+                async with semaphore:
+                    try:
+                        answers = await self._aguess_packed_block(block, marketplace)
+                    except DeadlineExceeded:
+                        # No budget left to retry items one by one either
+                        for key, product in zip(keys, block):
+                            result = self._local_fallback(product, marketplace)
+                            for index in pending[key]:
+                                results[index] = result
+                        return
+                retries = []
+                for item_index, key in enumerate(keys):
+                    if item_index not in answers:
+                        retries.append(guess(pending[key]))
+                        continue
+                    category = self._normalize_answer(answers[item_index], block[item_index], marketplace)
+                    self._remember(block[item_index], marketplace, category)
+                    result = self._result(category, 'llm')
+                    for index in pending[key]:
+                        results[index] = result
+                await asyncio.gather(*retries)
+            
+            if packed:
+                keys = list(pending)
+                blocks = self._pack_products([products[pending[key][0]] for key in keys])
+                await asyncio.gather(*(guess_block([keys[i] for i in block]) for block in blocks))
+            else:
+                await asyncio.gather(*(guess(indices) for indices in pending.values()))
+        
+        return results
+    
+    def bulk_request(self, product_data: Dict, marketplace: str = 'amazon') -> Optional[Tuple[str, Dict]]:
+        """
+        Chat completion request for an offline bulk job (see bulk_jobs).
+        
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, etc.)
+            marketplace: Target marketplace
+            
+        Returns:
+            Optional[Tuple[str, Dict]]: Cache key and request body, or None when the product is
+                answered offline (local classifier or cache)
+        """
+        if self._resolve_offline(product_data, marketplace) is not None:
+            return None
+        return self._cache_key(product_data, marketplace), self._completion_kwargs(product_data, marketplace)
+    
+    def ingest_bulk_answer(self, product_data: Dict, marketplace: str, answer: str) -> Dict:
+        """
+        Normalize, cache and learn a bulk job answer exactly like a live one.
+        
+        Returns:
+            Dict: Result shaped like guess_category_detailed (tier 'llm')
+        """
+        category = self._normalize_answer(answer, product_data, marketplace)
+        self._remember(product_data, marketplace, category)
+        return self._result(category, 'llm')
     
     def get_category_confidence(self, product_data: Dict, predicted_category: str, marketplace: str = 'amazon') -> float:
         """
@@ -170,8 +750,9 @@ if __name__ == "__main__":
         'description': 'Latest iPhone with advanced camera system and A16 chip'
     }
     
-    category = guesser.guess_category(test_product, 'amazon')
+    result = guesser.guess_category_detailed(test_product, 'amazon')
+    category = result['category']
     confidence = guesser.get_category_confidence(test_product, category, 'amazon')
     
-    print(f"Predicted category: {category}")
+    print(f"Predicted category: {category} (tier: {result['tier']})")
     print(f"Confidence: {confidence:.2f}") 
\ No newline at end of file
@@ -0,0 +1,242 @@
+import re
+import csv
+import sys
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from server.utils.cache_backend import CacheBackend, create_cache
+
+# Bump when matching rules change so cached mappings are rebuilt
+MAPPER_VERSION = 2
+
+# Scores for each way a header can match a target column
+EXACT_SCORE = 1.0
+ALIAS_SCORE = 0.95
+
+# Exact matches lose this much per position of the spelling in the target's list, so when two headers both
+# match a target exactly ('Brand Name', 'Manufacturer Name') the earlier spelling wins
+EXACT_RANK_STEP = 0.001
+
+# Fuzzy matches need this bigram (Dice) similarity, like the TS transformer's string-similarity check,
+# and comparable lengths so "Manufacturer Part Number" does not pass for "Manufacturer Name"
+FUZZY_THRESHOLD = 0.7
+FUZZY_LENGTH_RATIO = 0.75
+
+# Normalized header names that mean the same thing across suppliers and marketplaces
+COMMON_ALIASES = [
+    ('title', 'name', 'productname', 'itemname', 'producttitle', 'productnamerequired'),
+    ('brand', 'brandname'),
+    ('manufacturer', 'manufacturername'),
+    ('sku', 'itemsku', 'sellersku', 'productsku', 'yoursku', 'internalsku', 'skuid'),
+    ('price', 'sellingprice', 'standardprice', 'retailprice', 'listprice', 'minprice'),
+    ('description', 'productdescription', 'sitedescription', 'shortdescription', 'longdescription', 'bodyhtml'),
+    ('quantity', 'qty', 'stock', 'inventory', 'unitcount'),
+    ('productid', 'externalproductid', 'barcode', 'upc', 'gtin', 'ean'),
+    ('productidtype', 'externalproductidtype', 'idtype'),
+    ('mainimageurl', 'mainimage', 'imagelink', 'imageurl', 'image'),
+    ('partnumber', 'manufacturerpartnumber', 'mpn'),
+    ('model', 'modelnumber'),
+    ('color', 'colour', 'colorfinish'),
+    ('condition', 'itemcondition', 'skucondition'),
+]
+
+_LABEL_SUFFIX_RE = re.compile(r'(\s+\d+)?\s*(\(\+\))?\s*$')
+
+def normalize_header(header: str) -> str:
+    """Lowercase alphanumerics only, so 'Product_Title ' and 'product title' compare equal."""
+    return re.sub(r'[^a-z0-9]', '', (header or '').lower())
+
+def _bigrams(text: str) -> Set[str]:
+    return {text[index:index + 2] for index in range(len(text) - 1)}
+
+def _dice(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return 2.0 * len(left & right) / (len(left) + len(right))
+
+class ColumnMapper:
+    """
+    Maps feed headers to target columns without an LLM.
+
+    Every spelling a target accepts (its key, its display label and aliases)
+    is normalized into an exact-match table, alias groups are indexed by
+    normalized name, and a bigram inverted index narrows fuzzy candidates, so
+    a header row is mapped in one pass. Assignment is greedy by score, each
+    header and target used once. Results are cached per header signature,
+    which makes repeat uploads from the same supplier a single cache lookup.
+    """
+
+    def __init__(self, targets: Sequence[Tuple[str, Iterable[str]]], aliases: Optional[Sequence[Iterable[str]]] = None,
+                 cache: Optional[CacheBackend] = None, fuzzy: bool = True, namespace: str = ''):
+        """
+        Args:
+            targets: (target column, spellings) pairs in column order; the column name itself always matches
+            aliases: Groups of interchangeable normalized names (COMMON_ALIASES by default)
+            cache: Mapping cache (default `create_cache('column_mappings')`)
+            fuzzy: Allow bigram-similarity matches
+            namespace: Distinguishes mappers over the same targets in the cache
+        """
+        self.fuzzy = fuzzy
+        self.cache = cache if cache is not None else create_cache('column_mappings')
+        self.stats = {'hits': 0, 'misses': 0}
+
+        self._targets: List[str] = []
+        # Normalized spelling -> [(target index, rank of the spelling in the target's list)]
+        self._exact: Dict[str, List[Tuple[int, int]]] = {}
+        self._forms: List[Set[str]] = []
+        for name, spellings in targets:
+            if name in self._targets:
+                continue
+            index = len(self._targets)
+            self._targets.append(name)
+            ranks: Dict[str, int] = {}
+            for rank, spelling in enumerate([name, *spellings]):
+                ranks.setdefault(normalize_header(spelling), rank)
+            ranks.pop('', None)
+            self._forms.append(set(ranks))
+            for form, rank in ranks.items():
+                self._exact.setdefault(form, []).append((index, rank))
+
+        self._groups: Dict[str, Set[int]] = {}
+        for group in (COMMON_ALIASES if aliases is None else aliases):
+            members = {normalize_header(name) for name in group}
+            matched = {index for form in members for index, _ in self._exact.get(form, ())}
+            for member in members:
+                self._groups.setdefault(member, set()).update(matched)
+
+        self._bigram_index: Dict[str, Set[Tuple[int, str]]] = {}
+        for index, forms in enumerate(self._forms):
+            for form in forms:
+                for bigram in _bigrams(form):
+                    self._bigram_index.setdefault(bigram, set()).add((index, form))
+
+        signature = '\x1f'.join(f"{name}\x1e{','.join(sorted(forms))}" for name, forms in zip(self._targets, self._forms))
+        digest = hashlib.blake2b(f"{MAPPER_VERSION}\x1d{namespace}\x1d{fuzzy}\x1d{signature}".encode('utf-8'),
+                                 digest_size=8).hexdigest()
+        self._cache_prefix = f"columns_{digest}_"
+
+    @classmethod
+    def for_template(cls, template, cache: Optional[CacheBackend] = None) -> 'ColumnMapper':
+        """Mapper over a compiled template's columns (see template_cache), matching keys and labels."""
+        targets = [(field['name'], (field['label'], _LABEL_SUFFIX_RE.sub('', field['label'])))
+                   for field in template.fields]
+        return cls(targets, cache=cache, namespace=template.source or '')
+
+    @property
+    def targets(self) -> List[str]:
+        return list(self._targets)
+
+    def _candidates(self, header: str) -> List[Tuple[float, int]]:
+        """Scored target candidates for one normalized header."""
+        scored: Dict[int, float] = {}
+        for index, rank in self._exact.get(header, ()):
+            scored[index] = EXACT_SCORE - rank * EXACT_RANK_STEP
+        for index in self._groups.get(header, ()):
+            scored.setdefault(index, ALIAS_SCORE)
+
+        if self.fuzzy and not scored:
+            header_bigrams = _bigrams(header)
+            seen = set()
+            for bigram in header_bigrams:
+                for index, form in self._bigram_index.get(bigram, ()):
+                    if (index, form) in seen:
+                        continue
+                    seen.add((index, form))
+                    if min(len(form), len(header)) / max(len(form), len(header)) < FUZZY_LENGTH_RATIO:
+                        continue
+                    score = _dice(header_bigrams, _bigrams(form)) * ALIAS_SCORE
+                    if score >= FUZZY_THRESHOLD * ALIAS_SCORE and score > scored.get(index, 0.0):
+                        scored[index] = score
+
+        return [(score, index) for index, score in scored.items()]
+
+    def _match(self, headers: Sequence[str]) -> Dict[str, str]:
+        pairs = []
+        for position, header in enumerate(headers):
+            for score, index in self._candidates(normalize_header(header)):
+                pairs.append((-score, index, position))
+        pairs.sort()
+
+        mapping: Dict[int, int] = {}
+        used_headers = set()
+        for _, index, position in pairs:
+            if index in mapping or position in used_headers:
+                continue
+            mapping[index] = position
+            used_headers.add(position)
+
+        return {self._targets[index]: headers[position] for index, position in sorted(mapping.items())}
+
+    def map(self, headers: Sequence[str]) -> Dict[str, str]:
+        """
+        Map a feed's header row to target columns.
+
+        Args:
+            headers: Input header row
+
+        Returns:
+            Dict[str, str]: Target column -> input header, for the targets found
+        """
+        headers = list(headers)
+        key = self._cache_prefix + hashlib.sha256('\x1f'.join(headers).encode('utf-8')).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            return dict(cached)
+
+        self.stats['misses'] += 1
+        mapping = self._match(headers)
+        self.cache.set(key, mapping)
+        return dict(mapping)
+
+    def unmapped(self, headers: Sequence[str]) -> List[str]:
+        """Input headers left for manual or LLM mapping."""
+        mapped = set(self.map(headers).values())
+        return [header for header in headers if header not in mapped]
+
+_mappers: Dict[Tuple[str, str], ColumnMapper] = {}
+_mappers_lock = threading.Lock()
+
+def get_mapper(marketplace: str, category: str = 'base') -> Optional[ColumnMapper]:
+    """
+    Shared mapper for a marketplace category.
+
+    Marketplaces with a template (see templates_config.get_template) map onto
+    its full column set; the others onto their MARKETPLACES column list.
+    """
+    from templates_config import MARKETPLACES, get_template
+
+    with _mappers_lock:
+        key = (marketplace, category or 'base')
+        if key not in _mappers:
+            template = get_template(marketplace, category)
+            if template is not None:
+                _mappers[key] = ColumnMapper.for_template(template)
+            elif marketplace in MARKETPLACES:
+                _mappers[key] = ColumnMapper([(column, ()) for column in MARKETPLACES[marketplace]['columns']],
+                                             namespace=marketplace)
+            else:
+                return None
+        return _mappers[key]
+
+def map_headers(headers: Sequence[str], marketplace: str, category: str = 'base') -> Dict[str, str]:
+    """Map headers onto a marketplace's columns; empty for unknown marketplaces."""
+    mapper = get_mapper(marketplace, category)
+    return mapper.map(headers) if mapper else {}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m server.utils.column_mapper <marketplace> <feed.csv> [category]")
+        sys.exit(1)
+
+    with open(sys.argv[2], newline='', encoding='utf-8-sig', errors='replace') as handle:
+        feed_headers = next(csv.reader(handle), [])
+    mapper = get_mapper(sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else 'base')
+    if mapper is None:
+        print(f"Unknown marketplace: {sys.argv[1]}")
+        sys.exit(1)
+    for target, header in mapper.map(feed_headers).items():
+        print(f"{target} <- {header}")
+    for header in mapper.unmapped(feed_headers):
+        print(f"(unmapped) {header}")
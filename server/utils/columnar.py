@@ -0,0 +1,209 @@
+import math
+from typing import Any, Dict, Iterator, List, Optional
+
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.enrich import ID_FIELDS, backfill_parts, map_fields
+from server.utils.fused_enricher import FusedEnricher
+from server.utils.product_id_enricher import ProductIDEnricher
+
+# Product fields read from a table; every other column is left untouched
+PRODUCT_FIELDS = ('title', 'brand', 'description', 'upc', 'gtin', 'asin')
+
+# Record fields: the product fields plus the enrichers' backfill marker
+RECORD_FIELDS = PRODUCT_FIELDS + ('backfill',)
+
+class ProductRecord:
+    """
+    Compact per-row product state.
+
+    Holds only the fields the enrichers read, in slots rather than a dict,
+    and supports the small mapping surface they use (get, item access,
+    copy), so it can stand in for a product dict anywhere.
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, title: str = '', brand: str = '', description: str = '', upc: str = '', gtin: str = '',
+                 asin: str = '', backfill: str = ''):
+        self.title = title
+        self.brand = brand
+        self.description = description
+        self.upc = upc
+        self.gtin = gtin
+        self.asin = asin
+        self.backfill = backfill
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in RECORD_FIELDS:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in RECORD_FIELDS
+
+    def copy(self) -> 'ProductRecord':
+        return ProductRecord(self.title, self.brand, self.description, self.upc, self.gtin, self.asin, self.backfill)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+    def __repr__(self) -> str:
+        return f"ProductRecord({', '.join(f'{field}={getattr(self, field)!r}' for field in RECORD_FIELDS)})"
+
+def _is_arrow(table) -> bool:
+    return hasattr(table, 'column_names') and hasattr(table, 'append_column')
+
+def _column_names(table) -> List[str]:
+    return list(table.column_names) if _is_arrow(table) else [str(name) for name in table.columns]
+
+def _column_values(table, name: str) -> List[Any]:
+    if _is_arrow(table):
+        return table.column(name).to_pylist()
+    return table[name].tolist()
+
+def _cell(value: Any) -> str:
+    """Text of a cell; missing values become '' and integral floats (numeric ID columns) lose their '.0'."""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+def read_products(table, field_map: Optional[Dict[str, str]] = None) -> List[ProductRecord]:
+    """
+    Build product records from the title/brand/description/ID columns of a table.
+
+    Args:
+        table: pandas DataFrame or pyarrow Table
+        field_map: Product field -> column name (mapped from the column names by default)
+
+    Returns:
+        List[ProductRecord]: One record per row; other columns are never read
+    """
+    field_map = field_map if field_map is not None else map_fields(_column_names(table))
+    rows = len(table)
+
+    columns = {}
+    for field in PRODUCT_FIELDS:
+        column = field_map.get(field)
+        columns[field] = [_cell(value) for value in _column_values(table, column)] if column else [''] * rows
+
+    return [ProductRecord(*values) for values in zip(*(columns[field] for field in PRODUCT_FIELDS))]
+
+def with_columns(table, columns: Dict[str, List[Any]]):
+    """
+    Return table with columns added or replaced.
+
+    Both share their existing columns with the input rather than copying
+    them: Arrow tables by construction, pandas frames through copy-on-write
+    (always on from pandas 3, switched on for the assign before that).
+
+    Args:
+        table: pandas DataFrame or pyarrow Table
+        columns: Column name -> values, one per row
+
+    Returns:
+        Same type as table
+    """
+    if not _is_arrow(table):
+        import pandas as pd
+
+        if int(pd.__version__.split('.')[0]) >= 3:
+            return table.assign(**columns)
+        with pd.option_context('mode.copy_on_write', True):
+            return table.assign(**columns)
+
+    import pyarrow as pa
+
+    for name, values in columns.items():
+        array = pa.array(values, type=pa.string())
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, array)
+        else:
+            table = table.append_column(name, array)
+    return table
+
+def _batches(records: List[ProductRecord], size: int) -> Iterator[List[ProductRecord]]:
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+def enrich_table(table, guesser: Optional[CategoryGuesser] = None, enricher: Optional[ProductIDEnricher] = None,
+                 marketplace: str = 'amazon', field_map: Optional[Dict[str, str]] = None, batch_size: int = 1000,
+                 packed: bool = False, fused: bool = False):
+    """
+    Enrich a DataFrame or Arrow table, returning it with the results as columns.
+
+    Only the product columns are read (into ProductRecords); the results
+    come back as category / category_tier columns, filled identifier
+    columns (the table's own UPC/GTIN/ASIN columns when it has them) and a
+    backfill column (see enrich.backfill_parts).
+
+    Args:
+        table: pandas DataFrame or pyarrow Table
+        guesser: Category guesser, or None to skip categories
+        enricher: ID enricher, or None to skip identifiers
+        marketplace: Target marketplace taxonomy
+        field_map: Product field -> column name (mapped from the column names by default)
+        batch_size: Rows per enrichment batch
+        packed: Use packed multi-product category prompts
+        fused: One completion per product for category and identifiers (needs guesser and enricher)
+
+    Returns:
+        Same type as table, with the result columns added or replaced
+    """
+    field_map = field_map if field_map is not None else map_fields(_column_names(table))
+    records = read_products(table, field_map)
+
+    categories: List[str] = []
+    tiers: List[str] = []
+    identifiers: Dict[str, List[str]] = {id_type: [] for id_type in ID_FIELDS}
+    backfill: List[str] = []
+
+    fused_enricher = None
+    if fused and guesser is not None and enricher is not None:
+        fused_enricher = FusedEnricher(guesser, enricher, scheduler=guesser.scheduler)
+
+    for batch in _batches(records, batch_size):
+        results, enriched = None, None
+        if fused_enricher is not None:
+            results, enriched = fused_enricher.batch_enrich(batch, marketplace)
+        else:
+            if guesser is not None:
+                results = guesser.batch_guess_categories_detailed(batch, marketplace, packed=packed)
+            if enricher is not None:
+                enriched = enricher.batch_enrich_products(batch)
+
+        if results is not None:
+            categories.extend(result['category'] for result in results)
+            tiers.extend(result['tier'] for result in results)
+        if enriched is not None:
+            for id_type in ID_FIELDS:
+                identifiers[id_type].extend(product.get(id_type) or '' for product in enriched)
+        for index in range(len(batch)):
+            backfill.append(','.join(backfill_parts(results[index] if results is not None else None,
+                                                    enriched[index] if enriched is not None else None)))
+
+    columns: Dict[str, List[Any]] = {}
+    if guesser is not None:
+        columns['category'] = categories
+        columns['category_tier'] = tiers
+    if enricher is not None:
+        for id_type in ID_FIELDS:
+            columns[field_map.get(id_type, id_type)] = identifiers[id_type]
+    if guesser is not None or enricher is not None:
+        columns['backfill'] = backfill
+
+    return with_columns(table, columns)
@@ -0,0 +1,428 @@
+import io
+import os
+import sys
+import csv
+import time
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.column_mapper import ColumnMapper
+from server.utils.fused_enricher import FusedEnricher
+from server.utils.llm_scheduler import LLMScheduler, job_deadline
+from server.utils.marketplace_writer import MarketplaceWriter
+from server.utils.product_catalog import ProductCatalog
+from server.utils.product_id_enricher import ProductIDEnricher
+from server.utils.row_fingerprints import FingerprintStore, IncrementalRun
+
+# Input headers (normalized: lowercase alphanumerics) recognized for each product field
+FIELD_ALIASES = {
+    'title': ['title', 'productname', 'name', 'itemname', 'producttitle', 'productnamerequired'],
+    'brand': ['brand', 'brandname', 'manufacturer', 'manufacturername', 'vendor'],
+    'description': ['description', 'sitedescription', 'productdescription', 'shortdescription', 'bodyhtml'],
+    'upc': ['upc', 'upca', 'upccode'],
+    'gtin': ['gtin', 'gtin13', 'ean', 'ean13'],
+    'asin': ['asin'],
+}
+
+ID_FIELDS = ('upc', 'gtin', 'asin')
+
+# Columns added to the output when the input has no column for them
+OUTPUT_FIELDS = ('category', 'category_tier', 'upc', 'gtin', 'asin', 'backfill')
+
+# Category tiers of local stand-in answers: the LLM ran out of budget, or a bulk job returned no answer
+BACKFILL_TIERS = ('deadline', 'unanswered')
+
+_field_mapper: Optional[ColumnMapper] = None
+
+def map_fields(headers: List[str]) -> Dict[str, str]:
+    """
+    Map product fields to input headers.
+
+    Matching goes through the column-mapping engine over FIELD_ALIASES, so
+    near-miss spellings are picked up and a supplier's header row is only
+    resolved once.
+
+    Args:
+        headers: Input header row
+
+    Returns:
+        Dict[str, str]: Product field -> input header, for the fields found
+    """
+    global _field_mapper
+    if _field_mapper is None:
+        _field_mapper = ColumnMapper(list(FIELD_ALIASES.items()), namespace='feed_fields')
+    return _field_mapper.map(headers)
+
+def sniff_delimiter(sample: str) -> str:
+    """Pick the delimiter of a feed from its first line (file extensions lie)."""
+    first_line = sample.splitlines()[0] if sample else ''
+    try:
+        return csv.Sniffer().sniff(first_line, delimiters=',\t;|').delimiter
+    except csv.Error:
+        return '\t' if first_line.count('\t') > first_line.count(',') else ','
+
+def read_feed(handle, delimiter: Optional[str] = None) -> Tuple[List[str], str, Iterator[Dict[str, str]]]:
+    """
+    Open a CSV/TSV feed lazily.
+
+    Args:
+        handle: Text file object positioned at the header
+        delimiter: Field delimiter; sniffed from the header line if omitted
+
+    Returns:
+        Tuple[List[str], str, Iterator[Dict[str, str]]]: Header row, delimiter and a row iterator
+    """
+    header_line = handle.readline()
+    delimiter = delimiter or sniff_delimiter(header_line)
+    headers = next(csv.reader([header_line], delimiter=delimiter), [])
+    return headers, delimiter, csv.DictReader(handle, fieldnames=headers, delimiter=delimiter)
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Yield lists of up to size items without materializing the iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def to_product(row: Dict[str, str], field_map: Dict[str, str]) -> Dict[str, str]:
+    """Project a feed row onto the small dict the enrichers expect."""
+    return {field: (row.get(header) or '').strip() for field, header in field_map.items()}
+
+def backfill_parts(result: Optional[Dict], enriched: Optional[Dict]) -> List[str]:
+    """Parts of a row answered locally because no LLM answer was available ('category', 'ids')."""
+    parts = []
+    if result is not None and result['tier'] in BACKFILL_TIERS:
+        parts.append('category')
+    if enriched is not None and enriched.get('backfill'):
+        parts.append('ids')
+    return parts
+
+def enrich_rows(rows: Iterable[Dict[str, str]], field_map: Dict[str, str], guesser: Optional[CategoryGuesser],
+                enricher: Optional[ProductIDEnricher], marketplace: str = 'amazon', batch_size: int = 100,
+                packed: bool = False, fused: bool = False) -> Iterator[Dict[str, str]]:
+    """
+    Enrich feed rows batch by batch, yielding each row as soon as its batch is done.
+
+    At most batch_size rows are held in memory at a time.
+
+    Args:
+        rows: Feed rows
+        field_map: Product field -> input header (see map_fields)
+        guesser: Category guesser, or None to skip categories
+        enricher: ID enricher, or None to skip identifiers
+        marketplace: Target marketplace for categories
+        batch_size: Rows per batch
+        packed: Use packed multi-product category prompts
+        fused: Ask for the category and identifiers in one completion per product
+            (needs both guesser and enricher; takes precedence over packed)
+
+    Yields:
+        Dict[str, str]: Input row plus category / identifier columns, and a backfill column naming
+            the parts answered locally because the LLM ran out of its latency budget
+    """
+    fused_enricher = None
+    if fused and guesser is not None and enricher is not None:
+        fused_enricher = FusedEnricher(guesser, enricher, scheduler=guesser.scheduler)
+
+    for batch in batched(rows, batch_size):
+        products = [to_product(row, field_map) for row in batch]
+
+        if fused_enricher is not None:
+            results, enriched_products = fused_enricher.batch_enrich(products, marketplace)
+            for row, result, enriched in zip(batch, results, enriched_products):
+                row['category'] = result['category']
+                row['category_tier'] = result['tier']
+                for id_type in ID_FIELDS:
+                    if enriched.get(id_type):
+                        row[field_map.get(id_type, id_type)] = enriched[id_type]
+                row['backfill'] = ','.join(backfill_parts(result, enriched))
+            yield from batch
+            continue
+
+        results = enriched_products = None
+        if guesser is not None:
+            results = guesser.batch_guess_categories_detailed(products, marketplace, packed=packed)
+            for row, result in zip(batch, results):
+                row['category'] = result['category']
+                row['category_tier'] = result['tier']
+
+        if enricher is not None:
+            enriched_products = enricher.batch_enrich_products(products)
+            for row, enriched in zip(batch, enriched_products):
+                for id_type in ID_FIELDS:
+                    if enriched.get(id_type):
+                        row[field_map.get(id_type, id_type)] = enriched[id_type]
+
+        for index, row in enumerate(batch):
+            row['backfill'] = ','.join(backfill_parts(results[index] if results is not None else None,
+                                                      enriched_products[index] if enriched_products else None))
+
+        yield from batch
+
+def enrich_incremental(rows: Iterable[Dict[str, str]], run: IncrementalRun, enrich_batch,
+                       batch_size: int = 100, max_buffered_rows: Optional[int] = None) -> Iterator[Dict[str, str]]:
+    """
+    Enrich only new and changed rows, yielding every row in input order.
+
+    Unchanged rows are held back until batch_size stale rows have gathered
+    (or max_buffered_rows rows are waiting), so enrichment still runs in
+    full batches when churn is low.
+
+    Args:
+        rows: Feed rows
+        run: IncrementalRun for this upload
+        enrich_batch: Callable enriching a list of rows in place (e.g. a wrapper over enrich_rows)
+        batch_size: Stale rows per enrichment batch
+        max_buffered_rows: Rows held in memory at most (defaults to 50 batches)
+
+    Yields:
+        Dict[str, str]: Rows with stored or fresh enrichment
+    """
+    max_buffered_rows = max_buffered_rows or batch_size * 50
+    buffered: List[Dict[str, str]] = []
+    fingerprints: List[Tuple[str, str, str]] = []
+    stale: List[Dict[str, str]] = []
+
+    for batch in batched(rows, batch_size):
+        stale_indices, batch_fingerprints = run.split(batch)
+        stale.extend(batch[index] for index in stale_indices)
+        buffered.extend(batch)
+        fingerprints.extend(batch_fingerprints)
+
+        if len(stale) >= batch_size or len(buffered) >= max_buffered_rows:
+            if stale:
+                enrich_batch(stale)
+            run.record(buffered, fingerprints)
+            yield from buffered
+            buffered, fingerprints, stale = [], [], []
+
+    if stale:
+        enrich_batch(stale)
+    run.record(buffered, fingerprints)
+    yield from buffered
+
+def publish_outputs(marketplaces: str, directory: str, output_format: str, input_path: str) -> Dict[str, str]:
+    """Marketplace -> output path for --publish ('all' expands to every templates_config marketplace)."""
+    from templates_config import MARKETPLACES
+
+    if marketplaces == 'all':
+        names = list(MARKETPLACES)
+    else:
+        names = [name.strip() for name in marketplaces.split(',') if name.strip()]
+    stem = 'feed' if input_path == '-' else os.path.splitext(os.path.basename(input_path))[0]
+    os.makedirs(directory, exist_ok=True)
+    return {name: os.path.join(directory, f"{stem}.{name}.{output_format}") for name in names}
+
+def output_headers(headers: List[str], field_map: Dict[str, str]) -> List[str]:
+    extra = [field for field in OUTPUT_FIELDS if field not in field_map and field not in headers]
+    return headers + extra
+
+# Per-process state of sharded workers, set up once by _init_worker
+_worker: Dict[str, Any] = {}
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    """
+    Build the enrichers of one worker process.
+
+    The provider rate limits are split evenly across workers, since every
+    process runs its own scheduler; catalogs and templates are memory-mapped,
+    so their pages are shared between workers.
+    """
+    workers = max(1, options['workers'])
+    scheduler = LLMScheduler(
+        requests_per_minute=float(os.getenv('LLM_REQUESTS_PER_MINUTE', '500')) / workers,
+        tokens_per_minute=float(os.getenv('LLM_TOKENS_PER_MINUTE', '200000')) / workers
+    )
+    _worker.clear()
+    _worker.update(options)
+    _worker['guesser'] = CategoryGuesser(scheduler=scheduler) if options['categories'] else None
+    _worker['enricher'] = ProductIDEnricher(scheduler=scheduler) if options['ids'] else None
+
+def _enrich_shard(shard: int, rows: List[Dict[str, str]]) -> Tuple[int, str, Dict[str, Any]]:
+    """Enrich one shard in a worker and serialize it to CSV text (without header)."""
+    started = time.time()
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=_worker['fieldnames'], delimiter=_worker['delimiter'],
+                            extrasaction='ignore')
+    # The job deadline is wall-clock so it means the same in every worker
+    deadline_at = _worker.get('deadline_at')
+    with job_deadline(deadline_at - time.time() if deadline_at is not None else None):
+        writer.writerows(enrich_rows(rows, _worker['field_map'], _worker['guesser'], _worker['enricher'],
+                                     _worker['marketplace'], _worker['batch_size'], _worker['packed'],
+                                     _worker['fused']))
+    timing = {'shard': shard, 'rows': len(rows), 'seconds': time.time() - started, 'pid': os.getpid()}
+    return shard, output.getvalue(), timing
+
+def enrich_sharded(rows: Iterable[Dict[str, str]], options: Dict[str, Any], workers: int,
+                   chunk_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Enrich a feed across a process pool, yielding serialized shards in input order.
+
+    At most two shards per worker are in flight, so memory stays bounded by
+    chunk_size rather than by the feed.
+
+    Args:
+        rows: Feed rows
+        options: Worker options: field_map, fieldnames, delimiter, marketplace, batch_size, packed,
+            fused, categories and ids flags, and deadline_at (wall-clock job deadline or None)
+        workers: Worker processes
+        chunk_size: Rows per shard
+
+    Yields:
+        Tuple[str, Dict[str, Any]]: CSV text of the shard and its timing (shard, rows, seconds, pid)
+    """
+    options = dict(options, workers=workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as executor:
+        pending = deque()
+        shards = enumerate(batched(rows, chunk_size))
+        for shard, chunk in islice(shards, workers * 2):
+            pending.append(executor.submit(_enrich_shard, shard, chunk))
+        while pending:
+            _, text, timing = pending.popleft().result()
+            for shard, chunk in islice(shards, 1):
+                pending.append(executor.submit(_enrich_shard, shard, chunk))
+            yield text, timing
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m server.utils.enrich',
+        description='Stream a CSV/TSV product feed through category guessing and ID enrichment.'
+    )
+    parser.add_argument('input', help="Input feed path, or '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output path, or '-' for stdout (default)")
+    parser.add_argument('-m', '--marketplace', default='amazon', help='Target marketplace taxonomy')
+    parser.add_argument('-b', '--batch-size', type=int, default=100, help='Rows held in memory per batch')
+    parser.add_argument('-d', '--delimiter', help='Input delimiter (sniffed by default)')
+    parser.add_argument('--output-delimiter', help='Output delimiter (defaults to the input delimiter)')
+    parser.add_argument('--packed', action='store_true', help='Categorize several products per completion')
+    parser.add_argument('--fused', action='store_true',
+                        help='Ask for the category and identifiers in one completion per product')
+    parser.add_argument('--no-category', action='store_true', help='Skip category guessing')
+    parser.add_argument('--no-ids', action='store_true', help='Skip UPC/GTIN/ASIN enrichment')
+    parser.add_argument('--supplier', help='Re-enrich only rows that changed since this supplier\'s last upload')
+    parser.add_argument('--fingerprints', help='Row fingerprint store (default ENRICHMENT_FINGERPRINT_PATH)')
+    parser.add_argument('--delta-report', help='Write the incremental delta report (JSON) here')
+    parser.add_argument('--deadline', type=float,
+                        help='Latency budget of the whole job in seconds; rows still waiting on the LLM when it '
+                             'runs out get local answers and are marked in the backfill column')
+    parser.add_argument('--publish', help="Also write marketplace upload files: comma-separated marketplaces or 'all'")
+    parser.add_argument('--publish-dir', default='.', help='Directory for --publish outputs')
+    parser.add_argument('--publish-format', choices=('csv', 'xlsx'), default='csv', help='Format of --publish outputs')
+    parser.add_argument('-w', '--workers', type=int, default=int(os.getenv('ENRICH_WORKERS', '1')),
+                        help='Worker processes; more than 1 shards the feed across a process pool')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per shard when --workers > 1')
+    args = parser.parse_args(argv)
+
+    # Supplier descriptions can exceed csv's 128 KB default field limit
+    csv.field_size_limit(16 * 1024 * 1024)
+
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8-sig', errors='replace')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+
+    started = time.time()
+    count = 0
+    publisher = None
+    try:
+        headers, delimiter, rows = read_feed(source, args.delimiter)
+        field_map = map_fields(headers)
+        if 'title' not in field_map:
+            print(f"No title column found in {args.input}; headers: {', '.join(headers)}", file=sys.stderr)
+            return 1
+
+        fieldnames = output_headers(headers, field_map)
+        writer = csv.DictWriter(target, fieldnames=fieldnames, delimiter=args.output_delimiter or delimiter,
+                                extrasaction='ignore')
+        writer.writeheader()
+
+        if args.publish:
+            publisher = MarketplaceWriter(publish_outputs(args.publish, args.publish_dir, args.publish_format,
+                                                          args.input), fieldnames, field_map, args.publish_format)
+
+        if args.workers > 1 and args.supplier:
+            # Only the changed rows are enriched, which rarely warrants a process pool
+            print("Incremental runs enrich in-process; ignoring --workers", file=sys.stderr)
+
+        run = None
+        if args.workers > 1 and not args.supplier:
+            # Compile a CSV catalog once here rather than racing to do it in every worker
+            if os.getenv('PRODUCT_CATALOG_PATH') and not args.no_ids:
+                ProductCatalog.load(os.getenv('PRODUCT_CATALOG_PATH'))
+
+            options = {
+                'field_map': field_map,
+                'fieldnames': fieldnames,
+                'delimiter': args.output_delimiter or delimiter,
+                'marketplace': args.marketplace,
+                'batch_size': args.batch_size,
+                'packed': args.packed,
+                'fused': args.fused,
+                'categories': not args.no_category,
+                'ids': not args.no_ids,
+                'deadline_at': started + args.deadline if args.deadline is not None else None,
+            }
+            for text, timing in enrich_sharded(rows, options, args.workers, args.chunk_size):
+                target.write(text)
+                target.flush()
+                if publisher is not None:
+                    publisher.write_rows(csv.DictReader(io.StringIO(text), fieldnames=fieldnames,
+                                                        delimiter=options['delimiter']))
+                count += timing['rows']
+                print(f"Shard {timing['shard']}: {timing['rows']} rows in {timing['seconds']:.2f}s "
+                      f"(pid {timing['pid']})", file=sys.stderr)
+        else:
+            guesser = None if args.no_category else CategoryGuesser()
+            enricher = None if args.no_ids else ProductIDEnricher()
+
+            if args.supplier:
+                run = IncrementalRun(FingerprintStore(args.fingerprints), args.supplier, headers, field_map,
+                                     config=f"{args.marketplace}|{not args.no_category}|{not args.no_ids}")
+
+                def enrich_batch(stale: List[Dict[str, str]]) -> None:
+                    for _ in enrich_rows(stale, field_map, guesser, enricher, args.marketplace, len(stale),
+                                         args.packed, args.fused):
+                        pass
+
+                enriched = enrich_incremental(rows, run, enrich_batch, args.batch_size)
+            else:
+                enriched = enrich_rows(rows, field_map, guesser, enricher, args.marketplace, args.batch_size,
+                                       args.packed, args.fused)
+
+            with job_deadline(args.deadline - (time.time() - started) if args.deadline is not None else None):
+                for batch in batched(enriched, args.batch_size):
+                    writer.writerows(batch)
+                    target.flush()
+                    if publisher is not None:
+                        publisher.write_rows(batch)
+                    count += len(batch)
+
+        if run is not None:
+            report = run.finish()
+            print(f"Delta for {args.supplier}: {report['new']} new, {report['changed']} changed, "
+                  f"{report['unchanged']} unchanged, {report['removed']} removed; re-enriched "
+                  f"{report['reenriched']} of {report['rows']} rows", file=sys.stderr)
+            if args.delta_report:
+                with open(args.delta_report, 'w', encoding='utf-8') as handle:
+                    json.dump(report, handle, indent=2)
+    finally:
+        if publisher is not None:
+            publisher.close()
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    print(f"Enriched {count} rows in {time.time() - started:.2f}s", file=sys.stderr)
+    if publisher is not None:
+        for marketplace, rows in publisher.counts.items():
+            print(f"Published {rows} rows for {marketplace}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
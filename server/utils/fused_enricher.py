@@ -0,0 +1,244 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from server.utils.category_guesser import CategoryGuesser
+from server.utils.gs1 import derive_identifiers, derive_identifiers_bulk
+from server.utils.llm_client import get_client
+from server.utils.product_id_enricher import ProductIDEnricher
+from server.utils.llm_scheduler import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceeded, LLMScheduler, bind_context, estimate_request_tokens,
+    get_scheduler
+)
+
+SYSTEM_PROMPT = "You are a product data expert. Categorize the product using only the provided taxonomy and generate realistic product identifiers. Answer only in the requested line format, without explanations."
+
+_CATEGORY_LINE_RE = re.compile(r'^\s*category\s*:\s*(.+?)\s*$', re.I | re.M)
+
+class FusedEnricher:
+    """
+    Category guessing and ID generation in one completion per product.
+
+    Each part is resolved offline first with its own tiers (local
+    classifier and category cache; derived IDs, catalog and ID cache). Only
+    when both still need the LLM are they fused into one request, whose
+    answer is split back: the category is normalized and remembered by the
+    guesser, the identifiers validated and cached by the enricher. A part
+    missing from the answer falls back to its own single-purpose request,
+    unless the fused request ran out of its latency budget: then both parts
+    take their local answers and the product is marked for backfill.
+    """
+
+    def __init__(self, guesser: Optional[CategoryGuesser] = None, enricher: Optional[ProductIDEnricher] = None,
+                 scheduler: Optional[LLMScheduler] = None, max_workers: Optional[int] = None):
+        # Rate limiting, backoff and retries shared with every other LLM caller in the process
+        self.scheduler = scheduler or get_scheduler()
+        self.guesser = guesser or CategoryGuesser(scheduler=self.scheduler)
+        self.enricher = enricher or ProductIDEnricher(scheduler=self.scheduler)
+        self._client = None
+
+        # Worker threads used by batch_enrich for distinct products
+        self.max_workers = max_workers or int(os.getenv('PRODUCT_ID_ENRICHER_CONCURRENCY', '8'))
+
+        # Completions by request shape for the lifetime of this instance
+        self.stats = {'fused': 0, 'category_only': 0, 'ids_only': 0, 'fallbacks': 0}
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_client()
+
+    @client.setter
+    def client(self, value) -> None:
+        self._client = value
+
+    def enrich(self, product_data: Dict, marketplace: str = 'amazon', derived_ids: Optional[Dict[str, str]] = None,
+               priority: int = PRIORITY_INTERACTIVE) -> Tuple[Dict, Dict]:
+        """
+        Guess the category and fill missing identifiers of a product.
+
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, identifiers)
+            marketplace: Target marketplace taxonomy
+            derived_ids: Precomputed gs1.derive_identifiers result
+            priority: Scheduler priority of any LLM request
+
+        Returns:
+            Tuple[Dict, Dict]: Result shaped like CategoryGuesser.guess_category_detailed and
+                product data shaped like ProductIDEnricher.enrich_product_ids
+        """
+        category_result = self.guesser._resolve_offline(product_data, marketplace)
+        enriched_data, missing_ids = self.enricher._prepare_ids(
+            product_data, derived_ids if derived_ids is not None else derive_identifiers(product_data)
+        )
+
+        generated_ids = None
+        if missing_ids:
+            generated_ids = self.enricher._cached_ids(product_data, missing_ids)
+
+        if category_result is None and missing_ids and generated_ids is None:
+            self.stats['fused'] += 1
+            try:
+                category, generated_ids = self._request_fused(product_data, marketplace, missing_ids, priority)
+            except DeadlineExceeded:
+                enriched_data['backfill'] = 'ids'
+                return self.guesser._local_fallback(product_data, marketplace), enriched_data
+            if category is not None:
+                category_result = self.guesser._result(category, 'llm')
+
+        if category_result is None:
+            self.stats['category_only'] += 1
+            category_result = self.guesser._request_category(product_data, marketplace)
+        if missing_ids and generated_ids is None:
+            self.stats['ids_only'] += 1
+            try:
+                generated_ids = self.enricher._generate_missing_ids(product_data, missing_ids, priority)
+            except DeadlineExceeded:
+                enriched_data['backfill'] = 'ids'
+
+        if generated_ids:
+            self.enricher._apply_generated_ids(enriched_data, generated_ids)
+
+        return category_result, enriched_data
+
+    def _request_fused(self, product_data: Dict, marketplace: str, missing_ids: List[str],
+                       priority: int) -> Tuple[Optional[str], Optional[Dict[str, str]]]:
+        """
+        Ask for the category and the missing IDs in one completion.
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, str]]]: Category and generated IDs; a part that
+                could not be obtained is None so the caller can fall back to its own request
+        """
+        request = self._fused_completion_kwargs(product_data, marketplace, missing_ids)
+
+        try:
+            response = self.scheduler.call(
+                lambda: self.client.chat.completions.create(**request),
+                priority=priority,
+                estimated_tokens=estimate_request_tokens(request),
+                component='fused'
+            )
+            result_text = response.choices[0].message.content.strip()
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error in fused enrichment: {e}")
+            self.stats['fallbacks'] += 1
+            return None, None
+
+        category = None
+        match = _CATEGORY_LINE_RE.search(result_text)
+        if match and ' > ' in match.group(1):
+            category = self.guesser._normalize_answer(match.group(1), product_data, marketplace)
+            self.guesser._remember(product_data, marketplace, category)
+        else:
+            self.stats['fallbacks'] += 1
+
+        # Same parsing, validation and caching as a dedicated ID request; an answer without a single valid
+        # ID is not cached, so the enricher asks again with its own prompt
+        generated_ids = self.enricher._parse_generated_ids(result_text, missing_ids)
+        if not generated_ids:
+            self.stats['fallbacks'] += 1
+            return category, None
+        cache_key = self.enricher._id_cache_key(product_data, missing_ids)
+        self.enricher._store_generated_ids(product_data, missing_ids, cache_key, generated_ids)
+
+        return category, generated_ids
+
+    def _fused_completion_kwargs(self, product_data: Dict, marketplace: str, missing_ids: List[str]) -> Dict:
+        """Build the chat completion request for a fused category + ID prompt."""
+
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": self._build_fused_prompt(product_data, marketplace, missing_ids)
+                }
+            ],
+            "max_tokens": 150,
+            "temperature": 0.1
+        }
+
+    def _build_fused_prompt(self, product_data: Dict, marketplace: str, missing_ids: List[str]) -> str:
+        """Build one prompt asking for the category path and the missing identifiers."""
+
+        title = product_data.get('title', '')
+        brand = product_data.get('brand', '')
+        description = product_data.get('description', '')
+
+        candidates = self.guesser._candidate_paths(product_data, marketplace)
+        taxonomy_text = self.guesser._render_taxonomy(marketplace, candidates)
+        requirements_text = self.enricher._render_id_requirements(missing_ids)
+        id_lines = '\n'.join(f"{id_type.upper()}: <{id_type.upper()}>" for id_type in missing_ids)
+
+        prompt = f"""Enrich this product for the {marketplace.title()} marketplace:
+Title: {title}
+Brand: {brand}
+Description: {description}
+
+1. Choose the most specific category from the {marketplace.title()} taxonomy.
+Available categories:
+{taxonomy_text}
+2. Generate these identifiers:
+{requirements_text}
+Return exactly these lines:
+Category: <Main Category > Subcategory>
+{id_lines}"""
+
+        return prompt
+
+    def batch_enrich(self, products: List[Dict], marketplace: str = 'amazon',
+                     max_workers: Optional[int] = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Fused enrichment of many products.
+
+        Rows that share both the category cache key and the ID dedup key are
+        enriched once (concurrently across keys) and the result is copied to
+        the rest of the group.
+
+        Args:
+            products: List of product dictionaries
+            marketplace: Target marketplace taxonomy
+            max_workers: Threads for distinct products (defaults to self.max_workers)
+
+        Returns:
+            Tuple[List[Dict], List[Dict]]: Category results and enriched products, in input order
+        """
+        derived = derive_identifiers_bulk(products)
+
+        groups: Dict[Tuple, List[int]] = {}
+        for index, product in enumerate(products):
+            key = (self.guesser._cache_key(product, marketplace), self.enricher._dedup_key(product, derived[index]))
+            groups.setdefault(key, []).append(index)
+
+        def enrich(indices: List[int]) -> Tuple[Dict, Dict]:
+            first = indices[0]
+            return self.enrich(products[first], marketplace, derived[first], PRIORITY_BATCH)
+
+        workers = max_workers or self.max_workers
+        if workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+                results = list(pool.map(bind_context(enrich), groups.values()))
+        else:
+            results = [enrich(indices) for indices in groups.values()]
+
+        categories: List[Optional[Dict]] = [None] * len(products)
+        enriched_products: List[Optional[Dict]] = [None] * len(products)
+        for indices, (category_result, enriched) in zip(groups.values(), results):
+            enriched_products[indices[0]] = enriched
+            for index in indices:
+                categories[index] = category_result
+            for index in indices[1:]:
+                enriched_product = products[index].copy()
+                for id_type in ('upc', 'gtin', 'asin', 'backfill'):
+                    if enriched.get(id_type):
+                        enriched_product[id_type] = enriched[id_type]
+                enriched_products[index] = enriched_product
+
+        return categories, enriched_products
@@ -0,0 +1,145 @@
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+
+_numpy = None
+
+# Lengths of the GS1 identifiers carried in feeds; 'gtin' is GTIN-13 like the rest of the enricher
+GS1_LENGTHS = {'upc': 12, 'ean': 13, 'gtin': 13, 'gtin14': 14}
+
+_SEPARATORS_RE = re.compile(r'[\s\-]')
+_DIGITS_RE = re.compile(r'^\d{8,14}$')
+
+def normalize_code(value) -> str:
+    """
+    Strip separators and spreadsheet artifacts from an identifier.
+
+    Returns the bare digit string, or '' if the value is not a plausible
+    GS1 code (e.g. contains letters).
+    """
+    if value is None:
+        return ''
+    text = _SEPARATORS_RE.sub('', str(value))
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text if _DIGITS_RE.match(text) else ''
+
+def check_digit(body: str) -> str:
+    """Compute the GS1 mod-10 check digit for the digits before it."""
+    total = 0
+    for position, digit in enumerate(reversed(body)):
+        total += int(digit) * (3 if position % 2 == 0 else 1)
+    return str((10 - total % 10) % 10)
+
+def is_valid_gs1(code: str, length: Optional[int] = None) -> bool:
+    """Check length (if given), digits and check digit of a GS1 code."""
+    if not code or (length is not None and len(code) != length) or not _DIGITS_RE.match(code):
+        return False
+    return check_digit(code[:-1]) == code[-1]
+
+def _load_numpy():
+    """Import numpy on first bulk validation (False if unavailable)."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+def _weights(length: int) -> List[int]:
+    # Weight 1 for the check digit, then alternating 3/1 moving left
+    return [3 if (length - 1 - position) % 2 else 1 for position in range(length)]
+
+def validate_gs1_column(values: Sequence, length: int) -> List[bool]:
+    """
+    Validate a whole column of identifiers at once.
+
+    Values are normalized, filtered to the expected length and then
+    check-summed together (vectorized when numpy is available).
+
+    Args:
+        values: Raw column values
+        length: Expected code length (12 for UPC, 13 for GTIN-13, ...)
+
+    Returns:
+        List[bool]: Validity per value, aligned with values
+    """
+    codes = [normalize_code(value) for value in values]
+    result = [False] * len(codes)
+    positions = [index for index, code in enumerate(codes) if len(code) == length]
+    if not positions:
+        return result
+
+    weights = _weights(length)
+    np = _load_numpy()
+    if np:
+        digits = np.frombuffer(''.join(codes[index] for index in positions).encode('ascii'), dtype=np.uint8)
+        digits = digits.reshape(len(positions), length).astype(np.int32) - 48
+        valid = (digits @ np.array(weights, dtype=np.int32)) % 10 == 0
+        for index, ok in zip(positions, valid.tolist()):
+            result[index] = ok
+    else:
+        for index in positions:
+            code = codes[index]
+            result[index] = sum(int(digit) * weight for digit, weight in zip(code, weights)) % 10 == 0
+
+    return result
+
+def derive_identifiers(ids: Dict) -> Dict[str, str]:
+    """
+    Derive every GS1 form that follows from the valid identifiers given.
+
+    A UPC-A is a GTIN-13 (EAN-13) with a leading zero, and a GTIN-13 is a
+    GTIN-14 with indicator digit 0; padding keeps the check digit, so the
+    conversions need no lookup.
+
+    Args:
+        ids: Mapping with any of upc, ean, gtin (GTIN-13) and gtin14
+
+    Returns:
+        Dict[str, str]: Normalized upc/ean/gtin/gtin14 values that could be derived
+    """
+    gtin14 = None
+    for id_type in ('gtin14', 'gtin', 'ean', 'upc'):
+        code = normalize_code(ids.get(id_type))
+        if is_valid_gs1(code, GS1_LENGTHS[id_type]):
+            gtin14 = code.zfill(14)
+            break
+
+    return _expand_gtin14(gtin14)
+
+def _expand_gtin14(gtin14: Optional[str]) -> Dict[str, str]:
+    if not gtin14:
+        return {}
+
+    derived = {'gtin14': gtin14}
+    if gtin14[0] == '0':
+        derived['gtin'] = derived['ean'] = gtin14[1:]
+        if gtin14[1] == '0':
+            derived['upc'] = gtin14[2:]
+    return derived
+
+def derive_identifiers_bulk(rows: Iterable[Dict]) -> List[Dict[str, str]]:
+    """
+    derive_identifiers over many rows, validating each ID column in one pass.
+
+    Args:
+        rows: Product dictionaries
+
+    Returns:
+        List[Dict[str, str]]: Derived identifiers per row
+    """
+    rows = list(rows)
+    gtin14s: List[Optional[str]] = [None] * len(rows)
+
+    for id_type in ('gtin14', 'gtin', 'ean', 'upc'):
+        unresolved = [index for index in range(len(rows)) if gtin14s[index] is None and rows[index].get(id_type)]
+        if not unresolved:
+            continue
+        values = [rows[index].get(id_type) for index in unresolved]
+        for index, value, ok in zip(unresolved, values, validate_gs1_column(values, GS1_LENGTHS[id_type])):
+            if ok:
+                gtin14s[index] = normalize_code(value).zfill(14)
+
+    return [_expand_gtin14(gtin14) for gtin14 in gtin14s]
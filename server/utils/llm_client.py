@@ -0,0 +1,96 @@
+import os
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Optional
+
+# openai/httpx are imported on first use so cache-only and offline runs never pay for them
+
+_lock = threading.Lock()
+_client = None
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_async_override = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '100')),
+        max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE', '50')),
+        keepalive_expiry=float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120'))
+    )
+
+def _client_options(http_client) -> dict:
+    return {
+        'api_key': os.getenv('OPENAI_API_KEY'),
+        'base_url': os.getenv('OPENAI_BASE_URL') or None,
+        # Retries are handled by llm_scheduler, not the SDK
+        'max_retries': 0,
+        'http_client': http_client,
+    }
+
+def get_client():
+    """
+    Return the process-wide OpenAI client, creating it on first use.
+
+    The client shares one keep-alive connection pool (LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY) and honors OPENAI_BASE_URL.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _lock:
+        if _client is None:
+            import openai
+
+            http_client = openai.DefaultHttpxClient(limits=_limits(), timeout=float(os.getenv('LLM_TIMEOUT', '60')))
+            _client = openai.OpenAI(**_client_options(http_client))
+        return _client
+
+def get_async_client():
+    """
+    Return the async OpenAI client for the running event loop.
+
+    httpx async pools are bound to the loop that created them, so one
+    client is kept per loop; use run_sync from synchronous code to stay on
+    a single long-lived loop and keep its connections warm.
+    """
+    if _async_override is not None:
+        return _async_override
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            import openai
+
+            http_client = openai.DefaultAsyncHttpxClient(limits=_limits(), timeout=float(os.getenv('LLM_TIMEOUT', '60')))
+            client = _async_clients[loop] = openai.AsyncOpenAI(**_client_options(http_client))
+        return client
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-client-loop', daemon=True).start()
+        return _loop
+
+def run_sync(coroutine: Awaitable) -> Any:
+    """Run a coroutine on the shared background event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop()).result()
+
+def set_clients(client=None, async_client=None) -> None:
+    """Install process-wide client overrides (stubs for benchmarks and tests)."""
+    global _client, _async_override
+    with _lock:
+        _client = client
+        _async_override = async_client
+
+def reset_clients() -> None:
+    """Drop cached clients and overrides; the next call builds fresh ones."""
+    global _client, _async_override
+    with _lock:
+        _client = None
+        _async_override = None
+        _async_clients.clear()
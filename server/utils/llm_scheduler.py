@@ -0,0 +1,518 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional
+
+from server.utils.metrics import (
+    LLM_DEADLINES_EXCEEDED, LLM_FAILURES, LLM_HEDGES, LLM_QUEUE_SECONDS, LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_TOKENS
+)
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITY_BACKGROUND = 20
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+
+# Successful request latencies kept per component for the hedging percentile
+LATENCY_WINDOW = 256
+
+class DeadlineExceeded(Exception):
+    """An LLM call ran out of its latency budget (per call or per job)."""
+
+# Monotonic time by which every LLM call of the current job must finish (see job_deadline)
+_job_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('llm_job_deadline', default=None)
+
+@contextmanager
+def job_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bound every LLM call made inside the block to finish within `seconds` from now.
+
+    Applies to this thread, to asyncio tasks started inside the block and to
+    worker threads running functions wrapped with bind_context. Nested
+    scopes can only tighten the deadline; None adds no bound.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _job_deadline.get()
+    token = _job_deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _job_deadline.reset(token)
+
+def bind_context(fn: Callable) -> Callable:
+    """Wrap fn so calls from worker threads see the caller's job deadline."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+def estimate_request_tokens(request: Dict) -> int:
+    """Estimate prompt + completion tokens of a chat completion request (~4 chars per token)."""
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in request.get('messages', []))
+    return prompt_chars // 4 + int(request.get('max_tokens') or 0)
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+def _is_retryable(error: BaseException) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # openai's connection/timeout errors carry no status; match by name to avoid importing openai here
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in (
+        'APIConnectionError', 'APITimeoutError'
+    )
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Return (positive) or charge (negative) tokens after the fact."""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class LLMScheduler:
+    """
+    Process-wide admission control for LLM calls.
+
+    Requests wait in a priority queue until both the request bucket (RPM)
+    and the token bucket (TPM, using an estimate that is settled against the
+    reported usage afterwards) allow them. Throttling responses halve the
+    admitted rate and every success restores it additively (AIMD); retryable
+    failures are retried with full-jitter exponential backoff, honoring
+    Retry-After when the provider sends it.
+
+    Every call runs against a deadline: the per-call timeout or the
+    enclosing job_deadline, whichever is earlier. A call still unanswered
+    after the hedge_percentile latency of its component gets one duplicate
+    request and the first answer wins; a call that runs out of budget
+    raises DeadlineExceeded so the caller can fall back to a local answer.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_retries: Optional[int] = None, base_delay: float = 0.5, max_delay: float = 30.0,
+                 min_rate_factor: float = 0.05, increase_step: float = 0.02, decrease_cooldown: float = 1.0,
+                 call_timeout: Optional[float] = None, hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = 20):
+        rpm = requests_per_minute or float(os.getenv('LLM_REQUESTS_PER_MINUTE', '500'))
+        tpm = tokens_per_minute or float(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+
+        # Allow up to one second of burst on each bucket
+        self.request_bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0))
+        self.token_bucket = TokenBucket(tpm / 60.0, max(1.0, tpm / 60.0))
+        self.base_request_rate = self.request_bucket.rate
+        self.base_token_rate = self.token_bucket.rate
+
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('LLM_MAX_RETRIES', '4'))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_rate_factor = min_rate_factor
+        self.increase_step = increase_step
+        self.decrease_cooldown = decrease_cooldown
+        self.rate_factor = 1.0
+        self._last_decrease = 0.0
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue = []
+        self._sequence = itertools.count()
+
+        # Seconds one call may take end to end, including queueing and retries (0 for no limit)
+        self.call_timeout = call_timeout if call_timeout is not None else float(os.getenv('LLM_CALL_TIMEOUT', '60'))
+
+        # Percentile of recent request latency after which a call is hedged (0 turns hedging off)
+        self.hedge_percentile = (hedge_percentile if hedge_percentile is not None
+                                 else float(os.getenv('LLM_HEDGE_PERCENTILE', '95')))
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Dict[str, Deque[float]] = {}
+
+        # Threads that run bounded calls, so a stalled request cannot hold its caller past the deadline
+        self._runner_lock = threading.Lock()
+        self._runner: Optional[ThreadPoolExecutor] = None
+
+        self.stats = {'calls': 0, 'retries': 0, 'throttled': 0, 'failures': 0, 'hedged': 0, 'hedge_wins': 0,
+                      'deadline_exceeded': 0}
+
+    # -- admission -----------------------------------------------------------------
+
+    def _try_admit(self, ticket, tokens: float) -> float:
+        """Admit `ticket` if it is at the head of the queue and both buckets allow it; else return a wait."""
+        now = time.monotonic()
+        wait = max(self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+        if self._queue[0] != ticket:
+            # Someone more urgent (or earlier) goes first; re-check shortly
+            return max(wait, 0.005)
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.request_bucket.take(1)
+        self.token_bucket.take(tokens)
+        self._changed.notify_all()
+        return 0.0
+
+    def _withdraw(self, ticket) -> None:
+        """Drop a waiting ticket from the queue (lock held)."""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._changed.notify_all()
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, tokens: float = 0,
+                deadline: Optional[float] = None) -> None:
+        """Block until a request of `tokens` estimated tokens may be sent (DeadlineExceeded past `deadline`)."""
+        with self._lock:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            while True:
+                wait = self._try_admit(ticket, tokens)
+                if wait == 0:
+                    return
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._withdraw(ticket)
+                        raise DeadlineExceeded("Deadline passed while waiting for rate-limit admission")
+                    wait = min(wait, remaining)
+                self._changed.wait(min(wait, 1.0))
+
+    async def aacquire(self, priority: int = PRIORITY_INTERACTIVE, tokens: float = 0,
+                       deadline: Optional[float] = None) -> None:
+        """Async counterpart of acquire."""
+        with self._lock:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_admit(ticket, tokens)
+                if wait == 0:
+                    return
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded("Deadline passed while waiting for rate-limit admission")
+                    wait = min(wait, remaining)
+                await asyncio.sleep(min(wait, 1.0))
+        except (asyncio.CancelledError, DeadlineExceeded):
+            with self._lock:
+                self._withdraw(ticket)
+            raise
+
+    # -- feedback ------------------------------------------------------------------
+
+    def _apply_rate(self) -> None:
+        self.request_bucket.rate = self.base_request_rate * self.rate_factor
+        self.token_bucket.rate = self.base_token_rate * self.rate_factor
+
+    def _on_success(self, estimated_tokens: float, response: Any, component: str = 'llm',
+                    latency: Optional[float] = None) -> None:
+        usage = getattr(response, 'usage', None)
+        actual = getattr(usage, 'total_tokens', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        if isinstance(prompt_tokens, int):
+            LLM_TOKENS.labels(component, 'in').inc(prompt_tokens)
+        if isinstance(completion_tokens, int):
+            LLM_TOKENS.labels(component, 'out').inc(completion_tokens)
+        with self._lock:
+            self.stats['calls'] += 1
+            if latency is not None:
+                samples = self._latencies.get(component)
+                if samples is None:
+                    samples = self._latencies[component] = deque(maxlen=LATENCY_WINDOW)
+                samples.append(latency)
+            if isinstance(actual, int):
+                self.token_bucket.adjust(estimated_tokens - actual)
+            if self.rate_factor < 1.0:
+                self.rate_factor = min(1.0, self.rate_factor + self.increase_step)
+                self._apply_rate()
+
+    def _on_error(self, error: BaseException, attempt: int, component: str = 'llm') -> Optional[float]:
+        """Record a failure; return the delay before retrying, or None to give up."""
+        status = _status_code(error)
+        throttled = status in THROTTLE_STATUS
+        with self._lock:
+            if throttled:
+                self.stats['throttled'] += 1
+                # Requests already in flight get throttled together; count that as one signal
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._last_decrease = now
+                    self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+                    self._apply_rate()
+            if attempt >= self.max_retries or not _is_retryable(error):
+                self.stats['failures'] += 1
+                LLM_FAILURES.labels(component).inc()
+                return None
+            self.stats['retries'] += 1
+        LLM_RETRIES.labels(component, 'throttled' if throttled else 'error').inc()
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    # -- deadlines and hedging -----------------------------------------------------
+
+    def _deadline(self, timeout: Optional[float] = None) -> Optional[float]:
+        """Monotonic deadline of a call starting now: its timeout or the job deadline, whichever is earlier."""
+        deadline = _job_deadline.get()
+        timeout = timeout if timeout is not None else self.call_timeout
+        if timeout and timeout > 0:
+            call_deadline = time.monotonic() + timeout
+            deadline = call_deadline if deadline is None else min(deadline, call_deadline)
+        return deadline
+
+    def hedge_delay(self, component: str = 'llm') -> Optional[float]:
+        """
+        Seconds after admission at which a call of `component` is hedged.
+
+        None while hedging is off, too few latencies have been observed, or
+        the provider is throttling (a duplicate would only add to the load).
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            samples = self._latencies.get(component)
+            if not samples or len(samples) < self.hedge_min_samples or self.rate_factor < 1.0:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def _expired(self, component: str) -> DeadlineExceeded:
+        with self._lock:
+            self.stats['deadline_exceeded'] += 1
+        LLM_DEADLINES_EXCEEDED.labels(component).inc()
+        return DeadlineExceeded(f"LLM call ({component}) exceeded its latency budget")
+
+    def _on_hedge(self, component: str, won: bool) -> None:
+        with self._lock:
+            self.stats['hedge_wins' if won else 'hedged'] += 1
+        LLM_HEDGES.labels(component, 'won' if won else 'sent').inc()
+
+    def _get_runner(self) -> ThreadPoolExecutor:
+        with self._runner_lock:
+            if self._runner is None:
+                self._runner = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_CALL_THREADS', '64')),
+                                                  thread_name_prefix='llm-call')
+            return self._runner
+
+    # -- execution -----------------------------------------------------------------
+
+    def call(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE, estimated_tokens: float = 0,
+             component: str = 'llm', timeout: Optional[float] = None) -> Any:
+        """
+        Run `fn` under rate limiting with retries, within a deadline and with hedging.
+
+        Args:
+            fn: Zero-argument callable performing one LLM request
+            priority: Queue priority (PRIORITY_*; lower runs first)
+            estimated_tokens: Estimated prompt + completion tokens (see estimate_request_tokens)
+            component: Metrics label of the caller (e.g. 'category', 'product_ids')
+            timeout: Seconds for this call (defaults to call_timeout; the job deadline still applies)
+
+        Returns:
+            Any: The first result of fn; the last error is raised once retries are exhausted and
+                DeadlineExceeded once the budget runs out
+        """
+        deadline = self._deadline(timeout)
+        hedge_delay = self.hedge_delay(component)
+        if deadline is None and hedge_delay is None:
+            return self._attempt(fn, priority, estimated_tokens, component)
+        if deadline is not None and deadline <= time.monotonic():
+            raise self._expired(component)
+
+        # Blocking clients cannot be interrupted: the call runs on a runner thread and is
+        # abandoned (its late answer discarded) when the deadline passes
+        runner = self._get_runner()
+        flight = {'admitted': None}
+        primary = runner.submit(self._attempt, fn, priority, estimated_tokens, component, deadline, flight)
+        pending = {primary}
+        hedge = None
+        error = None
+
+        while True:
+            now = time.monotonic()
+            wake = deadline
+            if hedge is None and hedge_delay is not None:
+                admitted = flight['admitted']
+                if admitted is not None and now >= admitted + hedge_delay:
+                    self._on_hedge(component, False)
+                    hedge = runner.submit(self._attempt, fn, priority, estimated_tokens, component, deadline)
+                    pending.add(hedge)
+                    continue
+                # Until the primary is admitted its latency has not started; look again shortly
+                hedge_at = admitted + hedge_delay if admitted is not None else now + 0.05
+                wake = hedge_at if wake is None else min(wake, hedge_at)
+
+            done, pending = wait(pending, timeout=None if wake is None else max(0.0, wake - now),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._on_hedge(component, True)
+                    return future.result()
+                error = future.exception()
+            if done and not pending:
+                raise error
+            if deadline is not None and time.monotonic() >= deadline:
+                raise self._expired(component)
+
+    def _attempt(self, fn: Callable[[], Any], priority: int, estimated_tokens: float, component: str,
+                 deadline: Optional[float] = None, flight: Optional[Dict] = None) -> Any:
+        """One request through admission and retries; flight['admitted'] is set once it is admitted."""
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            self.acquire(priority, estimated_tokens, deadline)
+            started = time.perf_counter()
+            if flight is not None and flight['admitted'] is None:
+                flight['admitted'] = time.monotonic()
+            LLM_QUEUE_SECONDS.labels(component).observe(started - queued)
+            try:
+                response = fn()
+            except Exception as e:
+                LLM_REQUEST_SECONDS.labels(component, 'error').observe(time.perf_counter() - started)
+                delay = self._on_error(e, attempt, component)
+                if delay is None:
+                    raise
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise self._expired(component) from e
+                time.sleep(delay)
+                attempt += 1
+                continue
+            latency = time.perf_counter() - started
+            LLM_REQUEST_SECONDS.labels(component, 'ok').observe(latency)
+            self._on_success(estimated_tokens, response, component, latency)
+            return response
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE,
+                    estimated_tokens: float = 0, component: str = 'llm', timeout: Optional[float] = None) -> Any:
+        """Async counterpart of call; `fn` returns an awaitable. Losing and overdue requests are cancelled."""
+        deadline = self._deadline(timeout)
+        hedge_delay = self.hedge_delay(component)
+        if deadline is None and hedge_delay is None:
+            return await self._aattempt(fn, priority, estimated_tokens, component)
+        if deadline is not None and deadline <= time.monotonic():
+            raise self._expired(component)
+
+        flight = {'admitted': None}
+        primary = asyncio.ensure_future(self._aattempt(fn, priority, estimated_tokens, component, deadline, flight))
+        pending = {primary}
+        hedge = None
+        error = None
+
+        try:
+            while True:
+                now = time.monotonic()
+                wake = deadline
+                if hedge is None and hedge_delay is not None:
+                    admitted = flight['admitted']
+                    if admitted is not None and now >= admitted + hedge_delay:
+                        self._on_hedge(component, False)
+                        hedge = asyncio.ensure_future(
+                            self._aattempt(fn, priority, estimated_tokens, component, deadline)
+                        )
+                        pending.add(hedge)
+                        continue
+                    hedge_at = admitted + hedge_delay if admitted is not None else now + 0.05
+                    wake = hedge_at if wake is None else min(wake, hedge_at)
+
+                done, pending = await asyncio.wait(pending, timeout=None if wake is None else max(0.0, wake - now),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._on_hedge(component, True)
+                        return task.result()
+                    error = task.exception()
+                if done and not pending:
+                    raise error
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise self._expired(component)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _aattempt(self, fn: Callable[[], Awaitable[Any]], priority: int, estimated_tokens: float,
+                        component: str, deadline: Optional[float] = None, flight: Optional[Dict] = None) -> Any:
+        """Async counterpart of _attempt."""
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            await self.aacquire(priority, estimated_tokens, deadline)
+            started = time.perf_counter()
+            if flight is not None and flight['admitted'] is None:
+                flight['admitted'] = time.monotonic()
+            LLM_QUEUE_SECONDS.labels(component).observe(started - queued)
+            try:
+                response = await fn()
+            except Exception as e:
+                LLM_REQUEST_SECONDS.labels(component, 'error').observe(time.perf_counter() - started)
+                delay = self._on_error(e, attempt, component)
+                if delay is None:
+                    raise
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise self._expired(component) from e
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            latency = time.perf_counter() - started
+            LLM_REQUEST_SECONDS.labels(component, 'ok').observe(latency)
+            self._on_success(estimated_tokens, response, component, latency)
+            return response
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_lock = threading.Lock()
+
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide scheduler shared by every enricher."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler()
+        return _default_scheduler
@@ -0,0 +1,192 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import itertools
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from server.utils.gs1 import check_digit
+
+# Prompt shapes produced by CategoryGuesser and ProductIDEnricher
+_ID_PROMPT_PREFIX = 'Generate the following product identifiers'
+_PACKED_PROMPT_PREFIX = 'Categorize each of these products'
+_FUSED_PROMPT_PREFIX = 'Enrich this product'
+_TITLE_RE = re.compile(r'^Title: (.*)$', re.M)
+_DESCRIPTION_RE = re.compile(r'^Description: (.*)$', re.M)
+_PACKED_ITEM_RE = re.compile(r'^(\d+)\. Title: (.*)$', re.M)
+_REQUESTED_ID_RE = re.compile(r'^- (UPC|GTIN|ASIN):', re.M)
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+_ASIN_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def _words(text: str) -> set:
+    return {word.rstrip('s') for word in _WORD_RE.findall(text.lower())}
+
+def _taxonomy_paths(prompt: str) -> List[str]:
+    """Category paths listed under "Available categories:" ("Main: Sub, Sub" lines)."""
+    _, _, listing = prompt.partition('Available categories:\n')
+    paths = []
+    for line in listing.splitlines():
+        if not line.strip():
+            break
+        main, _, subcategories = line.partition(':')
+        paths.extend(f"{main.strip()} > {sub.strip()}" for sub in subcategories.split(',') if sub.strip())
+    return paths
+
+def pick_category(text: str, paths: List[str]) -> str:
+    """Path whose subcategory shares the most words with text; a stable hash of text breaks ties."""
+    if not paths:
+        return 'General > Miscellaneous'
+    words = _words(text)
+    offset = _stable_hash(text)
+    ranked = sorted(range(len(paths)), key=lambda index: (
+        -len(words & _words(paths[index].split(' > ')[-1])),
+        (index + offset) % len(paths)
+    ))
+    return paths[ranked[0]]
+
+def stub_identifiers(text: str) -> Dict[str, str]:
+    """Deterministic, well-formed UPC / GTIN-13 / ASIN for a product text."""
+    value = _stable_hash(text)
+    body = str(value % 10 ** 11).zfill(11)
+    upc = body + check_digit(body)
+    asin = 'B0' + ''.join(_ASIN_ALPHABET[(value >> (5 * index)) % 36] for index in range(8))
+    return {'upc': upc, 'gtin': '0' + upc, 'asin': asin}
+
+def scripted_reply(messages: List[Dict]) -> str:
+    """
+    Deterministic completion text for the prompts the enrichers send.
+
+    ID prompts get valid identifiers for the requested types, packed category
+    prompts a JSON object, single category prompts one path from the
+    taxonomy in the prompt and fused prompts a "Category:" line followed by
+    the identifiers; anything else is answered with "OK".
+    """
+    prompt = str(messages[-1].get('content', '')) if messages else ''
+
+    if prompt.startswith(_FUSED_PROMPT_PREFIX):
+        title = _TITLE_RE.search(prompt)
+        description = _DESCRIPTION_RE.search(prompt)
+        text = f"{title.group(1) if title else ''} {description.group(1) if description else ''}"
+        ids = stub_identifiers(title.group(1) if title else prompt)
+        lines = [f"Category: {pick_category(text, _taxonomy_paths(prompt))}"]
+        lines += [f"{id_type}: {ids[id_type.lower()]}" for id_type in _REQUESTED_ID_RE.findall(prompt)]
+        return '\n'.join(lines)
+
+    if prompt.startswith(_ID_PROMPT_PREFIX):
+        title = _TITLE_RE.search(prompt)
+        ids = stub_identifiers(title.group(1) if title else prompt)
+        return '\n'.join(f"{id_type}: {ids[id_type.lower()]}" for id_type in _REQUESTED_ID_RE.findall(prompt))
+
+    paths = _taxonomy_paths(prompt)
+    if prompt.startswith(_PACKED_PROMPT_PREFIX):
+        return json.dumps({item_id: pick_category(text, paths) for item_id, text in _PACKED_ITEM_RE.findall(prompt)})
+
+    title = _TITLE_RE.search(prompt)
+    if title:
+        description = _DESCRIPTION_RE.search(prompt)
+        return pick_category(f"{title.group(1)} {description.group(1) if description else ''}", paths)
+
+    return 'OK'
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+class LatencyModel:
+    """
+    Seeded response-time distribution.
+
+    Args:
+        distribution: 'fixed', 'uniform' (mean +/- jitter), 'exponential' (mean) or
+            'lognormal' (median mean, jitter as the spread)
+        mean_ms: Mean (or median) latency in milliseconds
+        jitter_ms: Spread in milliseconds
+        seed: Random seed, for reproducible runs
+    """
+
+    DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+    def __init__(self, distribution: str = 'fixed', mean_ms: float = 0.0, jitter_ms: float = 0.0,
+                 seed: Optional[int] = None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Next latency, in seconds."""
+        if self.mean_ms <= 0:
+            return 0.0
+        with self._lock:
+            if self.distribution == 'uniform':
+                value = self._random.uniform(self.mean_ms - self.jitter_ms, self.mean_ms + self.jitter_ms)
+            elif self.distribution == 'exponential':
+                value = self._random.expovariate(1.0 / self.mean_ms)
+            elif self.distribution == 'lognormal':
+                sigma = self.jitter_ms / self.mean_ms if self.jitter_ms else 0.5
+                value = self.mean_ms * self._random.lognormvariate(0.0, sigma)
+            else:
+                value = self.mean_ms
+        return max(0.0, value) / 1000.0
+
+def make_completion(content: str, model: str, prompt_tokens: int, completion_tokens: int,
+                    completion_id: str = 'chatcmpl-stub') -> SimpleNamespace:
+    """Object shaped like an openai ChatCompletion (the attributes the enrichers read)."""
+    return SimpleNamespace(
+        id=completion_id,
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason='stop',
+                                 message=SimpleNamespace(role='assistant', content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens)
+    )
+
+class StubClient:
+    """
+    In-process stand-in for openai.OpenAI answering chat completions locally.
+
+    Install it with llm_client.set_clients; calls and token usage are counted
+    in `stats`.
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None,
+                 responder: Callable[[List[Dict]], str] = scripted_reply):
+        self.latency = latency or LatencyModel()
+        self.responder = responder
+        self.stats = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _complete(self, request: Dict) -> SimpleNamespace:
+        messages = request.get('messages', [])
+        content = self.responder(messages)
+        prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+            completion_id = f"chatcmpl-stub-{next(self._ids)}"
+        return make_completion(content, request.get('model', 'stub'), prompt_tokens, completion_tokens, completion_id)
+
+    def create(self, **request) -> SimpleNamespace:
+        time.sleep(self.latency.sample())
+        return self._complete(request)
+
+class AsyncStubClient(StubClient):
+    """Async counterpart of StubClient (stand-in for openai.AsyncOpenAI)."""
+
+    async def create(self, **request) -> SimpleNamespace:
+        await asyncio.sleep(self.latency.sample())
+        return self._complete(request)
@@ -0,0 +1,222 @@
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from server.utils.llm_stub import LatencyModel, estimate_tokens, scripted_reply
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests',
+            500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable'}
+
+_SERVER_ERRORS = (500, 502, 503)
+
+_COMPLETION_PATHS = ('/v1/chat/completions', '/chat/completions')
+
+def load_script(path: str) -> List[Tuple[re.Pattern, str]]:
+    """
+    Load scripted responses: a JSON list of {"match": regex, "response": text}.
+
+    The first rule whose regex matches the last message wins; unmatched
+    prompts fall back to llm_stub.scripted_reply.
+    """
+    with open(path, encoding='utf-8') as handle:
+        rules = json.load(handle)
+    return [(re.compile(rule['match'], re.S), rule['response']) for rule in rules]
+
+class StubServer:
+    """
+    OpenAI-compatible chat-completions server for load and fault testing.
+
+    Serves POST /v1/chat/completions on a keep-alive HTTP/1.1 asyncio server,
+    answering with scripted (or llm_stub) responses after a sampled latency,
+    and injecting 429 (with Retry-After) and 5xx responses at the configured
+    rates. GET /stats returns request, status and token counters. Point the
+    enrichers at it with OPENAI_BASE_URL=http://<host>:<port>/v1 (any
+    OPENAI_API_KEY value is accepted).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8089, latency: Optional[LatencyModel] = None,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, retry_after: Optional[float] = 1.0,
+                 script: Optional[List[Tuple[re.Pattern, str]]] = None, seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency or LatencyModel()
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.script = script or []
+
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready = threading.Event()
+        self.stats = {'requests': 0, 'completions': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'status': {}}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _reply(self, messages: List[Dict]) -> str:
+        prompt = str(messages[-1].get('content', '')) if messages else ''
+        for pattern, response in self.script:
+            if pattern.search(prompt):
+                return response
+        return scripted_reply(messages)
+
+    def _count(self, status: int) -> None:
+        self.stats['requests'] += 1
+        self.stats['status'][str(status)] = self.stats['status'].get(str(status), 0) + 1
+
+    @staticmethod
+    def _error(status: int, message: str, error_type: str) -> Dict:
+        return {'error': {'message': message, 'type': error_type, 'param': None, 'code': str(status)}}
+
+    async def _complete(self, body: bytes) -> Tuple[int, Dict, Dict[str, str]]:
+        try:
+            request = json.loads(body or b'{}')
+            messages = request['messages']
+        except (ValueError, KeyError, TypeError):
+            return 400, self._error(400, 'Invalid chat completion request', 'invalid_request_error'), {}
+
+        await asyncio.sleep(self.latency.sample())
+
+        draw = self._random.random()
+        if draw < self.throttle_rate:
+            headers = {'retry-after': f"{self.retry_after:g}"} if self.retry_after is not None else {}
+            return 429, self._error(429, 'Rate limit reached (injected)', 'rate_limit_exceeded'), headers
+        if draw < self.throttle_rate + self.error_rate:
+            status = self._random.choice(_SERVER_ERRORS)
+            return status, self._error(status, 'Upstream error (injected)', 'server_error'), {}
+
+        content = self._reply(messages)
+        prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        self.stats['completions'] += 1
+        self.stats['prompt_tokens'] += prompt_tokens
+        self.stats['completion_tokens'] += completion_tokens
+        return 200, {
+            'id': f"chatcmpl-stub-{next(self._ids)}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }, {}
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict, Dict[str, str]]:
+        path = path.split('?', 1)[0].rstrip('/')
+        if method == 'POST' and path in _COMPLETION_PATHS:
+            return await self._complete(body)
+        if method == 'GET' and path in ('/stats', '/v1/stats'):
+            return 200, self.stats, {}
+        if method == 'GET' and path in ('/v1/models', '/models'):
+            return 200, {'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'owned_by': 'stub'}]}, {}
+        return 404, self._error(404, f"Unknown endpoint: {method} {path}", 'invalid_request_error'), {}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', '0') or 0))
+
+                status, payload, extra_headers = await self._dispatch(method, path, body)
+                if path.split('?', 1)[0].rstrip('/') in _COMPLETION_PATHS:
+                    self._count(status)
+
+                data = json.dumps(payload).encode('utf-8')
+                head = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}",
+                        'content-type: application/json',
+                        f"content-length: {len(data)}"]
+                head += [f"{name}: {value}" for name, value in extra_headers.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        """Serve until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> str:
+        """Run the server on a daemon thread (port 0 picks a free port); returns its base URL."""
+        threading.Thread(target=lambda: asyncio.run(self._serve_quietly()), name='llm-stub-server',
+                         daemon=True).start()
+        self._ready.wait()
+        return self.base_url
+
+    async def _serve_quietly(self) -> None:
+        try:
+            await self.serve()
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self) -> None:
+        if self._server is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m server.utils.llm_stub_server',
+        description='Local OpenAI-compatible chat-completions server for load and fault testing.'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Latency spread')
+    parser.add_argument('--distribution', choices=LatencyModel.DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500/502/503')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--script', help='JSON list of {"match": regex, "response": text} rules')
+    parser.add_argument('--seed', type=int, help='Random seed for latency and fault injection')
+    args = parser.parse_args(argv)
+
+    server = StubServer(
+        host=args.host,
+        port=args.port,
+        latency=LatencyModel(args.distribution, args.latency_ms, args.jitter_ms, seed=args.seed),
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        script=load_script(args.script) if args.script else None,
+        seed=args.seed
+    )
+    print(f"Serving chat completions on {server.base_url} (set OPENAI_BASE_URL to this)", file=sys.stderr)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.stats), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# Product keywords that point at a subcategory. Paths that a marketplace
+# taxonomy does not contain are ignored for that marketplace. Words that are
+# as common in accessory or unrelated titles ('tab', 'pc') are left out.
+KEYWORD_HINTS = {
+    'Cell Phones': ['iphone', 'galaxy', 'pixel', 'smartphone', 'phone', 'cellphone', 'oneplus', 'motorola', 'xiaomi'],
+    'Computers': ['laptop', 'macbook', 'notebook', 'chromebook', 'desktop', 'monitor', 'tablet', 'ipad', 'imac', 'thinkpad'],
+    'Audio': ['headphone', 'headset', 'earbud', 'earphone', 'airpod', 'soundbar', 'speaker', 'subwoofer', 'bose', 'jbl'],
+    'TV & Video': ['tv', 'television', 'oled', 'qled', 'projector', 'roku', 'firestick'],
+    'Cameras': ['camera', 'dslr', 'mirrorless', 'gopro', 'webcam'],
+}
+
+# Title words naming something made for a product rather than the product itself ("iPhone 14 case",
+# "TV stand"); a title with one of them is never confident enough to skip the LLM
+ACCESSORY_TOKENS = {
+    'case', 'cover', 'band', 'strap', 'stand', 'mount', 'holder', 'charger', 'cable', 'adapter', 'controller',
+    'protector', 'sleeve', 'skin', 'dock', 'replacement', 'remote', 'bag', 'battery', 'accessory',
+}
+
+STOP_WORDS = {'and', 'the', 'for', 'with', 'of', 'in', 'a', 'an', 'to', 'new'}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with a naive plural strip, stop words removed."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class LocalCategoryClassifier:
+    """
+    Offline first-tier category classifier.
+
+    Scores taxonomy paths with an inverted index built from the taxonomy
+    names, a table of keyword hints and token statistics learned from LLM
+    answers. Confidence combines how strongly the best path scored with how
+    clearly it beat the runner-up. It is capped when the title names an
+    accessory, and when only one word supports the best path unless that
+    word is one of the path's keyword hints ("iPhone", "soundbar").
+    """
+
+    TAXONOMY_WEIGHT = 1.0
+    MAIN_CATEGORY_WEIGHT = 0.3
+    HINT_WEIGHT = 3.0
+    LEARNED_WEIGHT = 2.0
+    DESCRIPTION_WEIGHT = 0.5
+    # Top score at which the strength part of the confidence saturates
+    SATURATION_SCORE = 2.5
+    # Learned token statistics ramp up to full weight over this many observations
+    MIN_LEARNED_COUNT = 5
+    # Distinct words that must support the best path for an uncapped confidence, unless one is a keyword hint
+    MIN_EVIDENCE = 2
+    # Confidence ceiling for weak single-word or accessory matches (below the guesser's 0.75 threshold)
+    WEAK_MATCH_CONFIDENCE = 0.5
+
+    def __init__(self, taxonomies: Dict[str, Any], keyword_hints: Optional[Dict[str, List[str]]] = None):
+        self.keyword_hints = keyword_hints if keyword_hints is not None else KEYWORD_HINTS
+
+        # marketplace -> token -> category path -> weight
+        self.index: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+        # marketplace -> category path -> its keyword hints
+        self.hints: Dict[str, Dict[str, Set[str]]] = {}
+
+        # marketplace -> token -> category path -> count, from LLM answers
+        self.learned: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+
+        for marketplace, taxonomy in taxonomies.items():
+            self.index[marketplace] = self._build_index(taxonomy)
+            self.hints[marketplace] = {
+                ' > '.join(ancestors + (leaf,)): set(self.keyword_hints[leaf])
+                for ancestors, leaf in self._leaf_parts(taxonomy) if self.keyword_hints.get(leaf)
+            }
+
+    def _build_index(self, taxonomy: Any) -> Dict[str, Dict[str, float]]:
+        """
+        Build the token -> path weights index for one taxonomy.
+
+        Accepts a two-level {"Main": ["Sub", ...]} dict or a taxonomy.Taxonomy;
+        for deeper trees every ancestor counts like the main category.
+        """
+
+        index: Dict[str, Dict[str, float]] = defaultdict(dict)
+
+        for ancestors, leaf in self._leaf_parts(taxonomy):
+            path = ' > '.join(ancestors + (leaf,))
+            for token in tokenize(leaf):
+                index[token][path] = index[token].get(path, 0.0) + self.TAXONOMY_WEIGHT
+            for token in {token for ancestor in ancestors for token in tokenize(ancestor)}:
+                index[token][path] = index[token].get(path, 0.0) + self.MAIN_CATEGORY_WEIGHT
+            for keyword in self.keyword_hints.get(leaf, []):
+                index[keyword][path] = index[keyword].get(path, 0.0) + self.HINT_WEIGHT
+
+        return dict(index)
+
+    @staticmethod
+    def _leaf_parts(taxonomy: Any) -> Iterator[Tuple[Tuple[str, ...], str]]:
+        if hasattr(taxonomy, 'leaf_parts'):
+            yield from taxonomy.leaf_parts()
+            return
+        for main_category, subcategories in taxonomy.items():
+            for subcategory in subcategories:
+                yield (main_category,), subcategory
+
+    def learn(self, product_data: Dict, category: str, marketplace: str = 'amazon') -> None:
+        """
+        Record an LLM answer so its title/brand tokens vote for that category.
+
+        Args:
+            product_data: Product the answer was given for
+            category: Category path returned by the LLM
+            marketplace: Target marketplace
+        """
+        learned = self.learned[marketplace]
+        text = f"{product_data.get('title', '')} {product_data.get('brand', '')}"
+        for token in set(tokenize(text)):
+            # Sizes and model numbers say little about the category
+            if not token.isdigit():
+                learned[token][category] += 1
+
+    def classify(self, product_data: Dict, marketplace: str = 'amazon') -> Tuple[Optional[str], float]:
+        """
+        Classify a product without any network call.
+
+        Args:
+            product_data: Dictionary containing product info (title, brand, description, etc.)
+            marketplace: Target marketplace
+
+        Returns:
+            Tuple[Optional[str], float]: Best category path (None if nothing matched) and confidence 0-1
+        """
+        title_text = f"{product_data.get('title', '')} {product_data.get('brand', '')}"
+        description = product_data.get('description', '') or ''
+
+        # Supplier descriptions are noisy; they may add evidence when the
+        # title is weak but never dilute a clear title match.
+        title_scores, title_evidence = self._score(((title_text, 1.0),), marketplace)
+        hints = self.hints.get(marketplace, self.hints.get('amazon', {}))
+        best = self._rank(title_scores, title_evidence, hints)
+        if description:
+            combined_scores, combined_evidence = self._score(
+                ((title_text, 1.0), (description, self.DESCRIPTION_WEIGHT)), marketplace
+            )
+            combined = self._rank(combined_scores, combined_evidence, hints)
+            if combined[1] > best[1]:
+                best = combined
+
+        # Unless the path itself is the accessory's category (e.g. "... > Cases")
+        accessories = ACCESSORY_TOKENS.intersection(tokenize(title_text))
+        if best[0] is not None and accessories - set(tokenize(best[0])):
+            best = best[0], min(best[1], self.WEAK_MATCH_CONFIDENCE)
+
+        return best
+
+    def _score(self, weighted_text: Tuple[Tuple[str, float], ...],
+               marketplace: str) -> Tuple[Dict[str, float], Dict[str, Set[str]]]:
+        """Sum index and learned weights per category path for the given texts, and the words behind each."""
+
+        index = self.index.get(marketplace, self.index.get('amazon', {}))
+        learned = self.learned.get(marketplace, {})
+
+        scores: Dict[str, float] = defaultdict(float)
+        evidence: Dict[str, Set[str]] = defaultdict(set)
+
+        for text, field_weight in weighted_text:
+            for token in set(tokenize(text)):
+                for path, weight in index.get(token, {}).items():
+                    scores[path] += weight * field_weight
+                    evidence[path].add(token)
+
+                counts = learned.get(token)
+                if counts:
+                    total = sum(counts.values())
+                    ramp = min(1.0, total / self.MIN_LEARNED_COUNT)
+                    for path, count in counts.items():
+                        scores[path] += self.LEARNED_WEIGHT * field_weight * ramp * count / total
+                        evidence[path].add(token)
+
+        return scores, evidence
+
+    def _rank(self, scores: Dict[str, float], evidence: Dict[str, Set[str]],
+              hints: Dict[str, Set[str]]) -> Tuple[Optional[str], float]:
+        """Pick the best path and turn its lead into a confidence."""
+
+        if not scores:
+            return None, 0.0
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_path, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+
+        margin = (best_score - runner_up) / best_score
+        strength = min(1.0, best_score / self.SATURATION_SCORE)
+        confidence = margin * strength
+
+        # One generic or learned word is not enough to skip the LLM; one of the path's own hints is
+        words = evidence[best_path]
+        if len(words) < self.MIN_EVIDENCE and not words & hints.get(best_path, set()):
+            confidence = min(confidence, self.WEAK_MATCH_CONFIDENCE)
+
+        return best_path, confidence
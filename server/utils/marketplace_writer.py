@@ -0,0 +1,226 @@
+import os
+import csv
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from server.utils.column_mapper import get_mapper, normalize_header
+from server.utils.row_fingerprints import ROW_KEY_ALIASES, find_row_key_column
+
+# Enriched identifier fields, in the order they are preferred for a single product ID column
+ID_TYPES = ('upc', 'gtin', 'asin')
+
+# Target product ID columns (normalized) that take an enriched identifier when no input header matched them;
+# other ID columns (e.g. Walmart's originalProductId) are only filled from a matching input header
+PRODUCT_ID_COLUMNS = ('productid', 'externalproductid')
+
+# Excel rejects cells longer than this
+XLSX_MAX_CELL = 32767
+
+def _load_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("openpyxl is required to write XLSX outputs (pip install openpyxl)")
+    return openpyxl
+
+class MarketplaceProjection:
+    """
+    Projects enriched feed rows onto one marketplace's upload columns.
+
+    Columns come from the marketplace template when it has one and from its
+    MARKETPLACES column list otherwise (see column_mapper.get_mapper); input
+    headers are matched to them once, up front. The main product ID column
+    takes the first UPC/GTIN/ASIN each row has (after enrichment), "...IdType"
+    companions of identifier columns get the matching type, and unmatched
+    SKU/ID columns take the feed's row key.
+    """
+
+    def __init__(self, marketplace: str, headers: List[str], field_map: Dict[str, str], category: str = 'base'):
+        mapper = get_mapper(marketplace, category)
+        if mapper is None:
+            raise ValueError(f"Unknown marketplace: {marketplace}")
+
+        self.marketplace = marketplace
+        self.columns = mapper.targets
+        mapping = mapper.map(headers)
+
+        # Header holding each enriched identifier (the feed's own ID column when it has one)
+        id_headers = {id_type: field_map.get(id_type, id_type) for id_type in ID_TYPES}
+        id_headers = {id_type: header for id_type, header in id_headers.items() if header in headers}
+        type_of_header = {header: id_type.upper() for id_type, header in id_headers.items()}
+
+        normalized = {normalize_header(column): column for column in self.columns}
+        key_column = find_row_key_column(headers)
+
+        # (target "...IdType" column, its product ID column)
+        type_pairs: List[Tuple[str, str]] = []
+        for name, column in normalized.items():
+            if name.endswith('idtype') and name[:-len('type')] in normalized:
+                type_pairs.append((column, normalized[name[:-len('type')]]))
+
+        if key_column is not None:
+            for name, column in normalized.items():
+                if name in ROW_KEY_ALIASES and column not in mapping and key_column not in mapping.values():
+                    mapping[column] = key_column
+
+        position = {column: index for index, column in enumerate(self.columns)}
+        candidates = [(id_headers[id_type], id_type.upper()) for id_type in ID_TYPES if id_type in id_headers]
+
+        # (type column position, ID column position, type label)
+        self._types: List[Tuple[int, int, str]] = []
+        # (ID column position, type column position or None, [(identifier header, type label)])
+        self._fallbacks: List[Tuple[int, Optional[int], List[Tuple[str, str]]]] = []
+        for type_column, id_column in type_pairs:
+            source = mapping.get(id_column)
+            is_main_id = normalize_header(id_column) in PRODUCT_ID_COLUMNS
+            if is_main_id and candidates and (source is None or source in type_of_header):
+                # First identifier the row has, starting with the header matched to the column
+                ordered = sorted(candidates, key=lambda candidate: candidate[0] != source)
+                type_position = None if type_column in mapping and source is None else position[type_column]
+                mapping.pop(id_column, None)
+                if type_position is not None:
+                    mapping.pop(type_column, None)
+                self._fallbacks.append((position[id_column], type_position, ordered))
+            elif source in type_of_header:
+                # Derived from the identifier that fills the ID column
+                mapping.pop(type_column, None)
+                self._types.append((position[type_column], position[id_column], type_of_header[source]))
+
+        self._sources: List[Optional[str]] = [mapping.get(column) for column in self.columns]
+
+    def project(self, row: Dict[str, Any]) -> List[str]:
+        """Values of a row in column order ('' where the feed has nothing)."""
+        values = [(row.get(source) or '') if source is not None else '' for source in self._sources]
+        for type_position, id_position, label in self._types:
+            if values[id_position]:
+                values[type_position] = label
+        for id_position, type_position, candidates in self._fallbacks:
+            for header, label in candidates:
+                if row.get(header):
+                    values[id_position] = row[header]
+                    if type_position is not None:
+                        values[type_position] = label
+                    break
+        return values
+
+class CsvSink:
+    """Streams rows to a CSV/TSV file."""
+
+    def __init__(self, path: str, columns: List[str], delimiter: Optional[str] = None):
+        self.path = path
+        self._handle = open(path, 'w', newline='', encoding='utf-8')
+        delimiter = delimiter or ('\t' if path.lower().endswith(('.tsv', '.txt')) else ',')
+        self._writer = csv.writer(self._handle, delimiter=delimiter)
+        self._writer.writerow(columns)
+
+    def write(self, values: List[str]) -> None:
+        self._writer.writerow(values)
+
+    def write_many(self, rows: Iterable[List[str]]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._handle.close()
+
+class XlsxSink:
+    """
+    Streams rows to an XLSX workbook.
+
+    Uses openpyxl's write-only mode, which serializes each row as it is
+    appended, so memory does not grow with the feed.
+    """
+
+    def __init__(self, path: str, columns: List[str], sheet_title: str = 'Products'):
+        openpyxl = _load_openpyxl()
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        self.path = path
+        self._illegal = ILLEGAL_CHARACTERS_RE
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(sheet_title)
+        self._sheet.append(columns)
+
+    def _clean(self, value: str) -> Optional[str]:
+        # Empty cells are skipped entirely; control characters and oversized cells make the workbook unreadable
+        if not value:
+            return None
+        if isinstance(value, str):
+            value = self._illegal.sub('', value)[:XLSX_MAX_CELL]
+        return value
+
+    def write(self, values: List[str]) -> None:
+        cells = [self._clean(value) for value in values]
+        # Trailing empty cells of wide templates cost as much as filled ones
+        while cells and cells[-1] is None:
+            cells.pop()
+        self._sheet.append(cells)
+
+    def write_many(self, rows: Iterable[List[str]]) -> None:
+        for values in rows:
+            self.write(values)
+
+    def close(self) -> None:
+        self._workbook.save(self.path)
+        self._workbook.close()
+
+def open_sink(path: str, columns: List[str], output_format: Optional[str] = None):
+    """CSV or XLSX sink for path (format from output_format, else the file extension)."""
+    output_format = (output_format or os.path.splitext(path)[1].lstrip('.') or 'csv').lower()
+    if output_format == 'xlsx':
+        return XlsxSink(path, columns)
+    return CsvSink(path, columns)
+
+class MarketplaceWriter:
+    """
+    Writes enriched rows to several marketplace outputs in one pass.
+
+    Each row is projected onto every target's columns and streamed to its
+    sink, so publishing a feed to all channels reads and enriches it once.
+
+    Example:
+        with MarketplaceWriter({'amazon': 'out.amazon.csv', 'walmart': 'out.walmart.xlsx'},
+                               headers, field_map) as writer:
+            writer.write_rows(enriched_rows)
+    """
+
+    def __init__(self, outputs: Dict[str, str], headers: List[str], field_map: Dict[str, str],
+                 output_format: Optional[str] = None, category: str = 'base'):
+        """
+        Args:
+            outputs: Marketplace -> output path
+            headers: Header row of the enriched rows (see enrich.output_headers)
+            field_map: Product field -> input header (see enrich.map_fields)
+            output_format: 'csv' or 'xlsx' for every output (by file extension if omitted)
+            category: Template category used for marketplaces with category templates
+        """
+        self.targets: List[Tuple[MarketplaceProjection, Any]] = []
+        self.counts: Dict[str, int] = {}
+        try:
+            for marketplace, path in outputs.items():
+                projection = MarketplaceProjection(marketplace, headers, field_map, category)
+                self.targets.append((projection, open_sink(path, projection.columns, output_format)))
+                self.counts[marketplace] = 0
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, row: Dict[str, Any]) -> None:
+        for projection, sink in self.targets:
+            sink.write(projection.project(row))
+            self.counts[projection.marketplace] += 1
+
+    def write_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        rows = rows if isinstance(rows, list) else list(rows)
+        for projection, sink in self.targets:
+            sink.write_many(projection.project(row) for row in rows)
+            self.counts[projection.marketplace] += len(rows)
+
+    def close(self) -> None:
+        for _, sink in self.targets:
+            sink.close()
+        self.targets = []
+
+    def __enter__(self) -> 'MarketplaceWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
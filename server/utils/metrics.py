@@ -0,0 +1,258 @@
+import os
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds; covers local lookups (sub-millisecond) through slow completions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# hook(kind, name, labels, value), called after every update while hooks are registered
+Hook = Callable[[str, str, Dict[str, str], float], None]
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _CounterChild:
+    __slots__ = ('_metric', '_labels', 'value')
+
+    def __init__(self, metric: 'Counter', labels: Tuple[str, ...]):
+        self._metric = metric
+        self._labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        registry = self._metric.registry
+        if not registry.enabled:
+            return
+        with self._metric.lock:
+            self.value += amount
+        if registry.hooks:
+            registry.emit('counter', self._metric.name, self._metric.label_dict(self._labels), amount)
+
+class _HistogramChild:
+    __slots__ = ('_metric', '_labels', 'counts', 'sum', 'count')
+
+    def __init__(self, metric: 'Histogram', labels: Tuple[str, ...]):
+        self._metric = metric
+        self._labels = labels
+        self.counts = [0] * (len(metric.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        registry = self._metric.registry
+        if not registry.enabled:
+            return
+        index = bisect.bisect_left(self._metric.buckets, value)
+        with self._metric.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+        if registry.hooks:
+            registry.emit('histogram', self._metric.name, self._metric.label_dict(self._labels), value)
+
+class _Metric:
+    kind = ''
+    child_class = None
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """
+        Child series for these label values, in labelnames order.
+
+        Children are cached; hot paths can keep the returned object and call
+        inc/observe on it directly.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self.lock:
+                child = self._children.setdefault(values, self.child_class(self, values))
+        return child
+
+    def label_dict(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self.lock:
+            return sorted(self._children.items())
+
+    def reset(self) -> None:
+        with self.lock:
+            self._children.clear()
+
+class Counter(_Metric):
+    """Monotonic counter with labels."""
+
+    kind = 'counter'
+    child_class = _CounterChild
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+class Histogram(_Metric):
+    """Bucketed histogram with labels (cumulative buckets on export, like Prometheus)."""
+
+    kind = 'histogram'
+    child_class = _HistogramChild
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+class MetricsRegistry:
+    """
+    In-process metrics store.
+
+    Updates are a lock-protected add on a cached child series, so metrics
+    can stay on in production (set METRICS_ENABLED=0 to turn them into
+    no-ops). Export with snapshot() or to_prometheus(); hooks receive each
+    update as it happens, for forwarding to StatsD, OpenTelemetry or logs.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = enabled if enabled is not None else os.getenv('METRICS_ENABLED', '1') not in ('0', 'false', 'no')
+        self.hooks: List[Hook] = []
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered with a different shape")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def add_hook(self, hook: Hook) -> None:
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def emit(self, kind: str, name: str, labels: Dict[str, str], value: float) -> None:
+        for hook in list(self.hooks):
+            try:
+                hook(kind, name, labels, value)
+            except Exception as e:
+                print(f"Error in metrics hook: {e}")
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Current values of every metric.
+
+        Returns:
+            Dict[str, Dict]: name -> {'type', 'help', 'series': [...]}; counter series carry
+                'labels' and 'value', histogram series 'labels', 'count', 'sum' and cumulative 'buckets'
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        snapshot = {}
+        for metric in metrics:
+            series = []
+            for values, child in metric.series():
+                labels = metric.label_dict(values)
+                if metric.kind == 'counter':
+                    series.append({'labels': labels, 'value': child.value})
+                    continue
+                with metric.lock:
+                    counts, total, count = list(child.counts), child.sum, child.count
+                cumulative, buckets = 0, {}
+                for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    buckets[_format_value(bound)] = cumulative
+                series.append({'labels': labels, 'count': count, 'sum': total, 'buckets': buckets})
+            snapshot[metric.name] = {'type': metric.kind, 'help': metric.documentation, 'series': series}
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for name, metric in self.snapshot().items():
+            lines.append(f"# HELP {name} {_escape(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for series in metric['series']:
+                labels = series['labels']
+                if metric['type'] == 'counter':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(series['value'])}")
+                    continue
+                for bound, count in series['buckets'].items():
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(series['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        """Drop every recorded series (metric definitions stay registered)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+_registry = MetricsRegistry()
+
+def get_registry() -> MetricsRegistry:
+    """Return the process-wide registry the enrichers report to."""
+    return _registry
+
+# -- enrichment metrics ------------------------------------------------------------
+
+LLM_REQUEST_SECONDS = _registry.histogram(
+    'enrichment_llm_request_seconds', 'Latency of one LLM request attempt', ('component', 'outcome'))
+LLM_QUEUE_SECONDS = _registry.histogram(
+    'enrichment_llm_queue_seconds', 'Time spent waiting for rate-limit admission', ('component',))
+LLM_TOKENS = _registry.counter(
+    'enrichment_llm_tokens_total', 'LLM tokens reported by the provider', ('component', 'direction'))
+LLM_RETRIES = _registry.counter(
+    'enrichment_llm_retries_total', 'LLM request attempts that were retried', ('component', 'reason'))
+LLM_FAILURES = _registry.counter(
+    'enrichment_llm_failures_total', 'LLM requests that failed after retries', ('component',))
+LLM_HEDGES = _registry.counter(
+    'enrichment_llm_hedges_total', 'Duplicate requests sent for slow LLM calls, and how many answered first',
+    ('component', 'outcome'))
+LLM_DEADLINES_EXCEEDED = _registry.counter(
+    'enrichment_llm_deadlines_exceeded_total', 'LLM calls abandoned because their latency budget ran out',
+    ('component',))
+CACHE_LOOKUPS = _registry.counter(
+    'enrichment_cache_lookups_total', 'Cache lookups by cache, tier and result', ('cache', 'tier', 'result'))
+CATEGORY_RESULTS = _registry.counter(
+    'enrichment_category_results_total', 'Category guesses by the tier that answered', ('tier',))
+CATALOG_LOOKUPS = _registry.counter(
+    'enrichment_catalog_lookups_total', 'Local product catalog lookups', ('result',))
+ID_VALIDATION_REJECTS = _registry.counter(
+    'enrichment_id_validation_rejects_total', 'Generated identifiers rejected by format validation', ('id_type',))
+NEAR_DUPLICATE_HITS = _registry.counter(
+    'enrichment_near_duplicate_hits_total', 'Lookups answered through a near-duplicate title', ('cache',))
@@ -0,0 +1,234 @@
+import re
+import random
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+# "256GB", "128 GB", "6.1 in", "5000mAh": variant attributes, never part of the product's core name
+_MEASURE_RE = re.compile(r'\b(\d+(?:\.\d+)?)\s*(gb|tb|mb|mah|hz|mhz|ghz|w|in|inch|inches|mm|cm|oz|lb|lbs|pack|pk|ct)\b')
+_BRACKETED_RE = re.compile(r'[\(\[][^\)\]]*[\)\]]')
+
+COLOR_WORDS = frozenset({
+    'black', 'white', 'silver', 'gold', 'blue', 'red', 'green', 'gray', 'grey', 'pink', 'purple', 'yellow',
+    'orange', 'rose', 'graphite', 'midnight', 'starlight', 'titanium', 'bronze', 'beige', 'navy', 'teal',
+})
+
+NOISE_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'with', 'for', 'of', 'by', 'in', 'new', 'brand', 'genuine', 'original', 'official',
+    'unlocked', 'renewed', 'refurbished', 'edition', 'version', 'model', 'color', 'colour',
+})
+
+# Brands stripped from titles when the row has no brand field, so "Apple iPhone" and "iPhone" compare equal
+KNOWN_BRANDS = frozenset({
+    'apple', 'samsung', 'google', 'sony', 'lg', 'dell', 'hp', 'lenovo', 'bose', 'logitech', 'microsoft', 'asus',
+    'acer', 'motorola', 'nokia', 'oneplus', 'xiaomi', 'huawei', 'jbl', 'beats', 'canon', 'nikon', 'garmin',
+    'fitbit', 'amazon', 'anker', 'philips', 'panasonic', 'toshiba', 'vizio', 'tcl', 'hisense', 'nintendo',
+})
+
+_MERSENNE_61 = (1 << 61) - 1
+
+def title_features(title: str, brand: str = '') -> Tuple[FrozenSet[str], FrozenSet[str], str]:
+    """
+    Split a product title into shingles of its core name and its variant attributes.
+
+    Brand words, colors, measures (capacity, size) and marketing noise are
+    removed from the core name; measures, colors and tokens containing digits
+    (model numbers) are kept as variant attributes. The core is shingled into
+    its tokens plus their character 3-grams, so spelling variants still
+    overlap while an extra word ("case", "charger") weighs as much as a
+    changed one.
+
+    Returns:
+        Tuple[FrozenSet[str], FrozenSet[str], str]: Core shingles, variant attributes, normalized brand
+    """
+    text = (title or '').lower()
+    brand_tokens = _TOKEN_RE.findall((brand or '').lower())
+
+    variants = {f"{number}{unit.rstrip('es') if unit.startswith('inch') else unit}"
+                for number, unit in _MEASURE_RE.findall(text)}
+    text = _MEASURE_RE.sub(' ', text)
+    for bracketed in _BRACKETED_RE.findall(text):
+        variants.update(token for token in _TOKEN_RE.findall(bracketed) if token in COLOR_WORDS or
+                        any(char.isdigit() for char in token))
+    text = _BRACKETED_RE.sub(' ', text)
+
+    skip = set(brand_tokens) or KNOWN_BRANDS
+    shingles = set()
+    for token in _TOKEN_RE.findall(text):
+        if token in skip or token in NOISE_WORDS:
+            continue
+        if token in COLOR_WORDS:
+            variants.add(token)
+            continue
+        if any(char.isdigit() for char in token):
+            variants.add(token)
+        shingles.add(token)
+        if len(token) > 3:
+            shingles.update(token[index:index + 3] for index in range(len(token) - 2))
+
+    return frozenset(shingles), frozenset(variants), ' '.join(brand_tokens)
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+class NearDuplicateIndex:
+    """
+    MinHash / LSH index over shingle sets.
+
+    Each entry's MinHash signature is split into bands; entries sharing any
+    band are candidates, and candidates are verified with the exact Jaccard
+    similarity of their shingles. With the default 21 bands of 3 rows, pairs
+    at Jaccard 0.8 become candidates with probability > 0.999, and pairs at
+    0.3 with about 0.44. Only the candidates sharing the most bands (an
+    estimate of their similarity) are verified, which bounds the work when
+    many indexed titles share common words.
+    """
+
+    def __init__(self, num_perm: int = 63, bands: int = 21, max_entries: int = 100000, max_candidates: int = 16,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+
+        generator = random.Random(seed)
+        self._permutations = [(generator.randrange(1, _MERSENNE_61), generator.randrange(0, _MERSENNE_61))
+                              for _ in range(num_perm)]
+        self._entries: OrderedDict = OrderedDict()
+        self._buckets: Dict[Tuple, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, shingles: FrozenSet[str]) -> List[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for shingle in shingles]
+        return [min((a * value + b) % _MERSENNE_61 for value in hashes) for a, b in self._permutations]
+
+    def _band_keys(self, shingles: FrozenSet[str]) -> List[Tuple]:
+        signature = self._signature(shingles)
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def add(self, key: str, shingles: FrozenSet[str], payload=None) -> None:
+        """Index shingles under key (re-adding a key replaces it)."""
+        if not shingles:
+            return
+        band_keys = self._band_keys(shingles)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (shingles, payload, band_keys)
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, []).append(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, _, band_keys = self._entries.pop(key)
+        for band_key in band_keys:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.remove(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, shingles: FrozenSet[str], threshold: float, accept=None) -> Optional[Tuple[str, float]]:
+        """
+        Most similar indexed entry at or above threshold.
+
+        Args:
+            shingles: Shingles of the probe
+            threshold: Minimum Jaccard similarity
+            accept: Optional predicate on an entry's payload (e.g. matching variants)
+
+        Returns:
+            Optional[Tuple[str, float]]: (key, similarity) of the best match, or None
+        """
+        if not shingles:
+            return None
+        band_keys = self._band_keys(shingles)
+        best = None
+        with self._lock:
+            collisions = Counter(key for band_key in band_keys for key in self._buckets.get(band_key, ()))
+            for key, _ in collisions.most_common(self.max_candidates):
+                entry_shingles, payload, _ = self._entries[key]
+                similarity = jaccard(shingles, entry_shingles)
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    if accept is None or accept(payload):
+                        best = (key, similarity)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class NearDuplicateMatcher:
+    """
+    Finds an earlier cache key whose product is a near duplicate of a new one.
+
+    Entries are partitioned (by marketplace, or by the requested ID types) so
+    only comparable lookups match. The category policy is lenient: similar
+    core names are enough. The identifier policy is variant-aware: brand and
+    every variant attribute (capacity, color, model numbers) must be equal,
+    and the core names must be nearly identical.
+    """
+
+    def __init__(self, threshold: float, variant_aware: bool = False, max_entries: int = 100000):
+        self.threshold = threshold
+        self.variant_aware = variant_aware
+        self.max_entries = max_entries
+        self._indexes: Dict[str, NearDuplicateIndex] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_categories(cls, threshold: float = 0.8) -> 'NearDuplicateMatcher':
+        return cls(threshold, variant_aware=False)
+
+    @classmethod
+    def for_identifiers(cls, threshold: float = 0.9) -> 'NearDuplicateMatcher':
+        return cls(threshold, variant_aware=True)
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.threshold <= 1.0
+
+    def spawn(self) -> 'NearDuplicateMatcher':
+        """Empty matcher with the same policy (e.g. for grouping one batch)."""
+        return NearDuplicateMatcher(self.threshold, self.variant_aware, self.max_entries)
+
+    def _index(self, partition: str) -> NearDuplicateIndex:
+        index = self._indexes.get(partition)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(partition, NearDuplicateIndex(max_entries=self.max_entries))
+        return index
+
+    def add(self, partition: str, key: str, title: str, brand: str = '') -> None:
+        if not self.enabled:
+            return
+        shingles, variants, normalized_brand = title_features(title, brand)
+        self._index(partition).add(key, shingles, (variants, normalized_brand))
+
+    def match(self, partition: str, title: str, brand: str = '') -> Optional[str]:
+        """
+        Key of the closest near-duplicate added to this partition, if any.
+
+        Args:
+            partition: Lookup partition (marketplace, requested ID types, ...)
+            title: Product title
+            brand: Brand field
+
+        Returns:
+            Optional[str]: The matching entry's key, or None
+        """
+        if not self.enabled or partition not in self._indexes:
+            return None
+        shingles, variants, normalized_brand = title_features(title, brand)
+
+        accept = (lambda payload: payload == (variants, normalized_brand)) if self.variant_aware else None
+
+        found = self._index(partition).query(shingles, self.threshold, accept)
+        return found[0] if found else None
@@ -0,0 +1,280 @@
+import os
+import re
+import csv
+import sys
+import mmap
+import struct
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ID_TYPES = ('upc', 'gtin', 'asin')
+
+MAGIC = b'JCATLG01'
+
+# magic, entry count, brand count, prefix count, then section offsets
+_HEADER = struct.Struct('<8sIIIQQQQ')
+_HASH = struct.Struct('<Q')
+_PATTERN = struct.Struct('<QQ')
+_RECORD_LENGTH = struct.Struct('<H')
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Longest brand / model phrases (in tokens) matched against a title
+MAX_BRAND_TOKENS = 3
+MAX_MODEL_TOKENS = 8
+
+def normalize_tokens(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens used for catalog keys and titles."""
+    return _TOKEN_RE.findall((text or '').lower())
+
+def _hash(text: str) -> int:
+    return _HASH.unpack(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest())[0]
+
+def _pattern_key(brand: str, model: str) -> str:
+    return f"{brand}\x1f{model}"
+
+def _prefix_key(brand: str, first_model_token: str) -> str:
+    return f"{brand}\x1e{first_model_token}"
+
+class ProductCatalog:
+    """
+    Read-only brand/model -> identifier index.
+
+    The index is a flat binary blob (see compile) holding three sorted hash
+    tables: known brand phrases, (brand, first model token) prefixes and
+    full (brand, model) patterns pointing at identifier records. Lookups
+    binary-search the blob directly, so a compiled catalog is opened with
+    mmap in constant time and shares pages between worker processes.
+
+    Matching is a token trie walk over the title: every brand phrase found in
+    the brand field or title is combined with every title position whose
+    token starts a model of that brand, and the longest model phrase wins.
+    """
+
+    def __init__(self, buffer, source: Optional[str] = None):
+        self._buffer = buffer
+        self.source = source
+
+        magic, self._entries, self._brands, self._prefixes, brands_at, prefixes_at, patterns_at, self._records_at = \
+            _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a compiled product catalog: {source or 'buffer'}")
+
+        self._brands_at = brands_at
+        self._prefixes_at = prefixes_at
+        self._patterns_at = patterns_at
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'ProductCatalog':
+        """Build an in-memory catalog from dicts with brand, model and id keys."""
+        return cls(cls._build(records))
+
+    @classmethod
+    def from_csv(cls, csv_path: str) -> 'ProductCatalog':
+        """Build an in-memory catalog from a brand,model,upc,gtin,asin CSV."""
+        return cls(cls._build(cls._read_csv(csv_path)), source=csv_path)
+
+    @classmethod
+    def open(cls, path: str) -> 'ProductCatalog':
+        """Memory-map a compiled catalog file."""
+        with open(path, 'rb') as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, source=path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ProductCatalog':
+        """
+        Open a catalog, compiling a CSV source on first use.
+
+        A CSV path is compiled next to itself (`<path>.idx`) and recompiled
+        whenever the CSV is newer than the index.
+
+        Args:
+            path: Compiled catalog or CSV file
+
+        Returns:
+            ProductCatalog: Memory-mapped catalog
+        """
+        if not path.lower().endswith('.csv'):
+            return cls.open(path)
+
+        compiled_path = f"{path}.idx"
+        if not os.path.exists(compiled_path) or os.path.getmtime(compiled_path) < os.path.getmtime(path):
+            cls.compile(path, compiled_path)
+        return cls.open(compiled_path)
+
+    @classmethod
+    def compile(cls, csv_path: str, output_path: str) -> int:
+        """
+        Compile a CSV catalog into the binary index format.
+
+        Args:
+            csv_path: CSV with brand, model and any of upc/gtin/asin columns
+            output_path: Destination file (written atomically)
+
+        Returns:
+            int: Number of indexed entries
+        """
+        blob = cls._build(cls._read_csv(csv_path))
+        tmp_path = f"{output_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as handle:
+            handle.write(blob)
+        os.replace(tmp_path, output_path)
+        return _HEADER.unpack_from(blob, 0)[1]
+
+    @staticmethod
+    def _read_csv(csv_path: str) -> Iterable[Dict]:
+        with open(csv_path, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                yield {(key or '').strip().lower(): value for key, value in row.items()}
+
+    @staticmethod
+    def _build(records: Iterable[Dict]) -> bytes:
+        brands = set()
+        prefixes = set()
+        patterns = {}
+
+        for record in records:
+            brand = ' '.join(normalize_tokens(record.get('brand', '')))
+            model_tokens = normalize_tokens(record.get('model', ''))
+            if not brand or not model_tokens:
+                continue
+            model = ' '.join(model_tokens)
+            key = _pattern_key(brand, model)
+            if key in patterns:
+                continue
+            ids = '\x1f'.join((record.get(id_type) or '').strip() for id_type in ID_TYPES)
+            brands.add(brand)
+            prefixes.add(_prefix_key(brand, model_tokens[0]))
+            patterns[key] = ids
+
+        brand_hashes = sorted({_hash(brand) for brand in brands})
+        prefix_hashes = sorted({_hash(prefix) for prefix in prefixes})
+
+        records_blob = bytearray()
+        pattern_rows = []
+        for key, ids in patterns.items():
+            payload = f"{key}\x1e{ids}".encode('utf-8')
+            pattern_rows.append((_hash(key), len(records_blob)))
+            records_blob += _RECORD_LENGTH.pack(len(payload)) + payload
+        pattern_rows.sort()
+
+        brands_at = _HEADER.size
+        prefixes_at = brands_at + len(brand_hashes) * _HASH.size
+        patterns_at = prefixes_at + len(prefix_hashes) * _HASH.size
+        records_at = patterns_at + len(pattern_rows) * _PATTERN.size
+
+        blob = bytearray(_HEADER.pack(MAGIC, len(pattern_rows), len(brand_hashes), len(prefix_hashes),
+                                      brands_at, prefixes_at, patterns_at, records_at))
+        for value in brand_hashes:
+            blob += _HASH.pack(value)
+        for value in prefix_hashes:
+            blob += _HASH.pack(value)
+        for row in pattern_rows:
+            blob += _PATTERN.pack(*row)
+        blob += records_blob
+
+        return bytes(blob)
+
+    def _find(self, table_at: int, count: int, row: struct.Struct, value: int) -> int:
+        """Binary search a sorted hash table; returns the row index or -1."""
+        low, high = 0, count - 1
+        unpack_from = row.unpack_from
+        size = row.size
+        buffer = self._buffer
+        while low <= high:
+            middle = (low + high) // 2
+            current = unpack_from(buffer, table_at + middle * size)[0]
+            if current < value:
+                low = middle + 1
+            elif current > value:
+                high = middle - 1
+            else:
+                # Step back to the first row carrying this hash
+                while middle > 0 and unpack_from(buffer, table_at + (middle - 1) * size)[0] == value:
+                    middle -= 1
+                return middle
+        return -1
+
+    def _has_brand(self, brand: str) -> bool:
+        return self._find(self._brands_at, self._brands, _HASH, _hash(brand)) >= 0
+
+    def _has_prefix(self, brand: str, token: str) -> bool:
+        return self._find(self._prefixes_at, self._prefixes, _HASH, _hash(_prefix_key(brand, token))) >= 0
+
+    def _get(self, brand: str, model: str) -> Optional[Dict[str, str]]:
+        key = _pattern_key(brand, model)
+        value = _hash(key)
+        index = self._find(self._patterns_at, self._entries, _PATTERN, value)
+        if index < 0:
+            return None
+
+        buffer = self._buffer
+        while index < self._entries:
+            row_hash, offset = _PATTERN.unpack_from(buffer, self._patterns_at + index * _PATTERN.size)
+            if row_hash != value:
+                break
+            start = self._records_at + offset
+            length = _RECORD_LENGTH.unpack_from(buffer, start)[0]
+            payload = bytes(buffer[start + _RECORD_LENGTH.size:start + _RECORD_LENGTH.size + length]).decode('utf-8')
+            record_key, ids = payload.split('\x1e', 1)
+            if record_key == key:
+                return {id_type: value for id_type, value in zip(ID_TYPES, ids.split('\x1f')) if value}
+            index += 1
+
+        return None
+
+    def _brand_candidates(self, tokens: List[str]) -> List[Tuple[str, int, int]]:
+        """Brand phrases present in tokens, as (brand, start, end) spans."""
+        found = []
+        for start in range(len(tokens)):
+            for end in range(start + 1, min(start + MAX_BRAND_TOKENS, len(tokens)) + 1):
+                phrase = ' '.join(tokens[start:end])
+                if self._has_brand(phrase):
+                    found.append((phrase, start, end))
+        return found
+
+    def lookup(self, title: str, brand: str = '') -> Dict[str, str]:
+        """
+        Find identifiers for the longest catalog model named in the title.
+
+        Args:
+            title: Product title
+            brand: Brand field, if any
+
+        Returns:
+            Dict[str, str]: Known identifiers (subset of upc/gtin/asin); empty if no match
+        """
+        if not self._entries:
+            return {}
+
+        title_tokens = normalize_tokens(title)
+        brands = [phrase for phrase, _, _ in self._brand_candidates(normalize_tokens(brand))]
+        brands += [phrase for phrase, _, _ in self._brand_candidates(title_tokens)]
+
+        best = None
+        best_length = 0
+        for brand_phrase in dict.fromkeys(brands):
+            for start, token in enumerate(title_tokens):
+                if not self._has_prefix(brand_phrase, token):
+                    continue
+                for end in range(min(start + MAX_MODEL_TOKENS, len(title_tokens)), start, -1):
+                    if end - start <= best_length:
+                        break
+                    ids = self._get(brand_phrase, ' '.join(title_tokens[start:end]))
+                    if ids is not None:
+                        best, best_length = ids, end - start
+                        break
+
+        return dict(best) if best else {}
+
+    def __len__(self) -> int:
+        return self._entries
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m server.utils.product_catalog <catalog.csv> <output.idx>")
+        sys.exit(1)
+
+    count = ProductCatalog.compile(sys.argv[1], sys.argv[2])
+    print(f"Compiled {count} catalog entries into {sys.argv[2]}")
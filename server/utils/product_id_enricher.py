@@ -1,16 +1,52 @@
-import openai
 import os
 import re
 from typing import Dict, List, Optional, Tuple
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from server.utils.cache_backend import CacheBackend, create_cache
+from server.utils.llm_client import get_client
+from server.utils.metrics import CATALOG_LOOKUPS, ID_VALIDATION_REJECTS, NEAR_DUPLICATE_HITS
+from server.utils.near_duplicate import NearDuplicateMatcher
+from server.utils.product_catalog import ProductCatalog
+from server.utils.single_flight import SingleFlight
+from server.utils.llm_scheduler import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceeded, LLMScheduler, bind_context, estimate_request_tokens,
+    get_scheduler
+)
+from server.utils.gs1 import GS1_LENGTHS, derive_identifiers, derive_identifiers_bulk, is_valid_gs1
+
+ASIN_RE = re.compile(r'^[A-Z0-9]{10}$')
 
 class ProductIDEnricher:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, cache: Optional[CacheBackend] = None, catalog: Optional[ProductCatalog] = None,
+                 max_workers: Optional[int] = None, scheduler: Optional[LLMScheduler] = None,
+                 near_duplicate_threshold: Optional[float] = None):
+        # OpenAI client comes from the shared, lazily created pool unless overridden
+        self._client = None
+        
+        # Rate limiting, backoff and retries shared with every other LLM caller in the process
+        self.scheduler = scheduler or get_scheduler()
+        
+        # Worker threads used by batch_enrich_products for distinct products
+        self.max_workers = max_workers or int(os.getenv('PRODUCT_ID_ENRICHER_CONCURRENCY', '8'))
+        
+        # Concurrent lookups for the same cache key share one in-flight request
+        self._inflight = SingleFlight()
         
-        # Cache for product ID lookups
-        self.id_cache = {}
+        # Counters for the most recent batch_enrich_products call
+        self.batch_stats = {'rows': 0, 'unique_keys': 0, 'dedup_ratio': 0.0, 'shared_inflight': 0}
+        
+        # Cache for product ID lookups (LRU in front of a shared SQLite file)
+        self.id_cache = cache if cache is not None else create_cache('product_ids')
+        
+        # Stricter than categories: a near-duplicate title only reuses generated IDs when brand and every
+        # variant attribute (capacity, color, model numbers) match; a threshold outside (0, 1] turns this off
+        self.near_duplicates = NearDuplicateMatcher.for_identifiers(
+            near_duplicate_threshold if near_duplicate_threshold is not None
+            else float(os.getenv('PRODUCT_ID_NEAR_DUPLICATE_THRESHOLD', '0.9'))
+        )
         
         # Mock database of common products (in real implementation, this would be a proper database)
         self.mock_product_db = {
@@ -28,30 +64,86 @@ class ProductIDEnricher:
                 'air 13': {'upc': '194253043085', 'gtin': '0194253043085', 'asin': 'B0BDJ6ZPYM'},
             }
         }
+        
+        # Indexed brand/model -> ID catalog; PRODUCT_CATALOG_PATH points at a CSV or compiled index,
+        # otherwise the mock database above is indexed in memory
+        if catalog is None:
+            catalog_path = os.getenv('PRODUCT_CATALOG_PATH')
+            if catalog_path:
+                catalog = ProductCatalog.load(catalog_path)
+            else:
+                catalog = ProductCatalog.from_records(
+                    {'brand': brand, 'model': model, **ids}
+                    for brand, models in self.mock_product_db.items()
+                    for model, ids in models.items()
+                )
+        self.catalog = catalog
+    
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_client()
+    
+    @client.setter
+    def client(self, value) -> None:
+        self._client = value
     
-    def enrich_product_ids(self, product_data: Dict) -> Dict:
+    def enrich_product_ids(self, product_data: Dict, derived_ids: Optional[Dict[str, str]] = None,
+                           priority: int = PRIORITY_INTERACTIVE) -> Dict:
         """
         Enrich product data with missing UPC, GTIN, and ASIN identifiers.
         
         Args:
             product_data: Dictionary containing product information
+            derived_ids: Precomputed gs1.derive_identifiers result (batch callers validate in bulk)
+            priority: Scheduler priority of any LLM request
+            
+        Returns:
+            Dict: Product data with enriched identifiers; 'backfill' is set to 'ids' when the
+                LLM ran out of its latency budget and only derived and catalog IDs were filled
+        """
+        enriched_data, missing_ids = self._prepare_ids(product_data, derived_ids)
+        
+        # Use GPT only for the IDs the catalog could not supply
+        if missing_ids:
+            try:
+                generated_ids = self._generate_missing_ids(product_data, missing_ids, priority)
+            except DeadlineExceeded:
+                enriched_data['backfill'] = 'ids'
+                return enriched_data
+            self._apply_generated_ids(enriched_data, generated_ids)
+        
+        return enriched_data
+    
+    def _prepare_ids(self, product_data: Dict,
+                     derived_ids: Optional[Dict[str, str]] = None) -> Tuple[Dict, List[str]]:
+        """
+        Fill every identifier that does not need the LLM.
+        
+        Args:
+            product_data: Dictionary containing product information
+            derived_ids: Precomputed gs1.derive_identifiers result
             
         Returns:
-            Dict: Product data with enriched identifiers
+            Tuple[Dict, List[str]]: Product data with derived and catalog IDs, and the ID types still missing
         """
         enriched_data = product_data.copy()
         
+        # UPC <-> GTIN conversions are deterministic; never ask GPT for them
+        if derived_ids is None:
+            derived_ids = derive_identifiers(product_data)
+        self._fill_derived_ids(enriched_data, derived_ids)
+        
         # Check what IDs are missing
         missing_ids = []
-        if not product_data.get('upc'):
+        if not enriched_data.get('upc'):
             missing_ids.append('upc')
-        if not product_data.get('gtin'):
+        if not enriched_data.get('gtin'):
             missing_ids.append('gtin')
-        if not product_data.get('asin'):
+        if not enriched_data.get('asin'):
             missing_ids.append('asin')
         
         if not missing_ids:
-            return enriched_data
+            return enriched_data, missing_ids
         
         # Try to find existing IDs first
         found_ids = self._lookup_existing_ids(product_data)
@@ -60,19 +152,26 @@ class ProductIDEnricher:
         for id_type, value in found_ids.items():
             if value:
                 enriched_data[id_type] = value
+        self._fill_derived_ids(enriched_data, derive_identifiers(enriched_data))
         
-        # Use GPT to generate missing IDs if needed
-        if missing_ids:
-            generated_ids = self._generate_missing_ids(product_data, missing_ids)
-            for id_type, value in generated_ids.items():
-                if value and not enriched_data.get(id_type):
-                    enriched_data[id_type] = value
-        
-        return enriched_data
+        return enriched_data, [id_type for id_type in missing_ids if not enriched_data.get(id_type)]
+    
+    def _apply_generated_ids(self, enriched_data: Dict, generated_ids: Dict[str, str]) -> None:
+        """Fill still-empty ID fields from generated IDs, then derive UPC/GTIN from each other."""
+        for id_type, value in generated_ids.items():
+            if value and not enriched_data.get(id_type):
+                enriched_data[id_type] = value
+        self._fill_derived_ids(enriched_data, derive_identifiers(enriched_data))
+    
+    def _fill_derived_ids(self, enriched_data: Dict, derived_ids: Dict[str, str]) -> None:
+        """Fill empty upc/gtin fields from derived GS1 identifiers."""
+        for id_type in ('upc', 'gtin'):
+            if derived_ids.get(id_type) and not enriched_data.get(id_type):
+                enriched_data[id_type] = derived_ids[id_type]
     
     def _lookup_existing_ids(self, product_data: Dict) -> Dict[str, Optional[str]]:
         """
-        Look up existing product IDs from mock database.
+        Look up existing product IDs from the product catalog.
         
         Args:
             product_data: Product information
@@ -80,55 +179,79 @@ class ProductIDEnricher:
         Returns:
             Dict: Found IDs
         """
-        title = product_data.get('title', '').lower()
-        brand = product_data.get('brand', '').lower()
-        
-        found_ids = {}
-        
-        # Simple keyword matching for mock lookup
-        for brand_key, models in self.mock_product_db.items():
-            if brand_key in brand or brand_key in title:
-                for model_key, ids in models.items():
-                    if model_key in title:
-                        found_ids.update(ids)
-                        break
-        
+        found_ids = self.catalog.lookup(product_data.get('title', ''), product_data.get('brand', ''))
+        CATALOG_LOOKUPS.labels('hit' if found_ids else 'miss').inc()
         return found_ids
     
-    def _generate_missing_ids(self, product_data: Dict, missing_ids: List[str]) -> Dict[str, str]:
+    def _generate_missing_ids(self, product_data: Dict, missing_ids: List[str],
+                              priority: int = PRIORITY_INTERACTIVE) -> Dict[str, str]:
         """
         Use GPT to generate missing product IDs.
         
         Args:
             product_data: Product information
             missing_ids: List of missing ID types to generate
+            priority: Scheduler priority of the LLM request
             
         Returns:
             Dict: Generated IDs
         """
-        # Create a cache key
-        cache_key = f"{product_data.get('title', '')}_{product_data.get('brand', '')}_{','.join(missing_ids)}"
+        cache_key = self._id_cache_key(product_data, missing_ids)
         
-        if cache_key in self.id_cache:
-            return self.id_cache[cache_key]
+        cached = self._cached_ids(product_data, missing_ids)
+        if cached is not None:
+            return cached
         
-        prompt = self._build_id_generation_prompt(product_data, missing_ids)
+        return self._inflight.do(
+            cache_key, lambda: self._request_missing_ids(product_data, missing_ids, cache_key, priority)
+        )
+    
+    def _id_cache_key(self, product_data: Dict, missing_ids: List[str]) -> str:
+        """Build the cache key for generated IDs of a product."""
+        return f"{product_data.get('title', '')}_{product_data.get('brand', '')}_{','.join(missing_ids)}"
+    
+    def _cached_ids(self, product_data: Dict, missing_ids: List[str]) -> Optional[Dict[str, str]]:
+        """Previously generated IDs for this product or a variant-identical near duplicate."""
+        
+        cached = self.id_cache.get(self._id_cache_key(product_data, missing_ids))
+        if cached is not None:
+            return cached
+        
+        similar_key = self.near_duplicates.match(','.join(missing_ids), product_data.get('title', ''),
+                                                 product_data.get('brand', ''))
+        if similar_key is not None:
+            cached = self.id_cache.get(similar_key)
+            if cached is not None:
+                NEAR_DUPLICATE_HITS.labels('product_ids').inc()
+                return cached
+        
+        return None
+    
+    def _store_generated_ids(self, product_data: Dict, missing_ids: List[str], cache_key: str,
+                             generated_ids: Dict[str, str]) -> None:
+        """Cache parsed IDs and index the product for near-duplicate reuse."""
+        self.id_cache[cache_key] = generated_ids
+        if generated_ids:
+            self.near_duplicates.add(','.join(missing_ids), cache_key, product_data.get('title', ''),
+                                     product_data.get('brand', ''))
+    
+    def _request_missing_ids(self, product_data: Dict, missing_ids: List[str], cache_key: str,
+                             priority: int = PRIORITY_INTERACTIVE) -> Dict[str, str]:
+        """Call GPT for missing IDs and cache the parsed result."""
+        
+        # Another flight for this key may have completed while we were queued
+        cached = self.id_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        request = self._id_completion_kwargs(product_data, missing_ids)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a product identifier expert. Generate realistic product IDs based on the product information. Return only valid IDs in the specified format."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=100,
-                temperature=0.1
+            response = self.scheduler.call(
+                lambda: self.client.chat.completions.create(**request),
+                priority=priority,
+                estimated_tokens=estimate_request_tokens(request),
+                component='product_ids'
             )
             
             result_text = response.choices[0].message.content.strip()
@@ -137,20 +260,39 @@ class ProductIDEnricher:
             generated_ids = self._parse_generated_ids(result_text, missing_ids)
             
             # Cache the result
-            self.id_cache[cache_key] = generated_ids
+            self._store_generated_ids(product_data, missing_ids, cache_key, generated_ids)
             
             return generated_ids
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error generating product IDs: {e}")
             return {}
     
-    def _build_id_generation_prompt(self, product_data: Dict, missing_ids: List[str]) -> str:
-        """Build the prompt for ID generation."""
+    def _id_completion_kwargs(self, product_data: Dict, missing_ids: List[str]) -> Dict:
+        """Build the chat completion request for ID generation."""
         
-        title = product_data.get('title', '')
-        brand = product_data.get('brand', '')
-        description = product_data.get('description', '')
+        prompt = self._build_id_generation_prompt(product_data, missing_ids)
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a product identifier expert. Generate realistic product IDs based on the product information. Return only valid IDs in the specified format."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": 100,
+            "temperature": 0.1
+        }
+    
+    def _render_id_requirements(self, missing_ids: List[str]) -> str:
+        """Render the requested identifier types as prompt lines."""
         
         id_requirements = {
             'upc': '12-digit UPC code (e.g., 123456789012)',
@@ -162,6 +304,17 @@ class ProductIDEnricher:
         for id_type in missing_ids:
             requirements_text += f"- {id_type.upper()}: {id_requirements.get(id_type, 'standard format')}\n"
         
+        return requirements_text
+    
+    def _build_id_generation_prompt(self, product_data: Dict, missing_ids: List[str]) -> str:
+        """Build the prompt for ID generation."""
+        
+        title = product_data.get('title', '')
+        brand = product_data.get('brand', '')
+        description = product_data.get('description', '')
+        
+        requirements_text = self._render_id_requirements(missing_ids)
+        
         prompt = f"""Generate the following product identifiers for this product:
 
 Product Information:
@@ -194,44 +347,126 @@ Only include the identifiers that were requested:"""
                 key = key.strip().lower()
                 value = value.strip()
                 
-                if key in missing_ids and self._validate_id_format(key, value):
-                    generated_ids[key] = value
+                if key in missing_ids:
+                    if self._validate_id_format(key, value):
+                        generated_ids[key] = value
+                    else:
+                        ID_VALIDATION_REJECTS.labels(key).inc()
         
         return generated_ids
     
     def _validate_id_format(self, id_type: str, value: str) -> bool:
         """Validate the format of generated IDs."""
         
-        if id_type == 'upc':
-            # UPC should be 12 digits
-            return bool(re.match(r'^\d{12}$', value))
-        elif id_type == 'gtin':
-            # GTIN should be 13 digits
-            return bool(re.match(r'^\d{13}$', value))
+        if id_type in ('upc', 'gtin'):
+            # UPC should be 12 digits, GTIN 13, both with a valid GS1 check digit
+            return is_valid_gs1(value, GS1_LENGTHS[id_type])
         elif id_type == 'asin':
             # ASIN should be 10 characters, alphanumeric
-            return bool(re.match(r'^[A-Z0-9]{10}$', value))
+            return bool(ASIN_RE.match(value))
         
         return True
     
-    def batch_enrich_products(self, products: List[Dict]) -> List[Dict]:
+    def bulk_request(self, product_data: Dict,
+                     derived_ids: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, Dict]]:
+        """
+        Chat completion request for an offline bulk job (see bulk_jobs).
+        
+        Args:
+            product_data: Dictionary containing product information
+            derived_ids: Precomputed gs1.derive_identifiers result
+            
+        Returns:
+            Optional[Tuple[str, Dict]]: ID cache key and request body, or None when derived, catalog
+                or cached IDs already cover the product
+        """
+        _, missing_ids = self._prepare_ids(product_data, derived_ids)
+        if not missing_ids or self._cached_ids(product_data, missing_ids) is not None:
+            return None
+        return self._id_cache_key(product_data, missing_ids), self._id_completion_kwargs(product_data, missing_ids)
+    
+    def ingest_bulk_answer(self, product_data: Dict, missing_ids: List[str], answer: str) -> Dict[str, str]:
+        """
+        Parse, validate and cache a bulk job answer exactly like a live one.
+        
+        Returns:
+            Dict[str, str]: Generated IDs that passed validation
+        """
+        generated_ids = self._parse_generated_ids(answer, missing_ids)
+        self._store_generated_ids(product_data, missing_ids, self._id_cache_key(product_data, missing_ids),
+                                  generated_ids)
+        return generated_ids
+    
+    def batch_enrich_products(self, products: List[Dict], max_workers: Optional[int] = None) -> List[Dict]:
         """
         Enrich multiple products with missing identifiers.
         
+        Rows are grouped by a normalized title/brand/ID key and each distinct
+        key is enriched exactly once (concurrently across keys); the resulting
+        identifiers are then copied onto every row of the group. Dedup
+        counters are left in self.batch_stats.
+        
         Args:
             products: List of product dictionaries
+            max_workers: Threads for distinct keys (defaults to self.max_workers)
             
         Returns:
-            List[Dict]: List of enriched product dictionaries
+            List[Dict]: List of enriched product dictionaries, in input order
         """
-        enriched_products = []
-        
-        for product in products:
-            enriched_product = self.enrich_product_ids(product)
-            enriched_products.append(enriched_product)
+        # Validate and derive GS1 identifiers column-wise before any per-row work
+        derived = derive_identifiers_bulk(products)
+        
+        groups: Dict[Tuple, List[int]] = {}
+        for index, product in enumerate(products):
+            groups.setdefault(self._dedup_key(product, derived[index]), []).append(index)
+        
+        shared_before = self._inflight.shared
+        
+        def enrich(indices: List[int]) -> Dict:
+            first = indices[0]
+            return self.enrich_product_ids(products[first], derived[first], PRIORITY_BATCH)
+        
+        workers = max_workers or self.max_workers
+        if workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+                results = list(pool.map(bind_context(enrich), groups.values()))
+        else:
+            results = [enrich(indices) for indices in groups.values()]
+        
+        enriched_products: List[Optional[Dict]] = [None] * len(products)
+        for indices, enriched in zip(groups.values(), results):
+            enriched_products[indices[0]] = enriched
+            for index in indices[1:]:
+                enriched_product = products[index].copy()
+                for id_type in ('upc', 'gtin', 'asin', 'backfill'):
+                    if enriched.get(id_type):
+                        enriched_product[id_type] = enriched[id_type]
+                enriched_products[index] = enriched_product
+        
+        self.batch_stats = {
+            'rows': len(products),
+            'unique_keys': len(groups),
+            'dedup_ratio': 1 - len(groups) / len(products) if products else 0.0,
+            'shared_inflight': self._inflight.shared - shared_before
+        }
         
         return enriched_products
     
+    def _dedup_key(self, product_data: Dict, derived_ids: Dict[str, str]) -> Tuple:
+        """Normalized key under which rows are guaranteed the same enrichment."""
+        
+        def normalize(value) -> str:
+            return ' '.join(str(value or '').lower().split())
+        
+        return (
+            normalize(product_data.get('title')),
+            normalize(product_data.get('brand')),
+            normalize(product_data.get('description')),
+            normalize(product_data.get('upc')) or derived_ids.get('upc', ''),
+            normalize(product_data.get('gtin')) or derived_ids.get('gtin', ''),
+            normalize(product_data.get('asin'))
+        )
+    
     def get_enrichment_confidence(self, product_data: Dict, enriched_data: Dict) -> float:
         """
         Get confidence score for the enrichment process.
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from server.utils.column_mapper import normalize_header
+
+# Bump when the fingerprint inputs change, so stored results are not reused across incompatible runs
+FINGERPRINT_VERSION = 1
+
+# Headers (normalized) that identify a row across uploads, most specific first
+ROW_KEY_ALIASES = ('sku', 'sellersku', 'itemsku', 'internalsku', 'yoursku', 'skuid', 'itemid', 'productid', 'id')
+
+# Output fields stored per row and restored for unchanged rows
+RESULT_FIELDS = ('category', 'category_tier', 'upc', 'gtin', 'asin', 'backfill')
+
+def normalize_value(value) -> str:
+    """Canonical form of a cell: NFC, trimmed, inner whitespace collapsed (case is kept)."""
+    return ' '.join(unicodedata.normalize('NFC', str(value or '')).split())
+
+def content_hash(values: Iterable[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        digest.update(normalize_value(value).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+def find_row_key_column(headers: List[str]) -> Optional[str]:
+    """Input header that identifies a row (a SKU or ID column), if the feed has one."""
+    by_name = {normalize_header(header): header for header in headers}
+    for alias in ROW_KEY_ALIASES:
+        if alias in by_name:
+            return by_name[alias]
+    return None
+
+def default_store_path() -> str:
+    """Location of the fingerprint store (ENRICHMENT_FINGERPRINT_PATH overrides it)."""
+    return os.getenv('ENRICHMENT_FINGERPRINT_PATH',
+                     os.path.join(tempfile.gettempdir(), 'jadoo_row_fingerprints.sqlite3'))
+
+class FingerprintStore:
+    """
+    Persistent per-supplier record of the rows of the last upload.
+
+    For each row key it keeps a hash of the enrichment inputs, a hash of
+    the whole row and the enrichment result, so a re-upload only needs to
+    enrich rows whose inputs changed. Each save stamps the run id; rows not
+    stamped by the latest run are the ones the supplier removed.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_store_path()
+        self._local = threading.local()
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "supplier TEXT NOT NULL, row_key TEXT NOT NULL, input_hash TEXT NOT NULL, "
+                "row_hash TEXT NOT NULL, result TEXT NOT NULL, run_id TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (supplier, row_key))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            if self.path != ':memory:':
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, supplier: str) -> Dict[str, Tuple[str, str, Dict]]:
+        """
+        Every stored row of a supplier.
+
+        Returns:
+            Dict[str, Tuple[str, str, Dict]]: row key -> (input hash, row hash, result)
+        """
+        rows = self._connection().execute(
+            "SELECT row_key, input_hash, row_hash, result FROM fingerprints WHERE supplier = ?", (supplier,)
+        )
+        return {row_key: (input_hash, row_hash, json.loads(result)) for row_key, input_hash, row_hash, result in rows}
+
+    def save(self, supplier: str, run_id: str, entries: Iterable[Tuple[str, str, str, Dict]]) -> None:
+        """
+        Record rows seen in a run.
+
+        Args:
+            supplier: Supplier the feed belongs to
+            run_id: Identifier of this run
+            entries: (row key, input hash, row hash, result) tuples
+        """
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(supplier, row_key, input_hash, row_hash, result, run_id, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((supplier, row_key, input_hash, row_hash, json.dumps(result), run_id, now)
+                 for row_key, input_hash, row_hash, result in entries)
+            )
+
+    def remove_missing(self, supplier: str, run_id: str) -> List[str]:
+        """Delete the supplier's rows that run_id did not see; returns their keys."""
+        with self._connection() as conn:
+            removed = [row_key for (row_key,) in conn.execute(
+                "SELECT row_key FROM fingerprints WHERE supplier = ? AND run_id != ?", (supplier, run_id)
+            )]
+            conn.execute("DELETE FROM fingerprints WHERE supplier = ? AND run_id != ?", (supplier, run_id))
+        return removed
+
+    def clear(self, supplier: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM fingerprints WHERE supplier = ?", (supplier,))
+
+def _content_keyed(row_key: str, row_hash: str) -> bool:
+    """Whether a row key is the row's own hash (possibly with an occurrence suffix) rather than a SKU."""
+    return row_key.partition('#')[0] == row_hash
+
+class IncrementalRun:
+    """
+    Splits an upload into rows that need enrichment and rows whose stored result still holds.
+
+    Rows are keyed by the feed's SKU/ID column, or by their content (the
+    whole-row hash) when there is none, so unkeyed rows match stored rows
+    by what they contain rather than by position; repeated keys get an
+    occurrence suffix. A row's stored result is reused when its input hash
+    (the mapped enrichment fields plus the run configuration) matches the
+    stored one, or, for a row with no stored entry, any stored row's, and
+    that result was not marked for backfill (answered locally because no
+    LLM answer was available). The whole-row hash only feeds the delta
+    report, so e.g. a price change is reported as changed without costing
+    an enrichment.
+    """
+
+    def __init__(self, store: FingerprintStore, supplier: str, headers: List[str], field_map: Dict[str, str],
+                 config: str = '', run_id: Optional[str] = None):
+        self.store = store
+        self.supplier = supplier
+        self.headers = list(headers)
+        self.field_map = dict(field_map)
+        self.run_id = run_id or time.strftime('%Y%m%dT%H%M%S') + f"-{os.getpid()}"
+        self.key_column = find_row_key_column(self.headers)
+
+        # Mapped fields in a fixed order, and everything that changes the output for the same inputs
+        self._input_fields = sorted(self.field_map.items())
+        self._salt = f"v{FINGERPRINT_VERSION}|{config}|{json.dumps(self._input_fields)}"
+
+        self.previous = store.load(supplier)
+        # input hash -> a reusable stored result, for rows whose key was not stored
+        self._results = {input_hash: result for input_hash, _, result in self.previous.values()
+                         if not result.get('backfill')}
+        # Content-keyed new rows' input hashes, paired with removed ones in finish
+        self._new_inputs: Dict[str, str] = {}
+        self._occurrences: Dict[str, int] = {}
+        self._pending: List[Tuple[str, str, str, Dict]] = []
+        self.started = time.time()
+        self.delta = {'new': [], 'changed': [], 'unchanged': 0, 'reenriched': 0}
+
+    def fingerprint(self, row: Dict[str, str]) -> Tuple[str, str, str]:
+        """(row key, input hash, row hash) of a feed row."""
+        input_hash = content_hash([self._salt] + [row.get(header) for _, header in self._input_fields])
+        row_hash = content_hash(row.get(header) for header in self.headers)
+
+        base_key = normalize_value(row.get(self.key_column)) if self.key_column else ''
+        base_key = base_key or row_hash
+        occurrence = self._occurrences.get(base_key, 0)
+        self._occurrences[base_key] = occurrence + 1
+        row_key = base_key if occurrence == 0 else f"{base_key}#{occurrence}"
+
+        return row_key, input_hash, row_hash
+
+    def split(self, batch: List[Dict[str, str]]) -> Tuple[List[int], List[Tuple[str, str, str]]]:
+        """
+        Restore stored results onto unchanged rows of a batch.
+
+        Returns:
+            Tuple[List[int], List[Tuple[str, str, str]]]: Indices of rows that still need enrichment,
+                and the fingerprint of every row in the batch
+        """
+        stale = []
+        fingerprints = []
+        for index, row in enumerate(batch):
+            row_key, input_hash, row_hash = fingerprint = self.fingerprint(row)
+            fingerprints.append(fingerprint)
+            stored = self.previous.get(row_key)
+
+            if stored is None:
+                self.delta['new'].append(row_key)
+                if _content_keyed(row_key, row_hash):
+                    self._new_inputs[row_key] = input_hash
+            elif stored[1] != row_hash:
+                self.delta['changed'].append(row_key)
+
+            if stored is not None and stored[0] == input_hash and not stored[2].get('backfill'):
+                self.delta['unchanged'] += stored[1] == row_hash
+                self._restore(row, stored[2])
+            elif stored is None and input_hash in self._results:
+                self._restore(row, self._results[input_hash])
+            else:
+                stale.append(index)
+
+        self.delta['reenriched'] += len(stale)
+        return stale, fingerprints
+
+    def _column(self, field: str) -> str:
+        # Identifiers are written back into the feed's own ID columns when it has them
+        return self.field_map.get(field, field) if field in ('upc', 'gtin', 'asin') else field
+
+    def _restore(self, row: Dict[str, str], result: Dict) -> None:
+        for field, value in result.items():
+            if value:
+                row[self._column(field)] = value
+
+    def record(self, batch: List[Dict[str, str]], fingerprints: List[Tuple[str, str, str]]) -> None:
+        """Queue the (now enriched) batch for saving."""
+        for row, (row_key, input_hash, row_hash) in zip(batch, fingerprints):
+            result = {field: row.get(self._column(field), '') for field in RESULT_FIELDS}
+            self._pending.append((row_key, input_hash, row_hash, result))
+        if len(self._pending) >= 5000:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self.store.save(self.supplier, self.run_id, self._pending)
+            self._pending = []
+
+    def finish(self) -> Dict:
+        """
+        Save the remaining rows, drop the rows this upload no longer has, and build the delta report.
+
+        Returns:
+            Dict: supplier, run_id, rows, new, changed, unchanged, removed, reenriched, seconds, and the
+                new / changed / removed row keys
+        """
+        self.flush()
+        removed = self.store.remove_missing(self.supplier, self.run_id)
+        rows = sum(self._occurrences.values())
+
+        # An edit outside the enrichment fields of a content-keyed row shows up as a new
+        # key and a removed one with the same inputs; report those pairs as changed
+        removed_by_input = defaultdict(list)
+        for row_key in removed:
+            input_hash, row_hash, _ = self.previous.get(row_key, ('', '', None))
+            if _content_keyed(row_key, row_hash):
+                removed_by_input[input_hash].append(row_key)
+        paired = []
+        for row_key in self.delta['new']:
+            matches = removed_by_input.get(self._new_inputs.get(row_key))
+            if matches:
+                paired.append((row_key, matches.pop()))
+        if paired:
+            new_keys, removed_keys = (set(keys) for keys in zip(*paired))
+            self.delta['new'] = [row_key for row_key in self.delta['new'] if row_key not in new_keys]
+            self.delta['changed'].extend(row_key for row_key, _ in paired)
+            removed = [row_key for row_key in removed if row_key not in removed_keys]
+
+        return {
+            'supplier': self.supplier,
+            'run_id': self.run_id,
+            'key_column': self.key_column,
+            'rows': rows,
+            'new': len(self.delta['new']),
+            'changed': len(self.delta['changed']),
+            'unchanged': self.delta['unchanged'],
+            'removed': len(removed),
+            'reenriched': self.delta['reenriched'],
+            'reenriched_ratio': round(self.delta['reenriched'] / rows, 4) if rows else 0.0,
+            'seconds': round(time.time() - self.started, 3),
+            'new_keys': self.delta['new'],
+            'changed_keys': self.delta['changed'],
+            'removed_keys': removed,
+        }
@@ -0,0 +1,273 @@
+import os
+import csv
+import json
+import math
+import heapq
+import itertools
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from server.utils.local_classifier import tokenize
+
+SEPARATOR = ' > '
+
+TAXONOMY_EXTENSIONS = ('.json', '.csv', '.txt')
+
+# CSV header names recognised for the category path and node id columns
+_PATH_COLUMNS = ('path', 'category_path', 'category', 'browse_path', 'full_path')
+_ID_COLUMNS = ('id', 'node_id', 'browse_node_id', 'category_id')
+
+class Taxonomy:
+    """
+    Marketplace category tree indexed for local candidate retrieval.
+
+    Holds every node path ("Electronics > Cell Phones > Smartphones") with
+    its optional marketplace node id, and an inverted index from tokens to
+    leaves: a leaf's own name weighs fully, its ancestors' names less, and
+    every token is scaled by its inverse document frequency so generic words
+    ("accessories", "electronics") do not drown out specific ones. Tokens on
+    more than MAX_POSTINGS leaves (ancestor names, common words) only add to
+    leaves a rarer token already found, so retrieval cost depends on the
+    query's tokens and MAX_POSTINGS, not on the size of the tree.
+    """
+
+    LEAF_WEIGHT = 1.0
+    ANCESTOR_WEIGHT = 0.3
+    HINT_WEIGHT = 3.0
+    # Leaves a token may retrieve; tokens on more leaves only rescore candidates
+    MAX_POSTINGS = 500
+
+    def __init__(self, paths: Iterable[str], node_ids: Optional[Dict[str, str]] = None,
+                 keyword_hints: Optional[Dict[str, List[str]]] = None):
+        self.paths: List[str] = []
+        self.children: Dict[str, List[str]] = defaultdict(list)
+        self.node_ids: Dict[str, str] = dict(node_ids or {})
+        self._lower: Dict[str, str] = {}
+
+        for path in paths:
+            parts = [part.strip() for part in path.split(SEPARATOR) if part.strip()]
+            for depth in range(1, len(parts) + 1):
+                self._add_node(SEPARATOR.join(parts[:depth]))
+
+        self.leaves = [path for path in self.paths if path not in self.children]
+        self.roots = [path for path in self.paths if SEPARATOR not in path]
+        self._build_index(keyword_hints or {})
+
+    def _add_node(self, path: str) -> None:
+        if path.lower() in self._lower:
+            return
+        self._lower[path.lower()] = path
+        self.paths.append(path)
+        parent, _, _ = path.rpartition(SEPARATOR)
+        if parent:
+            self.children[parent].append(path)
+
+    def _build_index(self, keyword_hints: Dict[str, List[str]]) -> None:
+        index: Dict[str, Dict[int, float]] = defaultdict(dict)
+
+        for leaf_index, path in enumerate(self.leaves):
+            parts = path.split(SEPARATOR)
+            weights: Dict[str, float] = {}
+            for depth, part in enumerate(parts):
+                weight = self.LEAF_WEIGHT if depth == len(parts) - 1 else self.ANCESTOR_WEIGHT
+                for token in tokenize(part):
+                    weights[token] = max(weights.get(token, 0.0), weight)
+            for keyword in keyword_hints.get(parts[-1], []):
+                weights[keyword] = max(weights.get(keyword, 0.0), self.HINT_WEIGHT)
+            for token, weight in weights.items():
+                index[token][leaf_index] = weight
+
+        # Rare tokens identify a leaf; tokens shared by most of the tree barely count
+        total = max(1, len(self.leaves))
+        self._index: Dict[str, List[Tuple[int, float]]] = {}
+        self._common: Dict[str, Dict[int, float]] = {}
+        for token, postings in index.items():
+            idf = math.log(1 + total / len(postings))
+            if len(postings) <= self.MAX_POSTINGS:
+                self._index[token] = [(leaf_index, weight * idf) for leaf_index, weight in postings.items()]
+            else:
+                self._common[token] = {leaf_index: weight * idf for leaf_index, weight in postings.items()}
+
+    @classmethod
+    def from_dict(cls, tree: Dict, keyword_hints: Optional[Dict[str, List[str]]] = None) -> 'Taxonomy':
+        """
+        Build a taxonomy from a nested dict ({"Electronics": ["Cell Phones", ...]} or deeper dicts).
+
+        Args:
+            tree: Category name -> child names (list), subtree (dict) or None for a leaf
+            keyword_hints: Leaf name -> keywords that identify it on their own
+
+        Returns:
+            Taxonomy: The indexed tree
+        """
+        def walk(prefix: str, node) -> Iterator[str]:
+            if isinstance(node, dict):
+                for name, child in node.items():
+                    path = f"{prefix}{SEPARATOR}{name}" if prefix else name
+                    yield path
+                    yield from walk(path, child)
+            elif isinstance(node, (list, tuple)):
+                for name in node:
+                    yield f"{prefix}{SEPARATOR}{name}" if prefix else name
+
+        return cls(walk('', tree), keyword_hints=keyword_hints)
+
+    @classmethod
+    def load(cls, path: str, keyword_hints: Optional[Dict[str, List[str]]] = None) -> 'Taxonomy':
+        """
+        Load a taxonomy file.
+
+        Supported formats:
+            .json: nested dict (as for from_dict) or a list of paths
+            .csv: a path column (path, category_path, category, ...) and an optional id column
+            .txt: one "A > B > C" path per line, optionally prefixed "<id> - " (Google product
+                taxonomy format); lines starting with # are skipped
+
+        Args:
+            path: Taxonomy file
+            keyword_hints: Leaf name -> keywords that identify it on their own
+
+        Returns:
+            Taxonomy: The indexed tree
+        """
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension == '.json':
+            with open(path, encoding='utf-8') as handle:
+                data = json.load(handle)
+            if isinstance(data, dict):
+                return cls.from_dict(data, keyword_hints)
+            return cls(data, keyword_hints=keyword_hints)
+
+        paths, node_ids = [], {}
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            if extension == '.csv':
+                reader = csv.DictReader(handle)
+                fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+                path_column = next((fields[name] for name in _PATH_COLUMNS if name in fields),
+                                   (reader.fieldnames or [None])[0])
+                id_column = next((fields[name] for name in _ID_COLUMNS if name in fields), None)
+                for row in reader:
+                    node_path = SEPARATOR.join(part.strip() for part in (row.get(path_column) or '').split('>'))
+                    if node_path:
+                        paths.append(node_path)
+                        if id_column and row.get(id_column):
+                            node_ids[node_path] = row[id_column].strip()
+            else:
+                for line in handle:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    node_id, dash, rest = line.partition(' - ')
+                    if dash and node_id.strip().isdigit():
+                        line = rest
+                    node_path = SEPARATOR.join(part.strip() for part in line.split('>'))
+                    paths.append(node_path)
+                    if dash and node_id.strip().isdigit():
+                        node_ids[node_path] = node_id.strip()
+
+        return cls(paths, node_ids, keyword_hints)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: str) -> bool:
+        return path.lower() in self._lower
+
+    @property
+    def depth(self) -> int:
+        return max((path.count(SEPARATOR) + 1 for path in self.paths), default=0)
+
+    def leaf_parts(self) -> Iterator[Tuple[Tuple[str, ...], str]]:
+        """(ancestor names, leaf name) for every leaf."""
+        for path in self.leaves:
+            parts = path.split(SEPARATOR)
+            yield tuple(parts[:-1]), parts[-1]
+
+    def node_id(self, path: str) -> Optional[str]:
+        canonical = self._lower.get(path.lower())
+        return self.node_ids.get(canonical) if canonical else None
+
+    def candidates(self, text: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """
+        Leaves most likely to fit a product text, best first.
+
+        Args:
+            text: Product title, brand and description
+            limit: Maximum number of candidates
+
+        Returns:
+            List[Tuple[str, float]]: (leaf path, score); the top-level categories if nothing matched
+        """
+        tokens = set(tokenize(text))
+        scores: Dict[int, float] = defaultdict(float)
+        for token in tokens:
+            for leaf_index, weight in self._index.get(token, ()):
+                scores[leaf_index] += weight
+
+        common = [self._common[token] for token in tokens if token in self._common]
+        if common:
+            if len(scores) < limit:
+                # Too few rare matches: also rank the first leaves of the most selective common token
+                for leaf_index in itertools.islice(min(common, key=len), self.MAX_POSTINGS):
+                    scores.setdefault(leaf_index, 0.0)
+            for postings in common:
+                for leaf_index in scores:
+                    scores[leaf_index] += postings.get(leaf_index, 0.0)
+
+        if not scores:
+            return [(path, 0.0) for path in self.roots[:limit]]
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(self.leaves[leaf_index], score) for leaf_index, score in best]
+
+    def resolve(self, answer: str, candidates: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Canonical node path for an LLM answer.
+
+        Accepts any node of the tree (case-insensitively); otherwise the
+        candidate whose leaf name matches the answer's last segment.
+
+        Args:
+            answer: Raw category text from the model
+            candidates: Paths the model was asked to choose from
+
+        Returns:
+            Optional[str]: The matching path, or None
+        """
+        answer = SEPARATOR.join(part.strip() for part in answer.strip().strip('"\'.').split('>'))
+        canonical = self._lower.get(answer.lower())
+        if canonical is not None:
+            return canonical
+
+        leaf_name = answer.split(SEPARATOR)[-1].lower()
+        for path in candidates or ():
+            if path.split(SEPARATOR)[-1].lower() == leaf_name:
+                return path
+        return None
+
+    def render(self, paths: Optional[List[str]] = None) -> str:
+        """
+        Render leaves grouped under their parent ("Parent: Leaf, Leaf" lines).
+
+        Args:
+            paths: Leaves to render (defaults to the whole tree)
+
+        Returns:
+            str: Prompt text
+        """
+        grouped: Dict[str, List[str]] = {}
+        for path in self.leaves if paths is None else paths:
+            parent, _, name = path.rpartition(SEPARATOR)
+            grouped.setdefault(parent, []).append(name)
+
+        return ''.join(f"{parent}: {', '.join(names)}\n" if parent else f"{', '.join(names)}\n"
+                       for parent, names in grouped.items())
+
+def find_taxonomy_file(directory: str, marketplace: str) -> Optional[str]:
+    """Taxonomy file for a marketplace in directory (<marketplace>.json/.csv/.txt), if any."""
+    for extension in TAXONOMY_EXTENSIONS:
+        path = os.path.join(directory, f"{marketplace}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
@@ -0,0 +1,373 @@
+import os
+import re
+import csv
+import sys
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b'JTMPL001'
+
+# magic, source size, source mtime (ns), source digest, field count, string count, then section offsets
+_HEADER = struct.Struct('<8sQQ16sIIQQQ')
+# name, label and group string refs, min_values, first allowed value, allowed value count
+_FIELD = struct.Struct('<IIIHII')
+_REF = struct.Struct('<I')
+_STRING = struct.Struct('<II')
+
+# Offset of the source size / mtime pair inside the header, patched in place when only the mtime moved
+_STAT_OFFSET = 8
+_STAT = struct.Struct('<QQ')
+
+# Walmart workbook layout
+_CONTENT_SHEET = 'Product Content And Site Exp'
+_HIDDEN_SHEET = 'Hidden_product_content_and_sit'
+_DEFINITIONS_SHEET = 'Data Definitions'
+_VALID_VALUES_HEADER = 'valid values header'
+
+# "Key Features 2 (+)" -> "Key Features"
+_LABEL_SUFFIX_RE = re.compile(r'(\s+\d+)?\s*(\(\+\))?\s*$')
+
+_loaded: Dict[str, Tuple[int, int, 'CompiledTemplate']] = {}
+_loaded_lock = threading.Lock()
+
+def default_cache_dir() -> str:
+    return os.getenv('TEMPLATE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'jadoo_templates')
+
+def _digest(path: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def _base_label(label: str) -> str:
+    return _LABEL_SUFFIX_RE.sub('', label or '')
+
+def _min_values(value) -> int:
+    try:
+        return max(0, int(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+def _read_csv_template(path: str) -> List[Dict]:
+    """Fields of a CSV template: its header row, with no requirement data."""
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        headers = next(csv.reader(handle), [])
+    return [{'name': header.strip(), 'label': header.strip(), 'group': '', 'min_values': 0, 'allowed_values': []}
+            for header in headers if header and header.strip()]
+
+def _load_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("openpyxl is required to compile XLSX templates (pip install openpyxl)")
+    return openpyxl
+
+def _read_xlsx_template(path: str) -> List[Dict]:
+    """
+    Fields of a Walmart category workbook, in upload column order.
+
+    Column order, keys and display names come from the content sheet; valid
+    values from the hidden sheet; minimum value counts from Data Definitions.
+    A column is required (min_values >= 1) when it sits under a "Required ..."
+    section or is one of the leading SKU / product type columns.
+    """
+    openpyxl = _load_openpyxl()
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        content = list(workbook[_CONTENT_SHEET].iter_rows(max_row=4, values_only=True))
+        hidden = list(workbook[_HIDDEN_SHEET].iter_rows(values_only=True)) if _HIDDEN_SHEET in workbook.sheetnames else []
+        definitions = {}
+        if _DEFINITIONS_SHEET in workbook.sheetnames:
+            for row in workbook[_DEFINITIONS_SHEET].iter_rows(min_row=2, values_only=True):
+                if row and row[0] and len(row) > 6:
+                    definitions[str(row[0]).strip()] = _min_values(row[6])
+    finally:
+        workbook.close()
+
+    # Hidden sheet columns: ColHeader / Attribute Name / XML Name rows, valid values listed under a ColHeader further down
+    allowed = {}
+    candidates: Dict[Tuple[str, str], List[str]] = {}
+    if len(hidden) >= 3:
+        col_headers, attribute_names, xml_names = hidden[0], hidden[1], hidden[2]
+        for column in range(1, len(col_headers)):
+            if xml_names[column]:
+                key = (str(xml_names[column]), _base_label(str(attribute_names[column] or '')))
+                candidates.setdefault(key, []).append(str(col_headers[column]))
+
+        start = next((index for index, row in enumerate(hidden) if row and row[0] == _VALID_VALUES_HEADER), None)
+        if start is not None:
+            for column, header in enumerate(hidden[start]):
+                if column == 0 or not header:
+                    continue
+                values = []
+                for row in hidden[start + 1:]:
+                    if column >= len(row) or row[column] is None:
+                        break
+                    values.append(str(row[column]).strip())
+                allowed[str(header)] = values
+
+    sections, _, labels, keys = (list(row) + [None] * (len(content[3]) - len(row)) for row in content[:4])
+    fields = []
+    section = ''
+    for position, key in enumerate(keys):
+        if not key:
+            continue
+        label = str(labels[position] or sections[position] or key).strip()
+        if labels[position] is None and sections[position]:
+            # Leading identifier columns carry their name in the section row
+            group, required = 'Required', True
+        else:
+            section = str(sections[position] or section)
+            group, required = section, section.startswith('Required')
+
+        # Measure / Unit pairs share one key and label across attributes; only keep values they all agree on
+        lists = [allowed.get(col_header, []) for col_header in candidates.get((str(key), _base_label(label)), [])]
+        values = lists[0] if lists and all(values == lists[0] for values in lists) else []
+
+        min_values = definitions.get(_base_label(label), 0)
+        fields.append({
+            'name': str(key),
+            'label': label,
+            'group': group,
+            'min_values': max(min_values, 1) if required else min_values,
+            'allowed_values': values,
+        })
+    return fields
+
+def read_template(path: str) -> List[Dict]:
+    """
+    Parse a template source file.
+
+    Args:
+        path: Walmart category workbook (.xlsx) or CSV header template
+
+    Returns:
+        List[Dict]: Fields in column order with name, label, group, min_values and allowed_values
+    """
+    if path.lower().endswith('.csv'):
+        return _read_csv_template(path)
+    return _read_xlsx_template(path)
+
+def _build(fields: Iterable[Dict], source_size: int, source_mtime_ns: int, source_digest: bytes) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def ref(text: str) -> int:
+        return strings.setdefault(text, len(strings))
+
+    field_rows = []
+    value_refs = []
+    for field in fields:
+        values = field.get('allowed_values') or []
+        field_rows.append((ref(field['name']), ref(field.get('label') or field['name']), ref(field.get('group') or ''),
+                           min(int(field.get('min_values') or 0), 0xFFFF), len(value_refs), len(values)))
+        value_refs.extend(ref(str(value)) for value in values)
+
+    encoded = [text.encode('utf-8') for text in strings]
+    fields_at = _HEADER.size
+    values_at = fields_at + len(field_rows) * _FIELD.size
+    strings_at = values_at + len(value_refs) * _REF.size
+
+    blob = bytearray(_HEADER.pack(MAGIC, source_size, source_mtime_ns, source_digest, len(field_rows), len(encoded),
+                                  fields_at, values_at, strings_at))
+    for row in field_rows:
+        blob += _FIELD.pack(*row)
+    for value in value_refs:
+        blob += _REF.pack(value)
+    offset = 0
+    for data in encoded:
+        blob += _STRING.pack(offset, len(data))
+        offset += len(data)
+    for data in encoded:
+        blob += data
+
+    return bytes(blob)
+
+class CompiledTemplate:
+    """
+    Read-only view over a compiled marketplace template.
+
+    The compiled form (see compile_template) is a header stamped with the
+    source's size, mtime and digest, a fixed-width field table in column
+    order, allowed-value references and a deduplicated string table, so a
+    template is memory-mapped and queried without touching the workbook.
+    """
+
+    def __init__(self, buffer, source: Optional[str] = None):
+        self._buffer = buffer
+        self.source = source
+
+        magic, self.source_size, self.source_mtime_ns, self.source_digest, self._count, self._strings, \
+            self._fields_at, self._values_at, self._strings_at = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a compiled template: {source or 'buffer'}")
+
+        self._fields: Optional[List[Dict]] = None
+        self._index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def open(cls, path: str, source: Optional[str] = None) -> 'CompiledTemplate':
+        """Memory-map a compiled template file."""
+        with open(path, 'rb') as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, source=source or path)
+
+    def _string(self, index: int) -> str:
+        offset, length = _STRING.unpack_from(self._buffer, self._strings_at + index * _STRING.size)
+        start = self._strings_at + self._strings * _STRING.size + offset
+        return bytes(self._buffer[start:start + length]).decode('utf-8')
+
+    @property
+    def fields(self) -> List[Dict]:
+        """Fields in column order (decoded once, on first access)."""
+        if self._fields is None:
+            fields = []
+            for position in range(self._count):
+                name, label, group, min_values, values_start, values_count = \
+                    _FIELD.unpack_from(self._buffer, self._fields_at + position * _FIELD.size)
+                values = [self._string(_REF.unpack_from(self._buffer, self._values_at + index * _REF.size)[0])
+                          for index in range(values_start, values_start + values_count)]
+                fields.append({
+                    'name': self._string(name),
+                    'label': self._string(label),
+                    'group': self._string(group),
+                    'min_values': min_values,
+                    'required': min_values > 0,
+                    'allowed_values': values,
+                })
+            self._fields = fields
+        return self._fields
+
+    @property
+    def columns(self) -> List[str]:
+        return [field['name'] for field in self.fields]
+
+    @property
+    def labels(self) -> List[str]:
+        return [field['label'] for field in self.fields]
+
+    @property
+    def required_columns(self) -> List[str]:
+        return [field['name'] for field in self.fields if field['required']]
+
+    def field(self, name: str) -> Optional[Dict]:
+        """First field with this key or display label."""
+        if self._index is None:
+            index = {}
+            for position, field in enumerate(self.fields):
+                index.setdefault(field['name'], position)
+                index.setdefault(field['label'], position)
+            self._index = index
+        position = self._index.get(name)
+        return self.fields[position] if position is not None else None
+
+    def allowed_values(self, name: str) -> List[str]:
+        field = self.field(name)
+        return list(field['allowed_values']) if field else []
+
+    def __len__(self) -> int:
+        return self._count
+
+def compile_template(source_path: str, output_path: str) -> int:
+    """
+    Compile a template source into the binary template format.
+
+    Args:
+        source_path: Template workbook or CSV
+        output_path: Destination file (written atomically)
+
+    Returns:
+        int: Number of compiled fields
+    """
+    stat = os.stat(source_path)
+    fields = read_template(source_path)
+    blob = _build(fields, stat.st_size, stat.st_mtime_ns, _digest(source_path))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as handle:
+        handle.write(blob)
+    os.replace(tmp_path, output_path)
+    return len(fields)
+
+def compiled_path(source_path: str, cache_dir: Optional[str] = None) -> str:
+    """Location of the compiled form of a template (one file per source path)."""
+    source_path = os.path.abspath(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    suffix = hashlib.blake2b(source_path.encode('utf-8'), digest_size=6).hexdigest()
+    return os.path.join(cache_dir or default_cache_dir(), f"{stem}-{suffix}.tpl")
+
+def _is_current(target: str, source_path: str, stat: os.stat_result) -> bool:
+    """
+    Check a compiled template against its source.
+
+    Size and mtime are compared first; if only the mtime moved (checkout,
+    copy) the source digest decides, and a match re-stamps the header.
+    """
+    try:
+        with open(target, 'rb') as handle:
+            header = handle.read(_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+
+    magic, size, mtime_ns, digest = _HEADER.unpack_from(header, 0)[:4]
+    if magic != MAGIC or size != stat.st_size:
+        return False
+    if mtime_ns == stat.st_mtime_ns:
+        return True
+    if digest != _digest(source_path):
+        return False
+
+    try:
+        with open(target, 'r+b') as handle:
+            handle.seek(_STAT_OFFSET)
+            handle.write(_STAT.pack(stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        pass
+    return True
+
+def load_template(source_path: str, cache_dir: Optional[str] = None) -> CompiledTemplate:
+    """
+    Open a template, compiling it on first use.
+
+    The compiled form lives in TEMPLATE_CACHE_DIR (default: a jadoo_templates
+    directory under the system temp dir) and is rebuilt whenever the source
+    changes; loaded templates are also kept per process until their source
+    is modified.
+
+    Args:
+        source_path: Template workbook or CSV
+        cache_dir: Directory for compiled templates
+
+    Returns:
+        CompiledTemplate: Memory-mapped template
+    """
+    source_path = os.path.abspath(source_path)
+    stat = os.stat(source_path)
+
+    with _loaded_lock:
+        cached = _loaded.get(source_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        target = compiled_path(source_path, cache_dir)
+        if not _is_current(target, source_path, stat):
+            compile_template(source_path, target)
+        template = CompiledTemplate.open(target, source=source_path)
+        _loaded[source_path] = (stat.st_size, stat.st_mtime_ns, template)
+        return template
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m server.utils.template_cache <template.xlsx|template.csv> [...]")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        template = load_template(path)
+        print(f"{path}: {len(template)} fields, {len(template.required_columns)} required -> {compiled_path(path)}")
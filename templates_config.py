@@ -1,8 +1,11 @@
+import os
+
 MARKETPLACES = {
     "amazon": {
         "name": "Amazon Seller Central",
         "columns": ["item_sku", "external_product_id", "external_product_id_type", "item_name", "brand_name", "manufacturer"],
         "endpoint": "/transform-to-amazon",
+        "template_dir": "attached_assets/templates/amazon",
         "color": "#ff9900",
         "hover_color": "#e88a00"
     },
@@ -10,6 +13,7 @@ MARKETPLACES = {
         "name": "Walmart Marketplace",
         "columns": ["sku", "productIdType", "productId", "productName", "brand", "price"],
         "endpoint": "/transform-to-walmart",
+        "template_dir": "attached_assets/templates/walmart",
         "color": "#0071ce",
         "hover_color": "#004c91"
     },
@@ -42,3 +46,30 @@ MARKETPLACES = {
         "hover_color": "#333333"
     }
 }
+
+TEMPLATE_EXTENSIONS = (".xlsx", ".csv")
+
+def template_path(marketplace, category="base"):
+    """Source template for a marketplace category, falling back to the marketplace's base template."""
+    template_dir = MARKETPLACES.get(marketplace, {}).get("template_dir")
+    if not template_dir:
+        return None
+    template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), template_dir)
+    # Categories come from requests; anything that is not a plain file name ('../x', 'a/b', '.hidden') could
+    # reach outside the template directory, so it gets the base template
+    names = ["base"]
+    if category and category == os.path.basename(category) and not category.startswith(".") and "\\" not in category:
+        names.insert(0, category)
+    for name in names:
+        for extension in TEMPLATE_EXTENSIONS:
+            path = os.path.join(template_dir, f"{name}{extension}")
+            if os.path.exists(path):
+                return path
+    return None
+
+def get_template(marketplace, category="base"):
+    """Compiled (memory-mapped) template for a marketplace category, or None if it has none."""
+    from server.utils.template_cache import load_template
+
+    path = template_path(marketplace, category)
+    return load_template(path) if path else None